@@ -1,15 +1,31 @@
-from flask import Flask, request, jsonify
+from flask import Blueprint, Flask, current_app, request, jsonify
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
+from datetime import datetime, timezone
 import os
+import uuid
 from dotenv import load_dotenv
+from storage import configure as configure_database, create_schema, describe
+from pagination import PaginationError, parse_limit, parse_fields, fetch_page
+from bulk_import import ImportFormatError, detect_format, iter_records, import_records
+from search import SearchError, parse_search_args, boolean_query, rows_by_ids
+from response_cache import (ResponseCache, ensure_version_table, bump_version,
+                            cached_json, current_version)
+from occupancy import Occupancy
+from events import EventFeed, MAX_EVENT_VISITORS, stream_response
+from auto_checkout import DailyCheckout, closing_time, last_cutoff
+from encoding import FastJSONProvider
+from outbox import CHECKIN, CHECKOUT, KIOSK_OUTBOX, Outbox, upsert_new
+from metrics import Gauge, instrument, phase
+import rollups
+from rollups import RollupDelta, StatsError, ensure_rollup_tables, parse_range
+import archive
+from archive import ArchiveError, archive_table, ensure_archive_table, parse_tier, search_tiers, tier_sources
+from sqlalchemy import insert, or_, text, update
+from werkzeug.http import http_date
 
 load_dotenv()
 
-app = Flask(__name__)
-CORS(app)
-
 # ============================================================
 # DATABASE CONFIGURATION (DOCKER READY)
 # ============================================================
@@ -19,18 +35,14 @@ DB_USER = os.getenv("DB_USER", "root")
 DB_PASSWORD = os.getenv("DB_PASSWORD", "root")
 DB_NAME = os.getenv("DB_NAME", "visitors")
 
-DATABASE_URL = f"mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:3306/{DB_NAME}"
-
-app.config["SQLALCHEMY_DATABASE_URI"] = DATABASE_URL
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+# DATABASE_URL overrides the DB_* settings; pooling is set up in storage.py
+DEFAULT_DATABASE_URL = f"mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:3306/{DB_NAME}"
 
-db = SQLAlchemy(app)
+# Bound to the app in create_app(); nothing connects to MySQL until a request needs it
+db = SQLAlchemy()
 
-print("\n" + "="*60)
-print("🚀 Connected to MySQL")
-print(f"Host: {DB_HOST}")
-print(f"Database: {DB_NAME}")
-print("="*60 + "\n")
+# Routes are registered on the app by create_app()
+api = Blueprint("visitors", __name__)
 
 # ============================================================
 # DATABASE MODEL
@@ -38,6 +50,19 @@ print("="*60 + "\n")
 
 class Visitor(db.Model):
     __tablename__ = "visitors"
+    __table_args__ = (
+        # Keyset pagination walks this index newest first
+        db.Index("ix_visitors_check_in_id", "check_in", "id"),
+        # Search: FULLTEXT on MySQL, phone prefixes as a range scan
+        db.Index("ix_visitors_fulltext", "name", "purpose", mysql_prefix="FULLTEXT"),
+        db.Index("ix_visitors_phone", "phone"),
+        # Open visits (check_out IS NULL) for the live occupancy list
+        db.Index("ix_visitors_open", "check_out", "id"),
+        # Kiosk-generated ids; the outbox upserts by it (outbox.py)
+        db.Index("ux_visitors_client_id", "client_id", unique=True),
+        # Ids of archived visits (archive.py) are never handed out again
+        {"sqlite_autoincrement": True},
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
@@ -45,6 +70,7 @@ class Visitor(db.Model):
     purpose = db.Column(db.String(255))
     check_in = db.Column(db.DateTime, default=datetime.utcnow)
     check_out = db.Column(db.DateTime, nullable=True)
+    client_id = db.Column(db.String(36), nullable=True)
 
     def to_dict(self):
         return {
@@ -54,63 +80,719 @@ class Visitor(db.Model):
             "purpose": self.purpose,
             "check_in": self.check_in,
             "check_out": self.check_out,
+            "client_id": self.client_id,
         }
 
-# ============================================================
-# CREATE TABLES
-# ============================================================
+# Rules shared by single and bulk check-in
+REQUIRED_FIELDS = ["name"]
+
+
+def validate_visitor(data):
+    """Error message for a visitor missing a required field, else None"""
+    for field in REQUIRED_FIELDS:
+        if not data.get(field):
+            return f"{field} is required"
+    return None
+
+
+def parse_client_id(data):
+    """The kiosk's id for a check-in, or a new one"""
+    client_id = data.get("client_id") or str(uuid.uuid4())
+    if not isinstance(client_id, str) or len(client_id) > 36:
+        raise ValueError("client_id must be a string of at most 36 characters")
+    return client_id
+
+# Who is inside right now; see occupancy.py
+occupancy = Occupancy()
+
+OPEN_VISIT_COLUMNS = ("id", "name", "phone", "purpose", "check_in")
+
+
+def open_visit(row):
+    return dict(zip(OPEN_VISIT_COLUMNS, row))
+
+
+def load_occupancy():
+    """Reload the open visits from the DB (an index range scan)"""
+    version = current_version(db.session)[0]
+    rows = (db.session.query(*[getattr(Visitor, c) for c in OPEN_VISIT_COLUMNS])
+            .filter(Visitor.check_out.is_(None)))
+    occupancy.load([open_visit(row) for row in rows], version)
+    db.session.commit()
 
-with app.app_context():
-    db.create_all()
-    print("✅ Tables created successfully")
+
+def current_occupancy():
+    """The occupancy set, reloaded only if another worker wrote since our last sync"""
+    if not occupancy.is_current(current_version(db.session)[0]):
+        load_occupancy()
+    return occupancy
+
+def backfill_rollups(chunk_size=rollups.BACKFILL_CHUNK):
+    """Rebuild the analytics rollups from all visits (python rollups.py backfill --app app)"""
+    # Holding the data_version row makes writers wait until the rebuild commits
+    archived = archive_table(Visitor).c
+    return rollups.backfill(db.session, Visitor.id, Visitor.check_in, Visitor.purpose,
+                            Visitor.check_out, chunk_size=chunk_size, lock=bump_version,
+                            archive=(archived.id, archived.check_in, archived.purpose,
+                                     archived.check_out))
+
+
+def archive_visits(days=archive.ARCHIVE_AFTER_DAYS, chunk_size=archive.ARCHIVE_CHUNK):
+    """Move closed visits that checked in more than `days` ago to the archive table"""
+    return archive.archive_old(db.session, Visitor, Visitor.check_in, archive.cutoff_for(days),
+                               chunk_size=chunk_size, where=(Visitor.check_out.isnot(None),),
+                               lock=bump_version)
+
+# Fields a client may ask for with ?fields=
+VISITOR_FIELDS = ["id", "name", "phone", "purpose", "check_in", "check_out", "client_id"]
+
+# Timestamps go out as the HTTP dates Flask has always written for them
+VISITOR_FORMATTERS = {"check_in": http_date, "check_out": http_date}
 
 # ============================================================
 # ROUTES
 # ============================================================
 
-@app.route("/")
+# Serialized list/search responses, keyed by data version and URL
+response_cache = ResponseCache()
+
+# Change deltas for GET /visitors/stream; see events.py
+visitor_feed = EventFeed()
+
+
+def version_reader(flask_app):
+    """Data version reader for the event stream, which outlives its request's app context"""
+    def read():
+        with flask_app.app_context():
+            return current_version(db.session)[0]
+    return read
+
+@api.route("/")
 def home():
     return jsonify({"message": "Visitor Management System Backend Running"})
 
 
-@app.route("/add_visitor", methods=["POST"])
+@api.route("/add_visitor", methods=["POST"])
 def add_visitor():
-    data = request.get_json()
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Request body must be a JSON object"}), 400
+    # Checked before either path, so both reject a bad visitor the same way
+    error = validate_visitor(data)
+    if error:
+        return jsonify({"error": error}), 400
+    try:
+        client_id = parse_client_id(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-    new_visitor = Visitor(
-        name=data.get("name"),
-        phone=data.get("phone"),
-        purpose=data.get("purpose"),
-    )
+    if outbox is not None:
+        outbox.add(CHECKIN, client_id, {"client_id": client_id, "name": data.get("name"),
+                                        "phone": data.get("phone"), "purpose": data.get("purpose")})
+        return jsonify({"message": "Visitor check-in accepted", "client_id": client_id}), 202
 
-    db.session.add(new_visitor)
-    db.session.commit()
+    try:
+        # A kiosk retrying a check-in that already went through
+        if db.session.scalar(db.select(Visitor.id).where(Visitor.client_id == client_id)) is not None:
+            return jsonify({"message": "Visitor already added", "client_id": client_id})
+
+        new_visitor = Visitor(
+            name=data.get("name"),
+            phone=data.get("phone"),
+            purpose=data.get("purpose"),
+            client_id=client_id,
+        )
+
+        db.session.add(new_visitor)
+        version = bump_version(db.session)
+        # Flushed by bump_version, so id/check_in are set; read before commit expires them
+        visit = open_visit([getattr(new_visitor, c) for c in OPEN_VISIT_COLUMNS])
+        created = new_visitor.to_dict()
+        delta = RollupDelta()
+        delta.visit(visit["check_in"], visit["purpose"])
+        delta.apply(db.session)
+        with phase("db_commit"):
+            db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
+    occupancy.check_in([visit], version)
+    visitor_feed.publish(version, "insert", {"visitors": [created]})
+
+    return jsonify({"message": "Visitor added successfully", "client_id": client_id}), 201
 
-    return jsonify({"message": "Visitor added successfully"}), 201
 
+@api.route("/add_visitor/bulk", methods=["POST"])
+def bulk_add_visitors():
+    """Import many visitors from a JSON, NDJSON, CSV or XLSX upload"""
+    upload = request.files.get("file")
+    delta = RollupDelta()
 
-@app.route("/visitors", methods=["GET"])
+    def insert_chunk(records):
+        # check_in is set here so the rollups count the same time the row gets
+        now = datetime.utcnow()
+        # One executemany per chunk, all inside the request's transaction
+        db.session.execute(insert(Visitor), [
+            {"name": r["name"], "phone": r.get("phone"), "purpose": r.get("purpose"),
+             "check_in": now}
+            for r in records
+        ])
+        for r in records:
+            delta.visit(now, r.get("purpose"))
+
+    try:
+        if upload:
+            fmt = detect_format(upload.mimetype, upload.filename, request.args.get("format"))
+            stream = upload.stream
+        else:
+            fmt = detect_format(request.mimetype, explicit=request.args.get("format"))
+            stream = request.stream
+        report = import_records(iter_records(stream, fmt), validate_visitor, insert_chunk)
+        version = bump_version(db.session)
+        delta.apply(db.session)
+        with phase("db_commit"):
+            db.session.commit()
+    except ImportFormatError as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
+
+    # executemany does not hand back ids here; reload on the next read
+    occupancy.invalidate()
+    if report["inserted"]:
+        visitor_feed.publish(version, "reset", {})
+
+    report["message"] = f"{report['inserted']} visitors added successfully"
+    return jsonify(report), 201 if report["inserted"] else 400
+
+
+@api.route("/visitors", methods=["GET"])
 def get_visitors():
-    visitors = Visitor.query.all()
-    return jsonify([v.to_dict() for v in visitors])
+    """List visitors newest first, one page at a time (?limit=&cursor=&fields=&tier=)"""
+    try:
+        limit = parse_limit(request.args.get("limit"))
+        fields = parse_fields(request.args.get("fields"), VISITOR_FIELDS)
+        tier = parse_tier(request.args)
+
+        def build():
+            visitors, next_cursor = fetch_page(
+                db.session, Visitor, "check_in", fields, limit,
+                cursor=request.args.get("cursor"),
+                formatters=VISITOR_FORMATTERS,
+                sources=tier_sources(Visitor, tier),
+            )
+            return {"visitors": visitors, "next_cursor": next_cursor}
+
+        # 304 for unchanged polls; cached body for repeat queries
+        return cached_json(db.session, response_cache, build)
+    except (PaginationError, ArchiveError) as e:
+        return jsonify({"error": str(e)}), 400
+
+
+@api.route("/visitors/stream", methods=["GET"])
+def stream_visitors():
+    """Server-sent events: insert/checkout deltas as they are committed"""
+    return stream_response(visitor_feed, version_reader(current_app._get_current_object()))
+
+
+@api.route("/visitors/search", methods=["GET"])
+def search_visitors():
+    """Ranked search: ?q=<words>&phone=<digits prefix>&limit=&offset=&tier="""
+    try:
+        q, phone, phone_match, limit, offset = parse_search_args(request.args)
+        fields = parse_fields(request.args.get("fields"), VISITOR_FIELDS)
+        tier = parse_tier(request.args)
+    except (SearchError, PaginationError, ArchiveError) as e:
+        return jsonify({"error": str(e)}), 400
+    if phone and phone_match != "prefix":
+        return jsonify({"error": "only phone prefix search is indexed here"}), 400
+    if q and db.engine.dialect.name != "mysql":
+        return jsonify({"error": "text search needs the MySQL FULLTEXT index"}), 501
+
+    def build():
+        return search_page(q, phone, fields, limit, offset, tier)
+
+    return cached_json(db.session, response_cache, build)
+
+
+def search_ids(source, q, phone, limit, offset):
+    """Ranked ids from one tier (the model, or the archive table's columns)"""
+    query = db.session.query(source.id)
+    if q:
+        match = "MATCH (name, purpose) AGAINST (:q IN BOOLEAN MODE)"
+        query = (query.filter(text(match))
+                 .order_by(text(f"{match} DESC"), source.id.desc())
+                 .params(q=boolean_query(q)))
+    else:
+        query = query.order_by(source.check_in.desc(), source.id.desc())
+    if phone:
+        query = query.filter(source.phone.like(f"{phone}%"))
+    return [row.id for row in query.offset(offset).limit(limit)]
+
 
+def search_page(q, phone, fields, limit, offset, tier="live"):
+    """One page of ranked search results from one tier or both (live matches first)"""
+    sources = tier_sources(Visitor, tier)
+    if len(sources) == 1:
+        ids = search_ids(sources[0], q, phone, limit + 1, offset)
+        has_more = len(ids) > limit
+        ids = ids[:limit]
+    else:
+        ids, has_more = search_tiers(
+            lambda source, count: search_ids(source, q, phone, count, 0),
+            sources, limit, offset)
+    return {
+        "visitors": rows_by_ids(db.session, Visitor, fields, ids, VISITOR_FORMATTERS,
+                                sources=sources),
+        "next_offset": offset + limit if has_more else None,
+    }
 
-@app.route("/checkout/<int:visitor_id>", methods=["PUT"])
+
+@api.route("/checkout/<int:visitor_id>", methods=["PUT"])
 def checkout(visitor_id):
-    visitor = Visitor.query.get(visitor_id)
+    if outbox is not None:
+        outbox.add(CHECKOUT, f"id:{visitor_id}", {"id": visitor_id})
+        return jsonify({"message": "Visitor checkout accepted"}), 202
 
-    if not visitor:
-        return jsonify({"error": "Visitor not found"}), 404
+    # One UPDATE, no separate lookup; only an open visit can be closed
+    now = datetime.utcnow()
+    closed = db.session.execute(
+        update(Visitor)
+        .where(Visitor.id == visitor_id, Visitor.check_out.is_(None))
+        .values(check_out=now)
+    ).rowcount
 
-    visitor.check_out = datetime.utcnow()
-    db.session.commit()
+    if not closed:
+        db.session.rollback()
+        if db.session.get(Visitor, visitor_id) is None:
+            return jsonify({"error": "Visitor not found"}), 404
+        return jsonify({"message": "Visitor already checked out"})
+
+    version = bump_version(db.session)
+    # The row is locked by the UPDATE, so this read matches what was closed
+    check_in, purpose = db.session.execute(
+        db.select(Visitor.check_in, Visitor.purpose).where(Visitor.id == visitor_id)
+    ).one()
+    if check_in is not None:
+        delta = RollupDelta()
+        delta.stay(check_in, purpose, rollups.stay_seconds(check_in, now))
+        delta.apply(db.session)
+    with phase("db_commit"):
+        db.session.commit()
+    occupancy.check_out([visitor_id], version)
+    visitor_feed.publish(version, "checkout", {"visitors": [{"id": visitor_id, "check_out": now}]})
 
     return jsonify({"message": "Visitor checked out successfully"})
 
 
+@api.route("/checkout/client/<client_id>", methods=["PUT"])
+def checkout_by_client_id(client_id):
+    """Check out by the kiosk's id, e.g. before the check-in has reached the DB"""
+    if outbox is not None:
+        outbox.add(CHECKOUT, f"client:{client_id}", {"client_id": client_id})
+        return jsonify({"message": "Visitor checkout accepted"}), 202
+
+    try:
+        closed = close_visits([Visitor.client_id == client_id])
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
+    if closed:
+        return jsonify({"message": "Visitor checked out successfully"})
+    if db.session.scalar(db.select(Visitor.id).where(Visitor.client_id == client_id)) is None:
+        return jsonify({"error": "Visitor not found"}), 404
+    return jsonify({"message": "Visitor already checked out"})
+
+
+# Most ids accepted by one bulk checkout, and per UPDATE statement
+MAX_BATCH_CHECKOUT = 1000
+
+# Attempts when another writer changes the selected visits first (SQLite)
+CHECKOUT_ATTEMPTS = 3
+
+
+class CheckoutError(ValueError):
+    """Raised for a bad bulk checkout request"""
+
+
+def parse_checkout_filter(raw):
+    """
+    Conditions for {"filter": {...}}: purpose (exact), checked_in_before
+    and checked_in_after (ISO timestamps, UTC). {} matches every open visit.
+    """
+    if not isinstance(raw, dict):
+        raise CheckoutError("filter must be an object")
+    unknown = set(raw) - {"purpose", "checked_in_before", "checked_in_after"}
+    if unknown:
+        raise CheckoutError(f"unknown filter: {', '.join(sorted(unknown))}")
+    where = []
+    if raw.get("purpose"):
+        where.append(Visitor.purpose == raw["purpose"])
+    for name in ("checked_in_before", "checked_in_after"):
+        if not raw.get(name):
+            continue
+        try:
+            moment = datetime.fromisoformat(raw[name])
+        except (TypeError, ValueError):
+            raise CheckoutError(f"{name} must be an ISO timestamp")
+        if moment.tzinfo is not None:
+            # Stored timestamps are naive UTC
+            moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+        if name == "checked_in_before":
+            where.append(Visitor.check_in < moment)
+        else:
+            where.append(Visitor.check_in >= moment)
+    return where
+
+
+def close_visits(where, check_out_for=None):
+    """
+    Check out every open visit matching where: one UPDATE per checkout time
+    (and MAX_BATCH_CHECKOUT ids), one transaction, one data version. The
+    rollups, occupancy set and event stream get the whole batch at once.
+    check_out_for(row) picks each visit's checkout time (None: now); a row
+    has id, check_in, purpose and client_id. Returns the ids closed.
+    """
+    for _ in range(CHECKOUT_ATTEMPTS):
+        now = datetime.utcnow()
+        # Locked on MySQL, so the UPDATEs close exactly these
+        rows = db.session.execute(
+            db.select(Visitor.id, Visitor.check_in, Visitor.purpose, Visitor.client_id)
+            .where(Visitor.check_out.is_(None), *where)
+            .with_for_update()
+        ).all()
+        if not rows:
+            db.session.rollback()
+            return []
+
+        by_time = {}
+        for row in rows:
+            when = (check_out_for(row) if check_out_for else None) or now
+            by_time.setdefault(when, []).append(row)
+        closed = 0
+        for when, group in by_time.items():
+            for start in range(0, len(group), MAX_BATCH_CHECKOUT):
+                ids = [row.id for row in group[start:start + MAX_BATCH_CHECKOUT]]
+                closed += db.session.execute(
+                    update(Visitor)
+                    .where(Visitor.id.in_(ids), Visitor.check_out.is_(None))
+                    .values(check_out=when)
+                    .execution_options(synchronize_session=False)
+                ).rowcount
+        if closed == len(rows):
+            break
+        # SQLite: another writer got in between the read and the write
+        db.session.rollback()
+    else:
+        raise RuntimeError("visits kept changing during checkout, try again")
+
+    version = bump_version(db.session)
+    delta = RollupDelta()
+    for when, group in by_time.items():
+        for row in group:
+            if row.check_in is not None:
+                delta.stay(row.check_in, row.purpose, rollups.stay_seconds(row.check_in, when))
+    delta.apply(db.session)
+    with phase("db_commit"):
+        db.session.commit()
+
+    ids = [row.id for row in rows]
+    occupancy.check_out(ids, version)
+    if len(ids) > MAX_EVENT_VISITORS:
+        visitor_feed.publish(version, "reset", {})
+    else:
+        visitor_feed.publish(version, "checkout", {"visitors": [
+            {"id": row.id, "check_out": when} for when, group in by_time.items() for row in group
+        ]})
+    return ids
+
+
+@api.route("/checkout/bulk", methods=["PUT"])
+def bulk_checkout():
+    """Check out many visitors at once: {"ids": [1, 2, 3]} or {"filter": {...}}"""
+    data = request.get_json(silent=True) or {}
+    try:
+        if "ids" in data:
+            ids = data["ids"]
+            if not isinstance(ids, list) or not ids:
+                raise CheckoutError("ids must be a non-empty list")
+            if len(ids) > MAX_BATCH_CHECKOUT:
+                raise CheckoutError(f"at most {MAX_BATCH_CHECKOUT} ids per request")
+            try:
+                ids = {int(visitor_id) for visitor_id in ids}
+            except (TypeError, ValueError):
+                raise CheckoutError("ids must be numbers")
+            where = [Visitor.id.in_(ids)]
+        elif "filter" in data:
+            where = parse_checkout_filter(data["filter"])
+        else:
+            raise CheckoutError("send ids or filter")
+    except CheckoutError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        closed = close_visits(where)
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
+
+    response = {
+        "message": f"{len(closed)} visitors checked out successfully",
+        "checked_out": sorted(closed),
+    }
+    if "ids" in data:
+        # Unknown ids and visits that were already closed
+        response["not_open"] = sorted(ids - set(closed))
+    return jsonify(response)
+
+
+def auto_checkout(cutoff):
+    """Close visits still open from before cutoff, each at the end of its own day"""
+    return close_visits([Visitor.check_in < cutoff],
+                        check_out_for=lambda row: row.check_in and min(
+                            closing_time(row.check_in, auto_checkouts.at), cutoff))
+
+
+# End-of-day auto-checkout (AUTO_CHECKOUT_AT); see auto_checkout.py
+auto_checkouts = DailyCheckout(auto_checkout)
+
+
+@api.before_app_request
+def start_auto_checkout():
+    auto_checkouts.ensure_started(current_app._get_current_object())
+
+
+# ============================================================
+# KIOSK OUTBOX (KIOSK_OUTBOX; see outbox.py)
+# ============================================================
+
+def record_checkins(entries):
+    """
+    Insert buffered check-ins by client id, in one transaction and data
+    version. Visits already in the DB (a batch replayed after its commit)
+    are left alone and not counted again. Returns the new visits' ids.
+    """
+    visits = {}
+    for entry in entries:
+        visits.setdefault(entry.payload["client_id"], dict(entry.payload, check_in=entry.accepted_at))
+    # Locked on MySQL, so a replay running at the same time waits here
+    existing = set(db.session.scalars(
+        db.select(Visitor.client_id).where(Visitor.client_id.in_(visits)).with_for_update()
+    ))
+    new = [visit for client_id, visit in visits.items() if client_id not in existing]
+    if not new:
+        db.session.rollback()
+        return []
+
+    db.session.execute(upsert_new(Visitor.__table__, new, "client_id", db.engine.dialect.name))
+    version = bump_version(db.session)
+    rows = db.session.execute(
+        db.select(*[getattr(Visitor, c) for c in OPEN_VISIT_COLUMNS], Visitor.client_id)
+        .where(Visitor.client_id.in_([visit["client_id"] for visit in new]))
+    ).all()
+    delta = RollupDelta()
+    for row in rows:
+        delta.visit(row.check_in, row.purpose)
+    delta.apply(db.session)
+    with phase("db_commit"):
+        db.session.commit()
+
+    occupancy.check_in([open_visit(row[:len(OPEN_VISIT_COLUMNS)]) for row in rows], version)
+    if len(rows) > MAX_EVENT_VISITORS:
+        visitor_feed.publish(version, "reset", {})
+    else:
+        visitor_feed.publish(version, "insert", {"visitors": [
+            dict(open_visit(row[:len(OPEN_VISIT_COLUMNS)]), check_out=None, client_id=row.client_id)
+            for row in rows
+        ]})
+    return [row.id for row in rows]
+
+
+def sync_outbox(entries):
+    """
+    Apply a batch from the outbox: check-ins first, then checkouts, each
+    at the time the kiosk accepted it. Entries already applied change nothing.
+    """
+    try:
+        checkins = [entry for entry in entries if entry.kind == CHECKIN]
+        if checkins:
+            record_checkins(checkins)
+        checkouts = [entry for entry in entries if entry.kind == CHECKOUT]
+        if checkouts:
+            by_client = {e.payload["client_id"]: e.accepted_at for e in checkouts if "client_id" in e.payload}
+            by_id = {int(e.payload["id"]): e.accepted_at for e in checkouts if "id" in e.payload}
+            close_visits([or_(Visitor.client_id.in_(by_client), Visitor.id.in_(by_id))],
+                         check_out_for=lambda row: by_client.get(row.client_id) or by_id.get(row.id))
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+# Off unless KIOSK_OUTBOX names a SQLite file
+outbox = Outbox(KIOSK_OUTBOX, sync_outbox) if KIOSK_OUTBOX else None
+
+
+@api.before_app_request
+def start_outbox():
+    if outbox is not None:
+        outbox.ensure_started(current_app._get_current_object())
+
+
+@api.route("/outbox", methods=["GET"])
+def get_outbox():
+    """Backlog of buffered check-ins and checkouts not yet in the DB"""
+    return jsonify(outbox.stats() if outbox is not None else {"enabled": False})
+
+
+def outbox_stat(name):
+    return lambda: outbox.stats()[name] if outbox is not None else None
+
+
+@api.route("/visitors/active", methods=["GET"])
+def get_active_visitors():
+    """Everyone currently in the building (evacuation roll-call)"""
+    current = current_occupancy()
+    return jsonify({"count": current.count(), "visitors": current.snapshot()})
+
+
+@api.route("/visitors/active/count", methods=["GET"])
+def get_active_count():
+    """Live headcount for lobby displays"""
+    return jsonify({"count": current_occupancy().count()})
+
+
+# Analytics, read from the rollup tables only (?from=&to=, YYYY-MM-DD)
+STATS_VIEWS = {
+    "daily": rollups.daily,
+    "hourly": rollups.hourly,
+    "purposes": rollups.by_purpose,
+}
+
+
+@api.route("/stats", methods=["GET"])
+def get_stats():
+    """Visits, completed visits and average stay for a date range"""
+    try:
+        start, end = parse_range(request.args)
+    except StatsError as e:
+        return jsonify({"error": str(e)}), 400
+    return cached_json(db.session, response_cache,
+                       lambda: rollups.summary(db.session, start, end))
+
+
+@api.route("/stats/<view>", methods=["GET"])
+def get_stats_view(view):
+    """Per-day, per-hour-of-day or per-purpose breakdown for a date range"""
+    if view not in STATS_VIEWS:
+        return jsonify({"error": f"unknown stats view: {view}"}), 404
+    try:
+        start, end = parse_range(request.args)
+    except StatsError as e:
+        return jsonify({"error": str(e)}), 400
+
+    def build():
+        return {"from": start.isoformat(), "to": end.isoformat(),
+                view: STATS_VIEWS[view](db.session, start, end)}
+
+    return cached_json(db.session, response_cache, build)
+
+
+# ============================================================
+# METRICS (GET /metrics; see metrics.py)
+# ============================================================
+
+METRIC_GAUGES = [
+    Gauge("visitor_occupancy", "Open visits in this worker's occupancy set", occupancy.count),
+    Gauge("visitor_event_stream_buffered", "Events kept for Last-Event-ID resume",
+          lambda: visitor_feed.stats()["buffered"]),
+    Gauge("visitor_event_streams_open", "Event streams holding a thread in this worker",
+          lambda: visitor_feed.stats()["open_streams"]),
+    Gauge("visitor_auto_checkout_last_closed", "Visits closed by the last end-of-day auto-checkout",
+          lambda: auto_checkouts.stats()["last_closed"]),
+    Gauge("visitor_outbox_backlog", "Check-ins and checkouts in the kiosk outbox not yet in the DB",
+          outbox_stat("backlog")),
+    Gauge("visitor_outbox_oldest_age_seconds", "Age of the oldest entry not yet in the DB",
+          outbox_stat("oldest_age_seconds")),
+]
+
+# ============================================================
+# APP FACTORY AND ONE-TIME SETUP
+# ============================================================
+
+def create_app():
+    """
+    Build the Flask app. Cheap and side-effect free: MySQL is not contacted
+    here. Run initialize() once per deployment before serving.
+    """
+    flask_app = Flask(__name__)
+    flask_app.json = FastJSONProvider(flask_app)
+    CORS(flask_app)
+    configure_database(flask_app, DEFAULT_DATABASE_URL)
+    db.init_app(flask_app)
+    flask_app.register_blueprint(api)
+    instrument(flask_app, lambda: db.engine, gauges=METRIC_GAUGES)
+
+    @flask_app.cli.command("init")
+    def init_command():
+        """Create tables and indexes"""
+        initialize(flask_app)
+
+    @flask_app.cli.command("auto-checkout")
+    def auto_checkout_command():
+        """Close visits left open before the last end of day (for cron)"""
+        if auto_checkouts.at is None:
+            raise SystemExit("AUTO_CHECKOUT_AT is off")
+        closed = auto_checkout(last_cutoff(auto_checkouts.at))
+        print(f"✅ {len(closed)} open visits closed")
+
+    @flask_app.cli.command("outbox-sync")
+    def outbox_sync_command():
+        """Send everything in the kiosk outbox to the database now"""
+        if outbox is None:
+            raise SystemExit("KIOSK_OUTBOX is off")
+        while outbox.drain_once(flask_app):
+            pass
+        stats = outbox.stats()
+        print(f"✅ {stats['synced']} entries synced, {stats['backlog']} left, {stats['dead']} dead")
+
+    return flask_app
+
+
+_initialized = False
+
+
+def initialize(flask_app=None):
+    """
+    One-time setup: tables and indexes. Runs in the gunicorn master
+    (gunicorn.conf.py), from `flask --app app init`, or before the dev
+    server starts. The occupancy set loads itself on first use.
+    """
+    global _initialized
+    if _initialized:
+        return
+    with (flask_app or app).app_context():
+        print("\n" + "="*60)
+        print(f"🚀 Using {db.engine.dialect.name} database")
+        print(f"Database: {describe(db.engine)}")
+        print("="*60 + "\n")
+        create_schema(db, Visitor)
+        ensure_archive_table(db.engine, Visitor)
+        ensure_version_table(db.engine)
+        ensure_rollup_tables(db.engine)
+        print("✅ Tables created successfully")
+        # Forked workers must open their own connections
+        db.engine.dispose()
+    _initialized = True
+
+
+app = create_app()
+
 # ============================================================
 # RUN APPLICATION
 # ============================================================
 
 if __name__ == "__main__":
+    initialize(app)
     app.run(host="0.0.0.0", port=5000, debug=True)
\ No newline at end of file
@@ -1,102 +1,70 @@
-from flask import Flask, request, jsonify
+from flask import Blueprint, Flask, current_app, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
-import openpyxl
-from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
+from datetime import datetime, timedelta
 import os
-from pathlib import Path
-import configparser
+from storage import configure as configure_database, create_schema, describe
+from pagination import PaginationError, parse_limit, parse_fields, fetch_page
+from excel_sink import ExcelSink, HEADERS, read_header, saved_row_count, write_workbook, visitor_row
+from excel_exporter import ExcelExporter
+from excel_reconcile import ReconcileTask, reconcile
+from excel_partitions import EXCEL_PARTITION, PartitionedExcelSink, partition_bounds
+from excel_path import ExcelPathResolver
+from bulk_import import ImportFormatError, detect_format, iter_records, import_records
+from search import (SearchError, parse_search_args, ensure_sqlite_search_index,
+                    sqlite_search_index_exists, search_sqlite, rows_by_ids)
+from response_cache import ResponseCache, ensure_version_table, bump_version, cached_json, current_version
+from export_stream import iter_csv, iter_xlsx
+import rollups
+from rollups import RollupDelta, StatsError, ensure_rollup_tables, parse_range
+from events import EventFeed, MAX_EVENT_VISITORS, stream_response
+import archive
+from archive import ArchiveError, archive_table, ensure_archive_table, parse_tier, search_tiers, tier_sources
+from encoding import FastJSONProvider
+from metrics import Gauge, instrument, phase, timed
+from suggest import SUGGEST_LOAD_ROWS, SuggestError, SuggestIndex, parse_suggest_args
+from sqlalchemy import insert
 
-app = Flask(__name__)
-CORS(app)
+# Bound to the app in create_app(); nothing connects until a request needs it
+db = SQLAlchemy()
 
-# Database configuration
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///visitors.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db = SQLAlchemy(app)
+# Routes are registered on the app by create_app()
+api = Blueprint('visitors', __name__)
 
 # ========================================
 # SMART EXCEL FILE FINDER
 # ========================================
 
-CONFIG_FILE = 'config.ini'
-DEFAULT_EXCEL_FILE = 'visitors_log.xlsx'
+# Journaled, append-optimized writer for the Excel log: one workbook, or
+# one per period with EXCEL_PARTITION=month|quarter|year (excel_partitions.py)
+excel_sink = PartitionedExcelSink(EXCEL_PARTITION) if EXCEL_PARTITION else ExcelSink()
 
-def get_excel_path():
-    """Get Excel file path from config or search for it"""
-    config = configparser.ConfigParser()
-    
-    # Read config file
-    if os.path.exists(CONFIG_FILE):
-        config.read(CONFIG_FILE)
-        if 'FILE_LOCATION' in config:
-            saved_path = config['FILE_LOCATION'].get('excel_path', DEFAULT_EXCEL_FILE)
-            
-            # Check if file exists at saved location
-            if os.path.exists(saved_path):
-                print(f"✅ Excel file found at: {saved_path}")
-                return saved_path
-            else:
-                print(f"⚠️ Excel file not found at saved location: {saved_path}")
-                print(f"🔍 Searching for Excel file...")
-    
-    # Search for Excel file in common locations
-    search_locations = [
-        DEFAULT_EXCEL_FILE,  # Current directory
-        os.path.join(os.getcwd(), DEFAULT_EXCEL_FILE),
-        os.path.join(Path.home(), 'Desktop', DEFAULT_EXCEL_FILE),
-        os.path.join(Path.home(), 'Documents', DEFAULT_EXCEL_FILE),
-        os.path.join(Path.home(), 'Downloads', DEFAULT_EXCEL_FILE),
-        os.path.join(Path.home(), 'Documents', 'Inceptez_Visitors', DEFAULT_EXCEL_FILE),
-    ]
-    
-    # Check each location
-    for location in search_locations:
-        if os.path.exists(location):
-            print(f"✅ Excel file found at: {location}")
-            save_excel_path(location)
-            return location
-    
-    # If not found anywhere, create in backend folder
-    print(f"📝 Creating new Excel file at: {DEFAULT_EXCEL_FILE}")
-    save_excel_path(DEFAULT_EXCEL_FILE)
-    return DEFAULT_EXCEL_FILE
-
-def save_excel_path(path):
-    """Save Excel file path to config"""
-    config = configparser.ConfigParser()
-    config['FILE_LOCATION'] = {
-        'excel_path': path,
-        'last_updated': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    }
-    with open(CONFIG_FILE, 'w') as configfile:
-        config.write(configfile)
-    print(f"💾 Saved Excel file location to config: {path}")
+# Caches the resolved location; see excel_path.py. A partitioned log is
+# found by its manifest.
+excel_paths = ExcelPathResolver(probe=excel_sink.manifest_path if EXCEL_PARTITION else None)
 
 def update_excel_path_if_moved():
-    """Check if Excel file was moved and update config"""
-    config = configparser.ConfigParser()
-    if os.path.exists(CONFIG_FILE):
-        config.read(CONFIG_FILE)
-        if 'FILE_LOCATION' in config:
-            saved_path = config['FILE_LOCATION'].get('excel_path', DEFAULT_EXCEL_FILE)
-            
-            # If file doesn't exist at saved location, search for it
-            if not os.path.exists(saved_path):
-                print(f"🔍 Excel file moved! Searching for new location...")
-                return get_excel_path()
-    
-    return saved_path if 'saved_path' in locals() else get_excel_path()
+    """Current Excel path - cached, re-searched only if the file is gone"""
+    with phase('excel_path'):
+        return excel_paths.resolve()
 
-# Get Excel file path
-EXCEL_FILE = get_excel_path()
+# Excel file path; resolved on first use (the search can probe the home directory)
+EXCEL_FILE = None
 
 # ========================================
 # Visitor Model
 # ========================================
 
 class Visitor(db.Model):
+    __table_args__ = (
+        # Keyset pagination walks this index newest first
+        db.Index('ix_visitor_created_at_id', 'created_at', 'id'),
+        # Phone-prefix search is a range scan on this index
+        db.Index('ix_visitor_phone', 'phone'),
+        # Ids of archived visits (archive.py) are never handed out again
+        {'sqlite_autoincrement': True},
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     phone = db.Column(db.String(20), nullable=False)
@@ -116,242 +84,743 @@ class Visitor(db.Model):
             'created_at': self.created_at.strftime('%Y-%m-%d %H:%M:%S')
         }
 
+# Rules shared by single and bulk check-in
+REQUIRED_FIELDS = ['name', 'phone', 'date', 'purpose']
+
+def validate_visitor(data):
+    """Error message for a visitor missing a required field, else None"""
+    for field in REQUIRED_FIELDS:
+        if not data.get(field):
+            return f'{field} is required'
+    return None
+
+def visitor_params(data):
+    """Column values for a new visitor from a validated payload"""
+    return {
+        'name': data['name'],
+        'phone': data['phone'],
+        'date': data['date'],
+        'purpose': data['purpose'],
+        'comments': data.get('comments') or ''
+    }
+
+# Fields a client may ask for with ?fields=
+VISITOR_FIELDS = ['id', 'name', 'phone', 'date', 'purpose', 'comments', 'created_at']
+VISITOR_FORMATTERS = {
+    # 'YYYY-MM-DD HH:MM:SS', several times faster than strftime()
+    'created_at': lambda value: value.isoformat(' ', 'seconds'),
+}
+
 # Initialize Excel file
 def init_excel():
     global EXCEL_FILE
     EXCEL_FILE = update_excel_path_if_moved()  # Check if moved
     
-    if not os.path.exists(EXCEL_FILE):
+    if EXCEL_PARTITION:
+        init_partitions()
+    elif not os.path.exists(EXCEL_FILE):
         # Create directory if it doesn't exist
         excel_dir = os.path.dirname(EXCEL_FILE)
         if excel_dir and not os.path.exists(excel_dir):
             os.makedirs(excel_dir, exist_ok=True)
         
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = "Visitors Log"
-        
-        # Headers
-        headers = ['ID', 'Name', 'Phone Number', 'Date', 'Purpose of Visit', 'Comments']
-        ws.append(headers)
-        
-        # Style headers
-        header_fill = PatternFill(start_color='4472C4', end_color='4472C4', fill_type='solid')
-        header_font = Font(bold=True, color='FFFFFF', size=12)
-        thin_border = Border(
-            left=Side(style='thin'),
-            right=Side(style='thin'),
-            top=Side(style='thin'),
-            bottom=Side(style='thin')
-        )
-        
-        for cell in ws[1]:
-            cell.fill = header_fill
-            cell.font = header_font
-            cell.alignment = Alignment(horizontal='center', vertical='center')
-            cell.border = thin_border
-        
-        # Set column widths
-        ws.column_dimensions['A'].width = 8
-        ws.column_dimensions['B'].width = 25
-        ws.column_dimensions['C'].width = 18
-        ws.column_dimensions['D'].width = 15
-        ws.column_dimensions['E'].width = 30
-        ws.column_dimensions['F'].width = 40
-        
-        wb.save(EXCEL_FILE)
+        write_workbook(EXCEL_FILE, [])
         print(f"✅ Excel file created at: {EXCEL_FILE}")
+    elif read_header(EXCEL_FILE) != HEADERS:
+        # Older layout without the hidden Record ID column that deletes rely on
+        print(f"🔄 Upgrading Excel file layout at: {EXCEL_FILE}")
+        rebuild_excel()
+        return
+    
+    # Fold in rows and deletes journaled before the last shutdown
+    excel_sink.compact(EXCEL_FILE)
 
-# Add visitor to Excel
-def add_to_excel(visitor):
-    global EXCEL_FILE
-    try:
-        EXCEL_FILE = update_excel_path_if_moved()  # Check if moved before writing
-        
-        wb = openpyxl.load_workbook(EXCEL_FILE)
-        ws = wb.active
-        
-        # Get next row number (subtract 1 for header to get ID)
-        next_row = ws.max_row + 1
-        visitor_id = next_row - 1  # First data row (row 2) gets ID 1
-        
-        # Prepare row data with sequential ID
-        row_data = [
-            visitor_id,
-            visitor.name,
-            visitor.phone,
-            visitor.date,
-            visitor.purpose,
-            visitor.comments or ''
-        ]
-        
-        # Add row
-        ws.append(row_data)
-        
-        # Style the new row
-        row_num = ws.max_row
-        thin_border = Border(
-            left=Side(style='thin'),
-            right=Side(style='thin'),
-            top=Side(style='thin'),
-            bottom=Side(style='thin')
-        )
-        
-        for cell in ws[row_num]:
-            cell.border = thin_border
-            cell.alignment = Alignment(vertical='center')
-        
-        wb.save(EXCEL_FILE)
-        print(f"✅ Added visitor to Excel: Row {row_num}, ID {visitor_id} at {EXCEL_FILE}")
-        return True
-    except Exception as e:
-        print(f"❌ Error adding to Excel: {e}")
-        return False
+def init_partitions():
+    """Startup for a partitioned log: regenerate only what is missing"""
+    if not os.path.exists(excel_sink.manifest_path(EXCEL_FILE)):
+        print(f"🗂️ Splitting the Excel log into {EXCEL_PARTITION}ly workbooks")
+        rebuild_excel()
+        return
+    for key in excel_sink.damaged(EXCEL_FILE):
+        print(f"🔄 Rebuilding Excel partition {key}")
+        rebuild_excel(partition=key)
+
+# Visitors are read from the DB this many rows at a time during a rebuild
+REBUILD_CHUNK = 1000
 
 # Rebuild Excel file with dynamic IDs
-def rebuild_excel():
+@timed('excel_rebuild')
+def rebuild_excel(partition=None):
+    """
+    Regenerate the log from the DB with constant memory, whatever its size.
+    A partitioned log can regenerate a single partition (key like 2026-02).
+    """
     global EXCEL_FILE
     try:
         EXCEL_FILE = update_excel_path_if_moved()  # Check if moved before rebuilding
+        if EXCEL_PARTITION:
+            return rebuild_partitions(partition)
         
-        visitors = Visitor.query.order_by(Visitor.created_at).all()
-        
-        # Create new workbook
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = "Visitors Log"
-        
-        # Headers
-        headers = ['ID', 'Name', 'Phone Number', 'Date', 'Purpose of Visit', 'Comments']
-        ws.append(headers)
-        
-        # Style headers
-        header_fill = PatternFill(start_color='4472C4', end_color='4472C4', fill_type='solid')
-        header_font = Font(bold=True, color='FFFFFF', size=12)
-        thin_border = Border(
-            left=Side(style='thin'),
-            right=Side(style='thin'),
-            top=Side(style='thin'),
-            bottom=Side(style='thin')
+        # Plain column tuples read in chunks - no ORM objects, no full list
+        query = (
+            db.session.query(Visitor.name, Visitor.phone, Visitor.date,
+                             Visitor.purpose, Visitor.comments, Visitor.id)
+            .order_by(Visitor.created_at, Visitor.id)
+            .yield_per(REBUILD_CHUNK)
         )
-        
-        for cell in ws[1]:
-            cell.fill = header_fill
-            cell.font = header_font
-            cell.alignment = Alignment(horizontal='center', vertical='center')
-            cell.border = thin_border
-        
-        # Add all visitors with sequential IDs
-        for idx, visitor in enumerate(visitors, start=1):
-            row_data = [
-                idx,
-                visitor.name,
-                visitor.phone,
-                visitor.date,
-                visitor.purpose,
-                visitor.comments or ''
-            ]
-            ws.append(row_data)
+        rows = (
+            [idx, name, phone, date, purpose, comments or '', record_id]
+            for idx, (name, phone, date, purpose, comments, record_id)
+            in enumerate(query, start=1)
+        )
+        with excel_sink.exclusive(EXCEL_FILE):
+            count = write_workbook(EXCEL_FILE, rows)
             
-            # Style the row
-            row_num = ws.max_row
-            for cell in ws[row_num]:
-                cell.border = thin_border
-                cell.alignment = Alignment(vertical='center')
-        
-        # Set column widths
-        ws.column_dimensions['A'].width = 8
-        ws.column_dimensions['B'].width = 25
-        ws.column_dimensions['C'].width = 18
-        ws.column_dimensions['D'].width = 15
-        ws.column_dimensions['E'].width = 30
-        ws.column_dimensions['F'].width = 40
-        
-        wb.save(EXCEL_FILE)
-        print(f"✅ Rebuilt Excel file with {len(visitors)} visitors at {EXCEL_FILE}")
+            # The DB is the source of truth, so journaled rows are already in the file
+            excel_sink.reset(EXCEL_FILE, next_id=count + 1)
+        print(f"✅ Rebuilt Excel file with {count} visitors at {EXCEL_FILE}")
         return True
     except Exception as e:
         print(f"❌ Error rebuilding Excel: {e}")
         return False
 
+def rebuild_partitions(partition=None):
+    """Regenerate every partition, or just one, from the DB"""
+    query = db.session.query(Visitor.created_at, Visitor.name, Visitor.phone, Visitor.date,
+                             Visitor.purpose, Visitor.comments, Visitor.id)
+    if partition:
+        start, end = partition_bounds(partition, EXCEL_PARTITION)
+        query = query.filter(Visitor.created_at >= start, Visitor.created_at < end)
+    query = query.order_by(Visitor.created_at, Visitor.id).yield_per(REBUILD_CHUNK)
+    rows = (
+        (created_at, name, phone, date, purpose, comments or '', record_id)
+        for created_at, name, phone, date, purpose, comments, record_id in query
+    )
+    count = excel_sink.rebuild(EXCEL_FILE, rows, only=partition)
+    print(f"✅ Rebuilt {'partition ' + partition if partition else 'all partitions'} "
+          f"with {count} visitors next to {EXCEL_FILE}")
+    return True
+
+# ========================================
+# Write-behind export (runs off the request path)
+# ========================================
+
+def export_changes(rows, deleted_ids):
+    """
+    Exporter callback: journal a burst of new rows and deletes. The
+    workbook is rewritten only when the journal is full or old enough
+    (ExcelSink), not once per burst.
+    """
+    global EXCEL_FILE
+    EXCEL_FILE = update_excel_path_if_moved()
+    with phase('excel_append'):
+        if rows:
+            excel_sink.append(EXCEL_FILE, rows)
+        if deleted_ids:
+            excel_sink.delete(EXCEL_FILE, deleted_ids)
+    print(f"✅ Exported {len(rows)} new and {len(deleted_ids)} deleted visitors to Excel")
+
+# A dropped batch is repaired by the next reconcile, which it runs straight away
+excel_exporter = ExcelExporter(export_changes, on_error=lambda: excel_reconciler.request())
+
+def reconcile_excel(full=False, compact=False):
+    """
+    Repair drift between the DB and the Excel log by journaling only the
+    rows that differ (excel_reconcile.py); compact=True also writes them
+    into the workbook. A missing or outdated workbook is rebuilt instead.
+    Returns the reconcile report.
+    """
+    global EXCEL_FILE
+    EXCEL_FILE = update_excel_path_if_moved()
+    if EXCEL_PARTITION:
+        init_partitions()
+    elif saved_row_count(EXCEL_FILE) is None and read_header(EXCEL_FILE) != HEADERS:
+        # Not written by us since its checksums were saved: check the layout
+        rebuild_excel()
+    # Changes already queued are written first, so they do not look like drift
+    excel_exporter.flush()
+    with phase('excel_reconcile'):
+        return reconcile(db.session, Visitor, excel_sink, EXCEL_FILE,
+                         current_version(db.session)[0], full=full, compact=compact)
+
+# Incremental every EXCEL_RECONCILE_SECONDS, full every few runs
+excel_reconciler = ReconcileTask(reconcile_excel)
+
+@api.before_app_request
+def start_excel_reconciler():
+    excel_reconciler.ensure_started(current_app._get_current_object())
+
+# ========================================
+# Analytics rollups (see rollups.py)
+# ========================================
+
+def backfill_rollups(chunk_size=rollups.BACKFILL_CHUNK):
+    """Rebuild the analytics rollups from all visitors (python rollups.py backfill)"""
+    # Holding the data_version row makes writers wait until the rebuild commits
+    archived = archive_table(Visitor).c
+    return rollups.backfill(db.session, Visitor.id, Visitor.created_at, Visitor.purpose,
+                            chunk_size=chunk_size, lock=bump_version,
+                            archive=(archived.id, archived.created_at, archived.purpose))
+
+# ========================================
+# Hot/cold archival (see archive.py)
+# ========================================
+
+def archive_visits(days=archive.ARCHIVE_AFTER_DAYS, chunk_size=archive.ARCHIVE_CHUNK):
+    """Move visitors registered more than `days` ago to the archive table"""
+    # The Excel log follows the live table, so archived rows leave it too
+    return archive.archive_old(db.session, Visitor, Visitor.created_at, archive.cutoff_for(days),
+                               chunk_size=chunk_size, lock=bump_version,
+                               on_chunk=excel_exporter.submit_delete)
+
+# Search tables per ?tier=, live first
+SEARCH_TABLES = {
+    'live': [Visitor.__tablename__],
+    'archive': [archive_table(Visitor).name],
+    'all': [Visitor.__tablename__, archive_table(Visitor).name],
+}
+
+# Serialized list/search responses, keyed by data version and URL
+response_cache = ResponseCache()
+
+# Change deltas for GET /api/visitors/stream; see events.py
+visitor_feed = EventFeed()
+
+# Returning-visitor typeahead for GET /api/visitors/suggest; see suggest.py
+suggest_index = SuggestIndex()
+
+SUGGEST_FIELDS = ['id', 'name', 'phone', 'purpose', 'comments', 'created_at']
+
+def suggestion(visitor):
+    """A visitor dict (the to_dict() shape) as the typeahead index keeps it"""
+    return {
+        'id': visitor['id'],
+        'name': visitor['name'],
+        'phone': visitor['phone'],
+        'purpose': visitor['purpose'],
+        'comments': visitor['comments'] or '',
+        'last_visit': visitor['created_at'],
+    }
+
+def load_suggestions():
+    """Reload the typeahead index from the newest visits (an index range scan)"""
+    version = current_version(db.session)[0]
+    rows = (db.session.query(*[getattr(Visitor, c) for c in SUGGEST_FIELDS])
+            .order_by(Visitor.created_at.desc(), Visitor.id.desc())
+            .limit(SUGGEST_LOAD_ROWS))
+    format_time = VISITOR_FORMATTERS['created_at']
+    suggest_index.load([suggestion(dict(row._asdict(), created_at=format_time(row.created_at)))
+                        for row in rows], version)
+    db.session.commit()
+
+def current_suggestions():
+    """
+    The typeahead index. The data version is checked at most once every
+    SUGGEST_SYNC_SECONDS, so keystrokes in between never touch the DB.
+    """
+    if suggest_index.needs_sync() and not suggest_index.is_current(current_version(db.session)[0]):
+        load_suggestions()
+    return suggest_index
+
+def version_reader(flask_app):
+    """Data version reader for the event stream, which outlives its request's app context"""
+    def read():
+        with flask_app.app_context():
+            return current_version(db.session)[0]
+    return read
+
 # Routes
-@app.route('/api/visitors', methods=['GET'])
+@api.route('/api/visitors', methods=['GET'])
 def get_visitors():
-    visitors = Visitor.query.order_by(Visitor.created_at.desc()).all()
-    return jsonify([v.to_dict() for v in visitors])
+    """List visitors newest first, one page at a time (?limit=&cursor=&fields=&tier=)"""
+    try:
+        limit = parse_limit(request.args.get('limit'))
+        fields = parse_fields(request.args.get('fields'), VISITOR_FIELDS)
+        tier = parse_tier(request.args)
+        
+        def build():
+            visitors, next_cursor = fetch_page(
+                db.session, Visitor, 'created_at', fields, limit,
+                cursor=request.args.get('cursor'),
+                formatters=VISITOR_FORMATTERS,
+                sources=tier_sources(Visitor, tier),
+            )
+            return {'visitors': visitors, 'next_cursor': next_cursor}
+        
+        # 304 for unchanged polls; cached body for repeat queries
+        return cached_json(db.session, response_cache, build)
+    except (PaginationError, ArchiveError) as e:
+        return jsonify({'error': str(e)}), 400
+
+# Set by initialize(), or looked up on the first search; False without FTS5
+search_available = None
+
+def search_ready():
+    global search_available
+    if search_available is None:
+        search_available = sqlite_search_index_exists(db.engine, Visitor.__tablename__)
+    return search_available
+
+@api.route('/api/visitors/search', methods=['GET'])
+def search_visitors():
+    """Ranked search: ?q=<words>&phone=<digits>&phone_match=prefix|suffix|contains&tier="""
+    if not search_ready():
+        return jsonify({'error': 'search index is not available'}), 503
+    try:
+        q, phone, phone_match, limit, offset = parse_search_args(request.args)
+        fields = parse_fields(request.args.get('fields'), VISITOR_FIELDS)
+        tier = parse_tier(request.args)
+    except (SearchError, PaginationError, ArchiveError) as e:
+        return jsonify({'error': str(e)}), 400
+    
+    def build():
+        return search_page(db.session, q, phone, phone_match, fields, limit, offset, tier)
+    
+    return cached_json(db.session, response_cache, build)
+
+def search_page(session, q, phone, phone_match, fields, limit, offset, tier='live'):
+    """One page of ranked search results from one tier or both (live matches first)"""
+    tables = SEARCH_TABLES[tier]
+    if len(tables) == 1:
+        ids, has_more = search_sqlite(session, tables[0], q, phone, phone_match, limit, offset)
+    else:
+        ids, has_more = search_tiers(
+            lambda table, count: search_sqlite(session, table, q, phone, phone_match, count, 0)[0],
+            tables, limit, offset)
+    return {
+        'visitors': rows_by_ids(session, Visitor, fields, ids, VISITOR_FORMATTERS,
+                                sources=tier_sources(Visitor, tier)),
+        'next_offset': offset + limit if has_more else None
+    }
+
+@api.route('/api/visitors/stream', methods=['GET'])
+def stream_visitors():
+    """Server-sent events: insert/delete deltas as they are committed"""
+    return stream_response(visitor_feed, version_reader(current_app._get_current_object()))
 
-@app.route('/api/visitors', methods=['POST'])
+@api.route('/api/visitors/suggest', methods=['GET'])
+def suggest_visitors():
+    """Returning visitors whose name words or phone start with ?q=, newest visit first"""
+    try:
+        q, limit = parse_suggest_args(request.args)
+    except SuggestError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'suggestions': current_suggestions().suggest(q, limit)})
+
+@api.route('/api/visitors', methods=['POST'])
 def add_visitor():
     try:
         data = request.json
         
         # Validate required fields
-        required_fields = ['name', 'phone', 'date', 'purpose']
-        for field in required_fields:
-            if not data.get(field):
-                return jsonify({'error': f'{field} is required'}), 400
+        error = validate_visitor(data)
+        if error:
+            return jsonify({'error': error}), 400
         
         # Create new visitor
-        visitor = Visitor(
-            name=data['name'],
-            phone=data['phone'],
-            date=data['date'],
-            purpose=data['purpose'],
-            comments=data.get('comments', '')
-        )
+        visitor = Visitor(**visitor_params(data))
         
         # Save to database
         db.session.add(visitor)
-        db.session.commit()
+        version = bump_version(db.session)
+        delta = RollupDelta()
+        delta.visit(visitor.created_at, visitor.purpose)
+        delta.apply(db.session)
+        created = visitor.to_dict()
+        with phase('db_commit'):
+            db.session.commit()
         
-        # Add to Excel
-        add_to_excel(visitor)
+        # Queue for Excel; the exporter thread writes it shortly
+        excel_exporter.submit_add(visitor_row(visitor))
+        visitor_feed.publish(version, 'insert', {'visitors': [created]})
+        suggest_index.add([suggestion(created)], version)
         
         return jsonify({
             'message': 'Visitor added successfully',
-            'visitor': visitor.to_dict()
+            'visitor': created
         }), 201
         
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/visitors/<int:visitor_id>', methods=['DELETE'])
+@api.route('/api/visitors/<int:visitor_id>', methods=['DELETE'])
 def delete_visitor(visitor_id):
     try:
         visitor = Visitor.query.get_or_404(visitor_id)
+        delta = RollupDelta()
+        delta.remove(visitor.created_at, visitor.purpose)
         db.session.delete(visitor)
-        db.session.commit()
+        version = bump_version(db.session)
+        delta.apply(db.session)
+        with phase('db_commit'):
+            db.session.commit()
         
-        # Rebuild Excel file with updated sequential IDs
-        rebuild_excel()
+        # Queue for Excel; only this row is dropped, IDs renumber on compaction
+        excel_exporter.submit_delete([visitor_id])
+        visitor_feed.publish(version, 'delete', {'ids': [visitor_id]})
+        suggest_index.remove([visitor_id], version)
         
         return jsonify({'message': 'Visitor deleted successfully'}), 200
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/excel-location', methods=['GET'])
-def get_excel_location():
-    """API endpoint to get current Excel file location"""
+def insert_visitors(params):
+    """
+    Insert a chunk of visitor rows with one executemany; returns their new
+    ids in the order given
+    """
+    if db.engine.dialect.insert_executemany_returning_sort_by_parameter_order:
+        return db.session.scalars(
+            insert(Visitor).returning(Visitor.id, sort_by_parameter_order=True),
+            params
+        ).all()
+    # No ordered RETURNING (MySQL): read the ids back. Rows past the largest
+    # id seen before the insert are this chunk's, in order, plus any another
+    # transaction committed meanwhile, which do not match the next row
+    before = db.session.scalar(db.select(db.func.max(Visitor.id))) or 0
+    db.session.execute(insert(Visitor), params)
+    inserted = db.session.execute(
+        db.select(Visitor.id, Visitor.name, Visitor.phone)
+        .where(Visitor.id > before).order_by(Visitor.id)
+    ).all()
+    ids = []
+    for visitor_id, name, phone in inserted:
+        if len(ids) == len(params):
+            break
+        expected = params[len(ids)]
+        # Compared as text: the DB hands back strings for what may have been numbers
+        if (str(name), str(phone)) == (str(expected['name']), str(expected['phone'])):
+            ids.append(visitor_id)
+    if len(ids) != len(params):
+        raise RuntimeError(f'read back {len(ids)} of {len(params)} imported visitor ids')
+    return ids
+
+def import_visitors(stream, fmt):
+    """
+    Stream visitors from an upload into the DB in one transaction and queue
+    them for Excel as a single batch. Returns the per-row import report.
+    """
+    exported = []
+    created = []
+    delta = RollupDelta()
+    
+    def insert_chunk(records):
+        # created_at is set here so the rollups count the same time the row gets
+        now = datetime.utcnow()
+        params = [dict(visitor_params(record), created_at=now) for record in records]
+        ids = insert_visitors(params)
+        for row, visitor_id in zip(params, ids):
+            exported.append([row['name'], row['phone'], row['date'],
+                             row['purpose'], row['comments'], visitor_id])
+            delta.visit(now, row['purpose'])
+            if len(created) <= MAX_EVENT_VISITORS:
+                created.append(dict(row, id=visitor_id, created_at=now.strftime('%Y-%m-%d %H:%M:%S')))
+    
+    try:
+        report = import_records(iter_records(stream, fmt), validate_visitor, insert_chunk)
+        version = bump_version(db.session)
+        delta.apply(db.session)
+        with phase('db_commit'):
+            db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    
+    if exported:
+        excel_exporter.submit_adds(exported)
+        # Big imports are cheaper to reload than to push row by row
+        if len(created) > MAX_EVENT_VISITORS:
+            visitor_feed.publish(version, 'reset', {})
+            suggest_index.invalidate()
+        else:
+            visitor_feed.publish(version, 'insert', {'visitors': created[::-1]})
+            suggest_index.add([suggestion(row) for row in created], version)
+    return report
+
+@api.route('/api/visitors/bulk', methods=['POST'])
+def bulk_add_visitors():
+    """Import many visitors from a JSON, NDJSON, CSV or XLSX upload"""
+    upload = request.files.get('file')
+    try:
+        if upload:
+            fmt = detect_format(upload.mimetype, upload.filename, request.args.get('format'))
+            stream = upload.stream
+        else:
+            fmt = detect_format(request.mimetype, explicit=request.args.get('format'))
+            stream = request.stream
+        report = import_visitors(stream, fmt)
+    except ImportFormatError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    
+    report['message'] = f"{report['inserted']} visitors imported successfully"
+    return jsonify(report), 201 if report['inserted'] else 400
+
+# Most ids accepted by one batched delete
+MAX_BATCH_DELETE = 1000
+
+@api.route('/api/visitors', methods=['DELETE'])
+def delete_visitors():
+    """Delete many visitors at once: {"ids": [1, 2, 3]}"""
+    data = request.get_json(silent=True) or {}
+    ids = data.get('ids')
+    if not isinstance(ids, list) or not ids:
+        return jsonify({'error': 'ids must be a non-empty list'}), 400
+    if len(ids) > MAX_BATCH_DELETE:
+        return jsonify({'error': f'at most {MAX_BATCH_DELETE} ids per request'}), 400
+    try:
+        ids = {int(visitor_id) for visitor_id in ids}
+    except (TypeError, ValueError):
+        return jsonify({'error': 'ids must be numbers'}), 400
+    
+    try:
+        rows = (db.session.query(Visitor.id, Visitor.created_at, Visitor.purpose)
+                .filter(Visitor.id.in_(ids)).all())
+        found = [row.id for row in rows]
+        if found:
+            delta = RollupDelta()
+            for row in rows:
+                delta.remove(row.created_at, row.purpose)
+            # One DELETE statement and one Excel event for the whole batch
+            Visitor.query.filter(Visitor.id.in_(found)).delete(synchronize_session=False)
+            version = bump_version(db.session)
+            delta.apply(db.session)
+            with phase('db_commit'):
+                db.session.commit()
+            excel_exporter.submit_delete(found)
+            visitor_feed.publish(version, 'delete', {'ids': found})
+            suggest_index.remove(found, version)
+        
+        return jsonify({
+            'message': f'{len(found)} visitors deleted successfully',
+            'deleted': sorted(found),
+            'not_found': sorted(ids - set(found))
+        }), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+EXPORT_HEADERS = ['ID', 'Name', 'Phone Number', 'Date', 'Purpose of Visit', 'Comments', 'Registered At']
+EXPORT_WIDTHS = {'A': 8, 'B': 25, 'C': 18, 'D': 15, 'E': 30, 'F': 40, 'G': 20}
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+def parse_export_day(raw, name):
+    """YYYY-MM-DD query parameter as a datetime, or None"""
+    if not raw:
+        return None
+    try:
+        return datetime.strptime(raw, '%Y-%m-%d')
+    except ValueError:
+        raise ValueError(f'{name} must be a date like 2026-02-07')
+
+def export_body(fmt, start=None, end=None, gzip=False):
+    """
+    Streamed CSV or XLSX body of the visitors registered between start and
+    end (inclusive). Returns (chunks, mimetype, headers); the chunks read
+    the DB, so iterate them inside an app context.
+    """
+    # Registration date range (inclusive), read in chunks as plain tuples
+    query = db.session.query(Visitor.id, Visitor.name, Visitor.phone, Visitor.date,
+                             Visitor.purpose, Visitor.comments, Visitor.created_at)
+    if start:
+        query = query.filter(Visitor.created_at >= start)
+    if end:
+        query = query.filter(Visitor.created_at < end + timedelta(days=1))
+    query = query.order_by(Visitor.created_at, Visitor.id).yield_per(REBUILD_CHUNK)
+    
+    rows = (
+        [visitor_id, name, phone, date, purpose, comments or '',
+         created_at.strftime('%Y-%m-%d %H:%M:%S')]
+        for visitor_id, name, phone, date, purpose, comments, created_at in query
+    )
+    filename = f"visitors_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{fmt}"
+    headers = {'Content-Disposition': f'attachment; filename="{filename}"'}
+    
+    if fmt == 'csv':
+        if gzip:
+            headers['Content-Encoding'] = 'gzip'
+            headers['Vary'] = 'Accept-Encoding'
+        return iter_csv(EXPORT_HEADERS, rows, gzip=gzip), 'text/csv', headers
+    return iter_xlsx(EXPORT_HEADERS, rows, widths=EXPORT_WIDTHS), XLSX_MIMETYPE, headers
+
+@api.route('/api/visitors/export', methods=['GET'])
+def export_visitors():
+    """Download visitors as CSV or XLSX (?format=csv|xlsx&from=&to=), streamed"""
+    fmt = request.args.get('format', 'csv')
+    if fmt not in ('csv', 'xlsx'):
+        return jsonify({'error': 'format must be csv or xlsx'}), 400
+    try:
+        start = parse_export_day(request.args.get('from'), 'from')
+        end = parse_export_day(request.args.get('to'), 'to')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    body, mimetype, headers = export_body(fmt, start, end,
+                                          gzip='gzip' in request.accept_encodings)
+    # stream_with_context keeps the DB session alive while the body is sent
+    return Response(stream_with_context(body), mimetype=mimetype, headers=headers)
+
+# Analytics, read from the rollup tables only (?from=&to=, YYYY-MM-DD)
+STATS_VIEWS = {
+    'daily': rollups.daily,
+    'hourly': rollups.hourly,
+    'purposes': rollups.by_purpose,
+}
+
+@api.route('/api/stats', methods=['GET'])
+def get_stats():
+    """Visit totals for a date range"""
+    try:
+        start, end = parse_range(request.args)
+    except StatsError as e:
+        return jsonify({'error': str(e)}), 400
+    return cached_json(db.session, response_cache,
+                       lambda: rollups.summary(db.session, start, end))
+
+@api.route('/api/stats/<view>', methods=['GET'])
+def get_stats_view(view):
+    """Per-day, per-hour-of-day or per-purpose visit counts for a date range"""
+    if view not in STATS_VIEWS:
+        return jsonify({'error': f'unknown stats view: {view}'}), 404
+    try:
+        start, end = parse_range(request.args)
+    except StatsError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    def build():
+        return {'from': start.isoformat(), 'to': end.isoformat(),
+                view: STATS_VIEWS[view](db.session, start, end)}
+    
+    return cached_json(db.session, response_cache, build)
+
+def excel_location():
+    """Where the Excel log is and how far behind the DB it is"""
     global EXCEL_FILE
     EXCEL_FILE = update_excel_path_if_moved()
-    return jsonify({
+    location = {
         'excel_path': os.path.abspath(EXCEL_FILE),
-        'exists': os.path.exists(EXCEL_FILE)
-    })
-
-# Initialize database and Excel
-with app.app_context():
-    db.create_all()
-    init_excel()
-    print(f"\n{'='*60}")
-    print(f"🚀 Visitor Management System Started")
-    print(f"{'='*60}")
-    print(f"📊 Excel File Location: {os.path.abspath(EXCEL_FILE)}")
-    print(f"💾 Database Location: {os.path.abspath('visitors.db')}")
-    print(f"🌐 Backend URL: http://localhost:5000")
-    print(f"{'='*60}\n")
+        'exists': os.path.exists(excel_paths.probe(EXCEL_FILE)),
+        'pending_rows': excel_sink.pending(EXCEL_FILE),
+        'export': excel_exporter.stats(),
+        'reconcile': excel_reconciler.stats(),
+        'events': visitor_feed.stats(),
+        'partition_period': EXCEL_PARTITION or None,
+        'partitions': []
+    }
+    if EXCEL_PARTITION:
+        location['manifest_path'] = os.path.abspath(excel_sink.manifest_path(EXCEL_FILE))
+        location['partitions'] = excel_sink.partitions(EXCEL_FILE)
+    return location
+
+@api.route('/api/excel-location', methods=['GET'])
+def get_excel_location():
+    """API endpoint to get current Excel file location"""
+    return jsonify(excel_location())
+
+# ========================================
+# Metrics (GET /metrics; see metrics.py)
+# ========================================
+
+def excel_file_bytes():
+    if EXCEL_FILE is None:
+        return None
+    if EXCEL_PARTITION:
+        return sum(os.path.getsize(entry['path'])
+                   for entry in excel_sink.partitions(EXCEL_FILE) if entry['exists'])
+    if not os.path.exists(EXCEL_FILE):
+        return None
+    return os.path.getsize(EXCEL_FILE)
+
+def excel_rows():
+    return excel_sink.workbook_rows(EXCEL_FILE) if EXCEL_FILE else None
+
+def excel_pending():
+    return excel_sink.pending(EXCEL_FILE) if EXCEL_FILE else None
+
+def excel_rows_repaired():
+    report = excel_reconciler.last_report
+    return report['appended'] + report['removed'] if report else None
+
+METRIC_GAUGES = [
+    Gauge('visitor_excel_file_bytes', 'Size of the Excel log', excel_file_bytes),
+    Gauge('visitor_excel_rows', 'Visitor rows in the Excel log (excluding journaled changes)',
+          excel_rows),
+    Gauge('visitor_excel_pending_changes', 'Journaled rows and deletes not yet compacted',
+          excel_pending),
+    Gauge('visitor_export_queue_depth', 'Changes waiting for the Excel exporter thread',
+          excel_exporter.queue_depth),
+    Gauge('visitor_excel_reconcile_repaired', 'Rows appended and ids tombstoned by the last Excel reconcile',
+          excel_rows_repaired),
+    Gauge('visitor_event_stream_buffered', 'Events kept for Last-Event-ID resume',
+          lambda: visitor_feed.stats()['buffered']),
+    Gauge('visitor_event_streams_open', 'Event streams holding a thread in this worker',
+          lambda: visitor_feed.stats()['open_streams']),
+    Gauge('visitor_suggest_index_visitors', "Returning visitors in this worker's typeahead index",
+          lambda: suggest_index.stats()['visitors']),
+]
+
+# ========================================
+# App factory and one-time setup
+# ========================================
+
+def create_app():
+    """
+    Build the Flask app. Cheap and side-effect free: no DB connection, no
+    file access. Run initialize() once per deployment before serving.
+    """
+    flask_app = Flask(__name__)
+    flask_app.json = FastJSONProvider(flask_app)
+    CORS(flask_app)
+    # Database configuration (DATABASE_URL overrides; WAL and pooling in storage.py)
+    configure_database(flask_app, 'sqlite:///visitors.db')
+    db.init_app(flask_app)
+    flask_app.register_blueprint(api)
+    instrument(flask_app, lambda: db.engine, gauges=METRIC_GAUGES)
+
+    @flask_app.cli.command('init')
+    def init_command():
+        """Create tables and indexes and bring the Excel log up to date"""
+        initialize(flask_app)
+
+    return flask_app
+
+_initialized = False
+
+def initialize(flask_app=None):
+    """
+    One-time setup: tables, indexes, search index and the Excel log.
+    Runs in the gunicorn master (gunicorn.conf.py), from
+    `flask --app app_smart_search init`, or before the dev server starts.
+    """
+    global search_available, _initialized
+    if _initialized:
+        return
+    with (flask_app or app).app_context():
+        create_schema(db, Visitor)
+        ensure_archive_table(db.engine, Visitor)
+        search_available = (ensure_sqlite_search_index(db.engine, Visitor.__tablename__)
+                            and ensure_sqlite_search_index(db.engine, archive_table(Visitor).name))
+        ensure_version_table(db.engine)
+        ensure_rollup_tables(db.engine)
+        init_excel()
+        # Built before gunicorn forks, so every worker starts with it
+        load_suggestions()
+        print(f"\n{'='*60}")
+        print(f"🚀 Visitor Management System Started")
+        print(f"{'='*60}")
+        print(f"📊 Excel File Location: {os.path.abspath(EXCEL_FILE)}")
+        print(f"💾 Database: {describe(db.engine)}")
+        print(f"🌐 Backend URL: http://localhost:5000")
+        print(f"{'='*60}\n")
+        # Forked workers must open their own connections
+        db.engine.dispose()
+    _initialized = True
+
+app = create_app()
 
 if __name__ == '__main__':
+    initialize(app)
     app.run(debug=True, port=5000)
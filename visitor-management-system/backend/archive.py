@@ -0,0 +1,235 @@
+"""
+HOT/COLD ARCHIVAL
+Visits older than the retention window move from the live visitors table
+to an archive table with the same columns (<table>_archive, plus
+archived_at), so the live table - which every default list, search and
+rebuild_excel() reads - only holds recent visits.
+  - Rows move ARCHIVE_CHUNK at a time, each chunk copied and deleted in
+    one transaction that also bumps the data version, so writers are never
+    blocked for long and caches and event streams see the change.
+  - Visits keep their id, and archived ids are never handed out again:
+    the newest row always stays live, and after every run (and at
+    startup) the live table's next id is raised above the archive's
+    (reserve_archived_ids). A row whose id is already archived is left
+    live rather than overwriting the archived visit.
+  - app.py only archives closed visits; open ones are still in the
+    building.
+Stats are unaffected: the rollups already count archived visits, and a
+backfill reads both tiers. The Excel log follows the live table.
+
+List and search endpoints take ?tier=live (default), archive or all.
+
+    python archive.py run [--app app] [--days 365] [--chunk 1000]
+"""
+import argparse
+import os
+import sys
+from datetime import datetime, timedelta
+
+from sqlalchemy import Column, DateTime, Index, MetaData, Table, delete, func, insert, literal, select, text
+
+from storage import add_missing_columns
+
+# Visits older than this many days are archived
+ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', '365'))
+
+# Visits moved per transaction
+ARCHIVE_CHUNK = 1000
+
+TIERS = ('live', 'archive', 'all')
+
+metadata = MetaData()
+
+
+class ArchiveError(ValueError):
+    """Raised for a bad ?tier= parameter"""
+
+
+def archive_table(model):
+    """The archive table for a model: its columns and indexes, ids kept as they are"""
+    name = f'{model.__tablename__}_archive'
+    if name in metadata.tables:
+        return metadata.tables[name]
+    live = model.__table__
+    table = Table(
+        name, metadata,
+        *[Column(column.name, column.type, primary_key=column.primary_key,
+                 nullable=column.nullable, autoincrement=False)
+          for column in live.columns],
+        Column('archived_at', DateTime, nullable=False),
+    )
+    # Same lookups as the live table (keyset, phone prefix, MySQL FULLTEXT)
+    for index in live.indexes:
+        Index(f'{index.name}_archive', *[table.c[column.name] for column in index.columns],
+              **index.dialect_kwargs)
+    return table
+
+
+def ensure_archive_table(engine, model):
+    """Create the archive table and its indexes if missing, and columns added to the model since"""
+    table = archive_table(model)
+    table.create(engine, checkfirst=True)
+    add_missing_columns(engine, table)
+    for index in table.indexes:
+        index.create(engine, checkfirst=True)
+    # MySQL before 8.0 recomputes AUTO_INCREMENT from the live rows on restart
+    with engine.begin() as connection:
+        reserve_archived_ids(connection, model)
+
+
+def reserve_archived_ids(connection, model):
+    """
+    Make sure the live table's next id is above every archived id. Only
+    needed when the live table's highest id is not (its newest row was
+    deleted); SQLite AUTOINCREMENT tables keep their sequence in
+    sqlite_sequence, MySQL in AUTO_INCREMENT. A SQLite table made without
+    AUTOINCREMENT (before the models asked for it) has no sequence to raise.
+    """
+    live = model.__table__
+    archived = connection.scalar(select(func.max(archive_table(model).c.id)))
+    if archived is None or (connection.scalar(select(func.max(live.c.id))) or 0) > archived:
+        return
+    dialect = connection.dialect.name
+    if dialect == 'sqlite':
+        sql = connection.scalar(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                                {'name': live.name})
+        if 'AUTOINCREMENT' not in (sql or '').upper():
+            print(f"⚠️ {live.name} has no AUTOINCREMENT; archived ids up to {archived} may be reused")
+            return
+        raised = connection.execute(text('UPDATE sqlite_sequence SET seq = :seq WHERE name = :name AND seq < :seq'),
+                                    {'seq': archived, 'name': live.name}).rowcount
+        if not raised and connection.scalar(text('SELECT seq FROM sqlite_sequence WHERE name = :name'),
+                                            {'name': live.name}) is None:
+            connection.execute(text('INSERT INTO sqlite_sequence (name, seq) VALUES (:name, :seq)'),
+                               {'seq': archived, 'name': live.name})
+    elif dialect == 'mysql':
+        # Never lowers it: MySQL keeps the larger of this and max(id) + 1
+        table = connection.dialect.identifier_preparer.format_table(live)
+        connection.execute(text(f'ALTER TABLE {table} AUTO_INCREMENT = {int(archived) + 1}'))
+
+
+def parse_tier(args):
+    """?tier=live|archive|all (default live)"""
+    tier = args.get('tier') or 'live'
+    if tier not in TIERS:
+        raise ArchiveError(f'tier must be one of: {", ".join(TIERS)}')
+    return tier
+
+
+def tier_sources(model, tier):
+    """Column namespaces to read for a tier, live first"""
+    archived = archive_table(model).c
+    return {'live': [model], 'archive': [archived], 'all': [model, archived]}[tier]
+
+
+def search_tiers(search, tiers, limit, offset):
+    """
+    One result list over several tiers, each tier's matches in its own
+    ranked order and live ones first. search(tier, limit) returns that
+    tier's first limit ids. Returns (ids, has_more).
+    """
+    window = offset + limit + 1
+    ids = []
+    for tier in tiers:
+        ids.extend(search(tier, window - len(ids)))
+        if len(ids) >= window:
+            break
+    return ids[offset:offset + limit], len(ids) > offset + limit
+
+
+def cutoff_for(days, now=None):
+    """Visits before this moment are past the retention window"""
+    if days < 1:
+        raise ValueError('the retention window must be at least one day')
+    return (now or datetime.utcnow()) - timedelta(days=days)
+
+
+def archive_old(session, model, time_column, cutoff, chunk_size=ARCHIVE_CHUNK,
+                where=(), lock=None, on_chunk=None):
+    """
+    Move rows with time_column < cutoff (and matching where) to the archive
+    table, oldest id first, committing after every chunk. lock(session) is
+    called at the start of each chunk's transaction (bump_version: it
+    serializes with writers and invalidates cached responses);
+    on_chunk(ids) after each commit. Rows whose id is already archived
+    stay live. Returns the number of rows moved.
+    """
+    live = model.__table__
+    archive = archive_table(model)
+    names = [column.name for column in live.columns]
+    due = (time_column < cutoff, *where)
+    archived = select(archive.c.id).where(archive.c.id == live.c.id).exists()
+
+    newest = session.scalar(select(func.max(live.c.id)))
+    session.commit()
+    if newest is None:
+        return 0
+
+    moved = 0
+    while True:
+        if lock:
+            lock(session)
+        ids = session.scalars(
+            select(live.c.id)
+            .where(*due, live.c.id < newest, ~archived)
+            .order_by(live.c.id)
+            .limit(chunk_size)
+        ).all()
+        if not ids:
+            session.rollback()
+            break
+
+        session.execute(insert(archive).from_select(
+            names + ['archived_at'],
+            select(*[live.c[name] for name in names],
+                   literal(datetime.utcnow(), DateTime)).where(live.c.id.in_(ids))
+        ))
+        session.execute(delete(live).where(live.c.id.in_(ids)))
+        session.commit()
+
+        moved += len(ids)
+        if on_chunk:
+            on_chunk(ids)
+        print(f"   ...{moved} visits archived")
+
+    clashes = session.scalar(select(func.count()).select_from(live).where(*due, live.c.id < newest, archived))
+    if clashes:
+        print(f"⚠️ {clashes} visits left live: their ids are already in {archive.name}")
+    reserve_archived_ids(session.connection(), model)
+    session.commit()
+    return moved
+
+
+# ========================================
+# COMMAND LINE
+# ========================================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Move old visits to the archive table')
+    parser.add_argument('command', choices=['run'],
+                        help='run: archive visits older than the retention window')
+    parser.add_argument('--app', choices=['app_smart_search', 'app'], default='app_smart_search',
+                        help='backend whose database to use (default: app_smart_search)')
+    parser.add_argument('--days', type=int, default=ARCHIVE_AFTER_DAYS,
+                        help=f'retention window in days (default: {ARCHIVE_AFTER_DAYS})')
+    parser.add_argument('--chunk', type=int, default=ARCHIVE_CHUNK,
+                        help=f'visits moved per transaction (default: {ARCHIVE_CHUNK})')
+    args = parser.parse_args(argv)
+    if args.days < 1:
+        parser.error('--days must be at least 1')
+
+    if args.app == 'app':
+        from app import app, archive_visits, initialize
+    else:
+        from app_smart_search import app, archive_visits, initialize
+    initialize(app)
+
+    print(f"🗄️ Archiving {args.app} visits older than {args.days} days...")
+    with app.app_context():
+        moved = archive_visits(args.days, args.chunk)
+    print(f"✅ {moved} visits archived")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
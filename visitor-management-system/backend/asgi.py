@@ -0,0 +1,600 @@
+"""
+ASGI SERVER - The visitor API for asyncio servers
+    pip install -r requirements-asgi.txt
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+
+Same routes, JSON and ETags as app_smart_search.py, on the same database
+and Excel log, but requests are coroutines instead of threads: one
+process holds hundreds of kiosk connections and open event streams.
+  - the DB is reached through asyncio drivers (aiosqlite / aiomysql, see
+    storage.async_url); the shared query helpers (pagination, search,
+    rollups, data version) run unchanged on the async session via
+    run_sync()
+  - Excel writes still go through app_smart_search's write-behind
+    exporter thread
+  - other blocking work (bulk imports, CSV/XLSX exports, the Excel path
+    lookup) runs on a bounded thread pool; when its queue is full the
+    request gets 503 and Retry-After instead of piling up
+Setup (tables, search index, Excel log) runs once at startup.
+
+The slow-request profiler of metrics.py samples threads, so it is not
+used here; request and phase histograms are.
+"""
+import asyncio
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Route
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import http_date, parse_accept_header, parse_date, parse_etags
+
+import app_smart_search
+from app_smart_search import (
+    MAX_BATCH_DELETE, METRIC_GAUGES, STATS_VIEWS, VISITOR_FIELDS, VISITOR_FORMATTERS,
+    Visitor, db, excel_exporter, excel_location, excel_reconciler, export_body, import_visitors,
+    load_suggestions, parse_export_day, response_cache, search_page, suggest_index, suggestion,
+    validate_visitor, visitor_feed, visitor_params,
+)
+from archive import ArchiveError, parse_tier, tier_sources
+from bulk_import import ImportFormatError, detect_format
+from encoding import JSON, EncodingError, choose_coding, dumps, encode, negotiate, parse_layout
+from events import parse_last_event_id
+from excel_sink import visitor_row
+from metrics import CONTENT_TYPE, REQUEST_SECONDS, Registry, phase, pool_stats, registry
+from pagination import PaginationError, fetch_page, parse_fields, parse_limit
+from response_cache import (bump_version, current_version, is_not_modified, last_modified,
+                            version_etag)
+from rollups import RollupDelta, StatsError, parse_range, summary
+from search import SearchError, parse_search_args
+from storage import async_url, engine_options, tune_sqlite
+from suggest import SuggestError, parse_suggest_args
+
+# Threads for blocking work, and how many such jobs may wait for one
+BLOCKING_WORKERS = int(os.getenv('ASGI_BLOCKING_WORKERS', '4'))
+BLOCKING_QUEUE = int(os.getenv('ASGI_BLOCKING_QUEUE', '16'))
+
+# Upload bodies above this size are spooled to a temporary file
+SPOOL_MAX_BYTES = 8 * 1024 * 1024
+
+# Export chunks buffered between the exporting thread and the client
+EXPORT_BUFFER_CHUNKS = 8
+
+flask_app = app_smart_search.app
+
+# Created at startup, inside the server's event loop
+engine = None
+sessions = None
+
+
+class ServerBusy(RuntimeError):
+    """Raised when the blocking-work queue is full"""
+
+
+def json_response(payload, status=200, headers=None):
+    # Same encoder as the Flask apps (encoding.py), so bodies are interchangeable
+    return Response(dumps(payload), status_code=status, headers=headers, media_type=JSON)
+
+
+def make_engine():
+    """Async engine for the database the Flask app is configured with"""
+    with flask_app.app_context():
+        # Flask-SQLAlchemy has already made a relative SQLite path absolute
+        url = async_url(db.engine.url)
+    async_engine = create_async_engine(url, **engine_options(url.drivername))
+    if url.drivername.startswith('sqlite'):
+        event.listen(async_engine.sync_engine, 'connect',
+                     lambda dbapi_connection, record: tune_sqlite(dbapi_connection))
+    return async_engine
+
+
+class BlockingPool:
+    """
+    Bounded thread pool for blocking app_smart_search code. Jobs run inside
+    a Flask app context (for db.session); at most workers run and queue
+    more wait, beyond that submitting raises ServerBusy.
+    """
+
+    def __init__(self, workers=BLOCKING_WORKERS, queue=BLOCKING_QUEUE):
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix='asgi-blocking')
+        self.limit = workers + queue
+        # Only touched from the event loop, so no lock
+        self.jobs = 0
+
+    def _claim(self):
+        if self.jobs >= self.limit:
+            raise ServerBusy('server busy, try again shortly')
+        self.jobs += 1
+
+    def _in_app_context(self, fn, *args):
+        with flask_app.app_context():
+            return fn(*args)
+
+    async def run(self, fn, *args):
+        """Result of fn(*args), run on the pool"""
+        self._claim()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._executor, self._in_app_context, fn, *args)
+        finally:
+            self.jobs -= 1
+
+    def iterate(self, make_chunks):
+        """
+        Async iterator over make_chunks()'s output, produced on the pool. At
+        most EXPORT_BUFFER_CHUNKS wait for the client; if it goes away the
+        producing thread stops at the next chunk.
+        """
+        self._claim()
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(EXPORT_BUFFER_CHUNKS)
+        stopped = False
+        done = object()
+
+        def put(item):
+            asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+        def produce():
+            try:
+                for chunk in make_chunks():
+                    if stopped:
+                        return
+                    put(chunk)
+            except Exception as e:
+                put(e)
+            else:
+                put(done)
+
+        async def chunks():
+            nonlocal stopped
+            producer = loop.run_in_executor(self._executor, self._in_app_context, produce)
+            try:
+                while True:
+                    item = await queue.get()
+                    if item is done:
+                        break
+                    if isinstance(item, Exception):
+                        raise item
+                    yield item
+            finally:
+                # Make room so a producer blocked on put() sees it should stop
+                stopped = True
+                while not queue.empty():
+                    queue.get_nowait()
+                await producer
+                self.jobs -= 1
+
+        return chunks()
+
+
+blocking = BlockingPool()
+
+
+async def spool_body(request):
+    """The request body as a binary file object, spooled to disk if large"""
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    async for chunk in request.stream():
+        spool.write(chunk)
+    spool.seek(0)
+    return spool
+
+
+def request_mimetype(request):
+    return request.headers.get('content-type', '').split(';', 1)[0].strip().lower()
+
+
+async def read_version():
+    async with sessions() as session:
+        return (await session.run_sync(current_version))[0]
+
+
+async def cached_json(request, build):
+    """
+    response_cache.cached_json() for this server: build(session) gets a
+    sync view of an async session and returns the JSON payload
+    """
+    try:
+        layout = parse_layout(request.query_params)
+    except EncodingError as e:
+        return json_response({'error': str(e)}, 400)
+    media_type = negotiate(parse_accept_header(request.headers.get('accept'), MIMEAccept))
+
+    async with sessions() as session:
+        version, updated_at = await session.run_sync(current_version)
+        # Same shape as Flask's request.full_path, so ETags match across servers
+        shape = f'{request.url.path}?{request.url.query}'
+        etag = version_etag(version, shape, media_type)
+
+        if_none_match = request.headers.get('if-none-match')
+        if is_not_modified(etag, updated_at,
+                           parse_etags(if_none_match) if if_none_match else None,
+                           parse_date(request.headers.get('if-modified-since'))):
+            response = Response(status_code=304)
+        else:
+            coding = choose_coding(parse_accept_header(request.headers.get('accept-encoding')))
+            key = (version, shape, media_type, coding)
+            cached = response_cache.get(key)
+            if cached is None:
+                payload = await session.run_sync(build)
+                with phase('encode'):
+                    cached = encode(payload, media_type, layout, coding)
+                response_cache.put(key, cached)
+            body, content_encoding = cached
+            response = Response(body, media_type=media_type)
+            if content_encoding:
+                response.headers['Content-Encoding'] = content_encoding
+
+    response.headers['Vary'] = 'Accept, Accept-Encoding'
+    response.headers['ETag'] = f'W/"{etag}"'
+    if last_modified(updated_at):
+        response.headers['Last-Modified'] = http_date(updated_at)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+# ========================================
+# Routes
+# ========================================
+
+async def get_visitors(request):
+    """List visitors newest first, one page at a time (?limit=&cursor=&fields=&tier=)"""
+    args = request.query_params
+    try:
+        limit = parse_limit(args.get('limit'))
+        fields = parse_fields(args.get('fields'), VISITOR_FIELDS)
+        tier = parse_tier(args)
+
+        def build(session):
+            visitors, next_cursor = fetch_page(
+                session, Visitor, 'created_at', fields, limit,
+                cursor=args.get('cursor'),
+                formatters=VISITOR_FORMATTERS,
+                sources=tier_sources(Visitor, tier),
+            )
+            return {'visitors': visitors, 'next_cursor': next_cursor}
+
+        return await cached_json(request, build)
+    except (PaginationError, ArchiveError) as e:
+        return json_response({'error': str(e)}, 400)
+
+
+async def search_visitors(request):
+    """Ranked search: ?q=<words>&phone=<digits>&phone_match=prefix|suffix|contains&tier="""
+    if not app_smart_search.search_available:
+        return json_response({'error': 'search index is not available'}, 503)
+    args = request.query_params
+    try:
+        q, phone, phone_match, limit, offset = parse_search_args(args)
+        fields = parse_fields(args.get('fields'), VISITOR_FIELDS)
+        tier = parse_tier(args)
+    except (SearchError, PaginationError, ArchiveError) as e:
+        return json_response({'error': str(e)}, 400)
+
+    return await cached_json(request, lambda session: search_page(
+        session, q, phone, phone_match, fields, limit, offset, tier))
+
+
+async def stream_visitors(request):
+    """Server-sent events: insert/delete deltas as they are committed"""
+    last_id = parse_last_event_id(
+        request.headers.get('last-event-id') or request.query_params.get('last_event_id'))
+    return StreamingResponse(
+        visitor_feed.astream(last_id, read_version),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+
+async def suggest_visitors(request):
+    """Returning visitors whose name words or phone start with ?q=, newest visit first"""
+    try:
+        q, limit = parse_suggest_args(request.query_params)
+    except SuggestError as e:
+        return json_response({'error': str(e)}, 400)
+    # Answered on the event loop; only a stale index goes to the pool
+    if suggest_index.needs_sync() and not suggest_index.is_current(await read_version()):
+        await blocking.run(load_suggestions)
+    return json_response({'suggestions': suggest_index.suggest(q, limit)})
+
+
+async def add_visitor(request):
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    if not isinstance(data, dict):
+        return json_response({'error': 'request body must be a JSON object'}, 400)
+    error = validate_visitor(data)
+    if error:
+        return json_response({'error': error}, 400)
+
+    def write(session):
+        visitor = Visitor(**visitor_params(data))
+        session.add(visitor)
+        version = bump_version(session)
+        delta = RollupDelta()
+        delta.visit(visitor.created_at, visitor.purpose)
+        delta.apply(session)
+        return version, visitor.to_dict(), visitor_row(visitor)
+
+    try:
+        async with sessions() as session:
+            version, created, row = await session.run_sync(write)
+            with phase('db_commit'):
+                await session.commit()
+    except Exception as e:
+        return json_response({'error': str(e)}, 500)
+
+    # Queue for Excel; the exporter thread writes it shortly
+    excel_exporter.submit_add(row)
+    visitor_feed.publish(version, 'insert', {'visitors': [created]})
+    suggest_index.add([suggestion(created)], version)
+    return json_response({'message': 'Visitor added successfully', 'visitor': created}, 201)
+
+
+async def delete_visitor(request):
+    visitor_id = request.path_params['visitor_id']
+
+    def write(session):
+        visitor = session.get(Visitor, visitor_id)
+        if visitor is None:
+            return None
+        delta = RollupDelta()
+        delta.remove(visitor.created_at, visitor.purpose)
+        session.delete(visitor)
+        version = bump_version(session)
+        delta.apply(session)
+        return version
+
+    try:
+        async with sessions() as session:
+            version = await session.run_sync(write)
+            if version is None:
+                return json_response({'error': 'Visitor not found'}, 404)
+            with phase('db_commit'):
+                await session.commit()
+    except Exception as e:
+        return json_response({'error': str(e)}, 500)
+
+    excel_exporter.submit_delete([visitor_id])
+    visitor_feed.publish(version, 'delete', {'ids': [visitor_id]})
+    suggest_index.remove([visitor_id], version)
+    return json_response({'message': 'Visitor deleted successfully'})
+
+
+async def delete_visitors(request):
+    """Delete many visitors at once: {"ids": [1, 2, 3]}"""
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    ids = data.get('ids') if isinstance(data, dict) else None
+    if not isinstance(ids, list) or not ids:
+        return json_response({'error': 'ids must be a non-empty list'}, 400)
+    if len(ids) > MAX_BATCH_DELETE:
+        return json_response({'error': f'at most {MAX_BATCH_DELETE} ids per request'}, 400)
+    try:
+        ids = {int(visitor_id) for visitor_id in ids}
+    except (TypeError, ValueError):
+        return json_response({'error': 'ids must be numbers'}, 400)
+
+    def write(session):
+        rows = (session.query(Visitor.id, Visitor.created_at, Visitor.purpose)
+                .filter(Visitor.id.in_(ids)).all())
+        found = [row.id for row in rows]
+        if not found:
+            return found, None
+        delta = RollupDelta()
+        for row in rows:
+            delta.remove(row.created_at, row.purpose)
+        session.query(Visitor).filter(Visitor.id.in_(found)).delete(synchronize_session=False)
+        version = bump_version(session)
+        delta.apply(session)
+        return found, version
+
+    try:
+        async with sessions() as session:
+            found, version = await session.run_sync(write)
+            if found:
+                with phase('db_commit'):
+                    await session.commit()
+    except Exception as e:
+        return json_response({'error': str(e)}, 500)
+
+    if found:
+        excel_exporter.submit_delete(found)
+        visitor_feed.publish(version, 'delete', {'ids': found})
+        suggest_index.remove(found, version)
+    return json_response({
+        'message': f'{len(found)} visitors deleted successfully',
+        'deleted': sorted(found),
+        'not_found': sorted(ids - set(found))
+    })
+
+
+async def bulk_add_visitors(request):
+    """Import many visitors from a JSON, NDJSON, CSV or XLSX upload"""
+    explicit = request.query_params.get('format')
+    try:
+        if request_mimetype(request) == 'multipart/form-data':
+            upload = (await request.form()).get('file')
+            if upload is None or isinstance(upload, str):
+                raise ImportFormatError('multipart upload needs a "file" field')
+            fmt = detect_format(upload.content_type, upload.filename, explicit)
+            stream = upload.file
+        else:
+            fmt = detect_format(request_mimetype(request), explicit=explicit)
+            stream = await spool_body(request)
+        # Parsing and the inserts are blocking; the whole import runs on the pool
+        report = await blocking.run(import_visitors, stream, fmt)
+    except ImportFormatError as e:
+        return json_response({'error': str(e)}, 400)
+    except ServerBusy as e:
+        return json_response({'error': str(e)}, 503, headers={'Retry-After': '5'})
+    except Exception as e:
+        return json_response({'error': str(e)}, 500)
+
+    report['message'] = f"{report['inserted']} visitors imported successfully"
+    return json_response(report, 201 if report['inserted'] else 400)
+
+
+async def export_visitors(request):
+    """Download visitors as CSV or XLSX (?format=csv|xlsx&from=&to=), streamed"""
+    args = request.query_params
+    fmt = args.get('format', 'csv')
+    if fmt not in ('csv', 'xlsx'):
+        return json_response({'error': 'format must be csv or xlsx'}, 400)
+    try:
+        start = parse_export_day(args.get('from'), 'from')
+        end = parse_export_day(args.get('to'), 'to')
+    except ValueError as e:
+        return json_response({'error': str(e)}, 400)
+
+    gzip = 'gzip' in request.headers.get('accept-encoding', '')
+
+    def produce():
+        body, mimetype, headers = export_body(fmt, start, end, gzip=gzip)
+        # Headers first: the response starts before the first row is read
+        yield mimetype, headers
+        yield from body
+
+    try:
+        chunks = blocking.iterate(produce)
+    except ServerBusy as e:
+        return json_response({'error': str(e)}, 503, headers={'Retry-After': '5'})
+    try:
+        # Errors before the first row (the query, the workbook setup) still get a JSON answer
+        mimetype, headers = await chunks.__anext__()
+    except Exception as e:
+        return json_response({'error': str(e)}, 500)
+    return StreamingResponse(chunks, media_type=mimetype, headers=headers)
+
+
+async def get_stats(request):
+    """Visit totals for a date range"""
+    try:
+        start, end = parse_range(request.query_params)
+    except StatsError as e:
+        return json_response({'error': str(e)}, 400)
+    return await cached_json(request, lambda session: summary(session, start, end))
+
+
+async def get_stats_view(request):
+    """Per-day, per-hour-of-day or per-purpose visit counts for a date range"""
+    view = request.path_params['view']
+    if view not in STATS_VIEWS:
+        return json_response({'error': f'unknown stats view: {view}'}, 404)
+    try:
+        start, end = parse_range(request.query_params)
+    except StatsError as e:
+        return json_response({'error': str(e)}, 400)
+
+    def build(session):
+        return {'from': start.isoformat(), 'to': end.isoformat(),
+                view: STATS_VIEWS[view](session, start, end)}
+
+    return await cached_json(request, build)
+
+
+async def get_excel_location(request):
+    """API endpoint to get current Excel file location"""
+    try:
+        return json_response(await blocking.run(excel_location))
+    except ServerBusy as e:
+        return json_response({'error': str(e)}, 503, headers={'Retry-After': '5'})
+
+
+# ========================================
+# Metrics (GET /metrics; see metrics.py)
+# ========================================
+
+app_gauges = Registry()
+app_gauges.gauge('visitor_db_pool_connections', 'Database pool connections by state',
+                 lambda: pool_stats(engine.sync_engine) if engine else None, label='state')
+app_gauges.gauge('visitor_blocking_jobs', 'Blocking jobs running or waiting for a thread',
+                 lambda: blocking.jobs)
+for gauge in METRIC_GAUGES:
+    app_gauges.add(gauge)
+
+
+async def get_metrics(request):
+    return Response(registry.render() + app_gauges.render(),
+                    headers={'Content-Type': CONTENT_TYPE})
+
+
+class RequestTimer:
+    """ASGI middleware: visitor_request_seconds up to the response headers"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+
+        async def timed_send(message):
+            if message['type'] == 'http.response.start':
+                endpoint = scope.get('endpoint')
+                route = ROUTE_PATHS.get(endpoint, 'unmatched')
+                REQUEST_SECONDS.observe(time.perf_counter() - started, scope['method'],
+                                        route, message['status'])
+            await send(message)
+
+        await self.app(scope, receive, timed_send)
+
+
+routes = [
+    Route('/api/visitors', get_visitors, methods=['GET']),
+    Route('/api/visitors', add_visitor, methods=['POST']),
+    Route('/api/visitors', delete_visitors, methods=['DELETE']),
+    Route('/api/visitors/search', search_visitors, methods=['GET']),
+    Route('/api/visitors/stream', stream_visitors, methods=['GET']),
+    Route('/api/visitors/suggest', suggest_visitors, methods=['GET']),
+    Route('/api/visitors/bulk', bulk_add_visitors, methods=['POST']),
+    Route('/api/visitors/export', export_visitors, methods=['GET']),
+    Route('/api/visitors/{visitor_id:int}', delete_visitor, methods=['DELETE']),
+    Route('/api/stats', get_stats, methods=['GET']),
+    Route('/api/stats/{view}', get_stats_view, methods=['GET']),
+    Route('/api/excel-location', get_excel_location, methods=['GET']),
+    Route('/metrics', get_metrics, methods=['GET']),
+]
+
+# Metric labels use the route pattern, not the concrete URL
+ROUTE_PATHS = {route.endpoint: route.path for route in routes}
+
+
+@asynccontextmanager
+async def lifespan(_):
+    global engine, sessions
+    await blocking.run(app_smart_search.initialize)
+    engine = make_engine()
+    sessions = async_sessionmaker(engine, expire_on_commit=False)
+    # Flask starts it before the first request, which never runs here
+    excel_reconciler.ensure_started(flask_app)
+    try:
+        yield
+    finally:
+        await blocking.run(excel_reconciler.stop)
+        # Let queued Excel changes reach the workbook before exiting
+        await blocking.run(excel_exporter.flush)
+        await engine.dispose()
+
+
+app = Starlette(
+    routes=routes,
+    middleware=[
+        Middleware(RequestTimer),
+        Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'],
+                   allow_headers=['*']),
+    ],
+    lifespan=lifespan,
+)
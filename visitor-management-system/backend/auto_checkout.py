@@ -0,0 +1,127 @@
+"""
+END-OF-DAY AUTO-CHECKOUT
+Visitors who leave without checking out would otherwise stay "inside" for
+ever. Opt in with AUTO_CHECKOUT_AT=HH:MM (server local time; off by
+default): every day at that time every visit still open from before that
+moment is closed, each checked out at the end of the day it started, so a
+forgotten checkout costs at most one day of stay time in the stats.
+
+The scheduler is a daemon thread per worker, started lazily. Each run
+only closes visits that are still open, so several workers (or a run that
+overlaps with `flask --app app auto-checkout`) simply find nothing left
+to do. When it starts it first catches up on the most recent end of day,
+in case the server was down at the time.
+"""
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+# Longest single sleep, so clock and timezone changes are noticed
+MAX_SLEEP_SECONDS = 60
+
+
+def parse_time_of_day(raw):
+    """'HH:MM' as a datetime.time, or None for '', 'off' and the like"""
+    raw = (raw or '').strip().lower()
+    if raw in ('', 'off', 'none', 'false', '0'):
+        return None
+    try:
+        return datetime.strptime(raw, '%H:%M').time()
+    except ValueError:
+        raise ValueError(f'AUTO_CHECKOUT_AT must be HH:MM or off, not {raw!r}')
+
+
+# Off unless set: it changes what is stored for visits left open
+AUTO_CHECKOUT_AT = parse_time_of_day(os.getenv('AUTO_CHECKOUT_AT', 'off'))
+
+
+def _utc(local_moment):
+    """Aware local datetime -> naive UTC, like the stored timestamps"""
+    return local_moment.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _local_moment(day, at):
+    return datetime.combine(day, at).astimezone()
+
+
+def last_cutoff(at, now=None):
+    """The most recent end of day at or before now, as naive UTC"""
+    now = (now or datetime.now()).astimezone()
+    moment = _local_moment(now.date(), at)
+    if moment > now:
+        moment = _local_moment(now.date() - timedelta(days=1), at)
+    return _utc(moment)
+
+
+def next_cutoff(at, now=None):
+    """The first end of day after now, as naive UTC"""
+    now = (now or datetime.now()).astimezone()
+    moment = _local_moment(now.date(), at)
+    if moment <= now:
+        moment = _local_moment(now.date() + timedelta(days=1), at)
+    return _utc(moment)
+
+
+def closing_time(check_in, at):
+    """When a visit that checked in at check_in (naive UTC) is auto-closed"""
+    local = check_in.replace(tzinfo=timezone.utc).astimezone()
+    return next_cutoff(at, local)
+
+
+class DailyCheckout:
+    """
+    Daemon thread calling job(cutoff) - close visits opened before cutoff -
+    once at start and then at every end of day, inside the Flask app context
+    """
+
+    def __init__(self, job, at=AUTO_CHECKOUT_AT):
+        self.job = job
+        self.at = at
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+        self.runs = 0
+        self.errors = 0
+        self.last_run_at = None
+        self.last_closed = 0
+
+    def ensure_started(self, flask_app):
+        if self.at is None or self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, args=(flask_app,),
+                                                name='auto-checkout', daemon=True)
+                self._thread.start()
+
+    def _run(self, flask_app):
+        # Catch up on the end of day we may have been down for
+        self._fire(flask_app, last_cutoff(self.at))
+        while True:
+            cutoff = next_cutoff(self.at)
+            while datetime.utcnow() < cutoff:
+                remaining = (cutoff - datetime.utcnow()).total_seconds()
+                time.sleep(min(max(remaining, 0), MAX_SLEEP_SECONDS))
+            self._fire(flask_app, cutoff)
+
+    def _fire(self, flask_app, cutoff):
+        try:
+            with flask_app.app_context():
+                self.last_closed = len(self.job(cutoff))
+            self.runs += 1
+            self.last_run_at = datetime.now().isoformat(timespec='seconds')
+            if self.last_closed:
+                print(f"🌙 Auto-checkout: {self.last_closed} open visits closed")
+        except Exception as e:
+            self.errors += 1
+            print(f"⚠️ Auto-checkout failed: {e}")
+
+    def stats(self):
+        return {
+            'at': self.at.strftime('%H:%M') if self.at else None,
+            'runs': self.runs,
+            'errors': self.errors,
+            'last_run_at': self.last_run_at,
+            'last_closed': self.last_closed,
+        }
@@ -0,0 +1,14 @@
+"""
+BENCHMARKS - Offline performance suite for the SQLite backend
+Everything runs against app_smart_search.py with its database and Excel
+log in a scratch work directory, never the real ones.
+
+Run from the backend folder:
+    python -m benchmarks.seed --size 100k --workdir /tmp/vms-bench
+    python -m benchmarks.micro --workdir /tmp/vms-bench
+    python -m benchmarks.load --workdir /tmp/vms-bench --concurrency 16 --requests 5000
+
+Each command prints a summary and saves a JSON report (with the git
+commit it ran on) under benchmarks/results/, so runs on two commits can
+be compared side by side.
+"""
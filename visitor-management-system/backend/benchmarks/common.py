@@ -0,0 +1,110 @@
+"""
+Shared benchmark plumbing: scratch work directory, timing statistics and
+JSON reports
+"""
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(BACKEND_DIR, 'benchmarks', 'results')
+DEFAULT_WORKDIR = os.path.join(tempfile.gettempdir(), 'vms-bench')
+
+SIZES = {'10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+
+
+def parse_size(raw):
+    """'10k', '100k', '1m' or a plain number of visitors"""
+    raw = raw.lower()
+    if raw in SIZES:
+        return SIZES[raw]
+    try:
+        return int(raw)
+    except ValueError:
+        raise ValueError(f'size must be one of {", ".join(SIZES)} or a number')
+
+
+def load_app(workdir):
+    """
+    Import app_smart_search with its database and Excel log inside workdir.
+    Must run before anything else imports the app: both locations are
+    fixed when the module is first imported.
+    """
+    workdir = os.path.abspath(workdir)
+    os.makedirs(workdir, exist_ok=True)
+    sys.path.insert(0, BACKEND_DIR)
+    os.chdir(workdir)
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'visitors.db')}"
+
+    # Point the path resolver at a log in workdir so it never searches ~/Desktop
+    from excel_sink import write_workbook
+    excel_file = os.path.join(workdir, 'visitors_log.xlsx')
+    if not os.path.exists(excel_file):
+        write_workbook(excel_file, [])
+    with open('config.ini', 'w') as config:
+        config.write(f'[FILE_LOCATION]\nexcel_path = {excel_file}\n')
+
+    import app_smart_search
+    app_smart_search.initialize()
+    return app_smart_search
+
+
+def summarize(samples):
+    """Latency statistics (milliseconds) for a list of durations in seconds"""
+    if not samples:
+        return {'count': 0}
+    ordered = sorted(samples)
+
+    def percentile(p):
+        # Nearest-rank percentile
+        index = max(math.ceil(p / 100 * len(ordered)) - 1, 0)
+        return ordered[index] * 1000
+
+    return {
+        'count': len(ordered),
+        'min_ms': round(ordered[0] * 1000, 3),
+        'mean_ms': round(sum(ordered) / len(ordered) * 1000, 3),
+        'p50_ms': round(percentile(50), 3),
+        'p95_ms': round(percentile(95), 3),
+        'p99_ms': round(percentile(99), 3),
+        'max_ms': round(ordered[-1] * 1000, 3),
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR,
+            capture_output=True, text=True, timeout=5,
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def environment():
+    """What the numbers were measured on"""
+    return {
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+    }
+
+
+def save_report(name, report, output=None):
+    """Write the report as JSON (default benchmarks/results/<name>-<commit>-<time>.json)"""
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        commit = report.get('environment', {}).get('commit') or 'nogit'
+        output = os.path.join(RESULTS_DIR, f'{name}-{commit}-{stamp}.json')
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2, default=str)
+    print(f"💾 Report saved to: {output}")
+    return output
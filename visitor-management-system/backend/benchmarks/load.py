@@ -0,0 +1,209 @@
+"""
+Concurrent HTTP load driver
+
+    python -m benchmarks.load [--workdir DIR] [--concurrency 16] [--requests 5000]
+    python -m benchmarks.load --url http://localhost:5000 --duration 60
+
+Without --url the SQLite app is served from the work directory on a
+local port by a threaded WSGI server in this process, so nothing outside
+the machine is touched. Each worker thread keeps one HTTP connection and
+picks requests from --mix:
+  list    GET /api/visitors (first page, then following next_cursor)
+  add     POST /api/visitors
+  delete  DELETE /api/visitors/<id> of a visitor this run added
+  search  GET /api/visitors/search?q=<name>
+
+Reports p50/p95/p99 latency per request kind, errors and throughput.
+"""
+import argparse
+import http.client
+import json
+import random
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+from benchmarks.common import DEFAULT_WORKDIR, environment, load_app, save_report, summarize
+
+DEFAULT_MIX = 'list=70,add=20,delete=5,search=5'
+SEARCH_TERMS = ['Priya', 'Sharma', 'Interview', 'Meeting', 'Chen', 'Demo']
+
+
+def parse_mix(raw):
+    """'list=70,add=20' -> [('list', 70), ('add', 20)]"""
+    mix = []
+    for part in raw.split(','):
+        kind, _, weight = part.partition('=')
+        if kind not in ('list', 'add', 'delete', 'search'):
+            raise ValueError(f'unknown request kind in mix: {kind}')
+        mix.append((kind, int(weight or 1)))
+    return mix
+
+
+class Driver:
+    """Shared state of one load run"""
+
+    def __init__(self, base_url, mix, total, duration, seed):
+        parts = urlsplit(base_url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.prefix = parts.path.rstrip('/')
+        self.kinds = [kind for kind, _ in mix]
+        self.weights = [weight for _, weight in mix]
+        self.total = total
+        self.deadline = time.monotonic() + duration if duration else None
+        self.seed = seed
+
+        self._lock = threading.Lock()
+        self._issued = 0
+        self.samples = {kind: [] for kind in self.kinds}
+        self.errors = {kind: 0 for kind in self.kinds}
+        self.added_ids = []
+        self.next_cursor = None
+
+    def _claim(self):
+        with self._lock:
+            if self.total and self._issued >= self.total:
+                return False
+            if self.deadline and time.monotonic() >= self.deadline:
+                return False
+            self._issued += 1
+            return True
+
+    def _request(self, kind, rng):
+        if kind == 'add':
+            body = json.dumps({
+                'name': f'Load Test {rng.randrange(10**6)}', 'phone': f'8{rng.randrange(10**9):09d}',
+                'date': time.strftime('%Y-%m-%d'), 'purpose': 'Load test', 'comments': '',
+            })
+            return 'POST', '/api/visitors', body
+        if kind == 'delete':
+            with self._lock:
+                visitor_id = self.added_ids.pop() if self.added_ids else None
+            if visitor_id is None:
+                return None
+            return 'DELETE', f'/api/visitors/{visitor_id}', None
+        if kind == 'search':
+            return 'GET', f'/api/visitors/search?q={rng.choice(SEARCH_TERMS)}', None
+        cursor = self.next_cursor if rng.random() < 0.3 else None
+        return 'GET', '/api/visitors' + (f'?cursor={cursor}' if cursor else ''), None
+
+    def _record(self, kind, elapsed, status, data):
+        with self._lock:
+            if status >= 400:
+                self.errors[kind] += 1
+                return
+            self.samples[kind].append(elapsed)
+            if kind == 'add':
+                self.added_ids.append(json.loads(data)['visitor']['id'])
+            elif kind == 'list' and data:
+                self.next_cursor = json.loads(data).get('next_cursor')
+
+    def worker(self, index):
+        rng = random.Random(self.seed + index)
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        headers = {'Content-Type': 'application/json'}
+        while self._claim():
+            kind = rng.choices(self.kinds, self.weights)[0]
+            request = self._request(kind, rng)
+            if request is None:
+                kind, request = 'list', self._request('list', rng)
+            method, path, body = request
+            started = time.perf_counter()
+            try:
+                conn.request(method, self.prefix + path, body=body, headers=headers)
+                response = conn.getresponse()
+                data = response.read()
+                status = response.status
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+                data, status = b'', 599
+            self._record(kind, time.perf_counter() - started, status, data)
+        conn.close()
+
+
+def serve_local(workdir):
+    """Serve the SQLite app from workdir on a free local port; returns its URL"""
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    app_module = load_app(workdir)
+    server = make_server('127.0.0.1', 0, app_module.app, threaded=True,
+                         request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_port}', app_module
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Concurrent HTTP load test')
+    parser.add_argument('--url', help='running backend to test (default: serve the work directory)')
+    parser.add_argument('--workdir', default=DEFAULT_WORKDIR, help=f'default: {DEFAULT_WORKDIR}')
+    parser.add_argument('--concurrency', type=int, default=16, help='parallel connections')
+    parser.add_argument('--requests', type=int, default=2000, help='total requests (default: 2000)')
+    parser.add_argument('--duration', type=float, default=0, help='run for this many seconds instead')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f'request mix (default: {DEFAULT_MIX})')
+    parser.add_argument('--seed', type=int, default=42, help='random seed')
+    parser.add_argument('--output', help='report path (default: benchmarks/results/)')
+    args = parser.parse_args(argv)
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+    total = 0 if args.duration else args.requests
+    if not total and not args.duration:
+        parser.error('give --requests or --duration')
+
+    app_module = None
+    url = args.url
+    if not url:
+        url, app_module = serve_local(args.workdir)
+
+    driver = Driver(url, mix, total, args.duration, args.seed)
+    print(f"🚦 {args.concurrency} connections against {url} ({args.mix})")
+    threads = [threading.Thread(target=driver.worker, args=(i,)) for i in range(args.concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    if app_module:
+        # Let the write-behind exporter finish so its cost is not left behind
+        app_module.excel_exporter.flush()
+
+    completed = sum(len(samples) for samples in driver.samples.values())
+    errors = sum(driver.errors.values())
+    all_samples = [s for samples in driver.samples.values() for s in samples]
+    report = {
+        'benchmark': 'load',
+        'environment': environment(),
+        'url': url if args.url else 'local',
+        'concurrency': args.concurrency,
+        'mix': dict(mix),
+        'elapsed_seconds': round(elapsed, 3),
+        'completed': completed,
+        'errors': errors,
+        'throughput_rps': round(completed / elapsed, 1) if elapsed else None,
+        'overall': summarize(all_samples),
+        'requests': {
+            kind: dict(summarize(samples), errors=driver.errors[kind])
+            for kind, samples in driver.samples.items()
+        },
+    }
+
+    print(f"   {completed} requests in {elapsed:.1f}s = {report['throughput_rps']} req/s, {errors} errors")
+    for kind, stats in report['requests'].items():
+        if stats['count']:
+            print(f"   {kind:8} p50 {stats['p50_ms']:>9.2f} ms   p95 {stats['p95_ms']:>9.2f} ms"
+                  f"   p99 {stats['p99_ms']:>9.2f} ms   ({stats['count']} ok, {stats['errors']} errors)")
+    save_report('load', report, args.output)
+    return 0 if not errors else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
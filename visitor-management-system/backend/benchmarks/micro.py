@@ -0,0 +1,139 @@
+"""
+Micro-benchmarks for the Excel and serialization hot spots
+
+    python -m benchmarks.micro [--workdir DIR] [--repeat 5]
+
+Measures, against whatever the work directory was seeded with:
+  - ExcelExporter.submit_add(): what a check-in pays to hand its row to
+    the write-behind exporter
+  - ExcelSink.append(): journaling one visitor row, as the exporter does
+    (the slowest calls are the ones that hit the automatic compaction)
+  - compaction: folding a full journal into the workbook
+  - rebuild_excel(): regenerating the whole workbook from the DB
+  - to_dict(): serializing a page of ORM visitors, next to the column
+    tuples the list endpoint actually reads
+  - encoding a page of tuples as the list endpoint does (encoding.py):
+    JSON records, JSON columns, MessagePack and gzip, next to to_dict()
+    plus stdlib json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+from benchmarks.common import DEFAULT_WORKDIR, environment, load_app, save_report, summarize
+
+
+def timed(fn, repeat):
+    """Durations (seconds) of repeat calls to fn()"""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Excel and serialization micro-benchmarks')
+    parser.add_argument('--workdir', default=DEFAULT_WORKDIR, help=f'default: {DEFAULT_WORKDIR}')
+    parser.add_argument('--repeat', type=int, default=5, help='runs of the slow benchmarks')
+    parser.add_argument('--appends', type=int, default=200, help='submit_add and append calls to time')
+    parser.add_argument('--page', type=int, default=500, help='visitors per to_dict page')
+    parser.add_argument('--output', help='report path (default: benchmarks/results/)')
+    args = parser.parse_args(argv)
+
+    app_module = load_app(args.workdir)
+    app, db, Visitor = app_module.app, app_module.db, app_module.Visitor
+    # Time the calls themselves, not their progress messages
+    quiet = open(os.devnull, 'w')
+
+    results = {}
+    with app.app_context():
+        total = db.session.query(Visitor.id).count()
+        excel_file = app_module.update_excel_path_if_moved()
+        print(f"⏱️ Benchmarking against {total} visitors")
+
+        sample = db.session.query(Visitor).order_by(Visitor.id.desc()).first()
+        if sample is not None:
+            stdout, sys.stdout = sys.stdout, quiet
+            try:
+                row = app_module.visitor_row(sample)
+                sink, exporter = app_module.excel_sink, app_module.excel_exporter
+                submits = timed(lambda: exporter.submit_add(row), args.appends)
+                exporter.flush()
+                appends = timed(lambda: sink.append(excel_file, [row]), args.appends)
+                compaction = []
+                for _ in range(args.repeat):
+                    # Just under the threshold, so append() does not compact itself
+                    sink.compact(excel_file)
+                    sink.append(excel_file, [app_module.visitor_row(sample)] * (sink.compact_every - 1))
+                    compaction += timed(lambda: sink.compact(excel_file), 1)
+            finally:
+                sys.stdout = stdout
+            results['exporter_submit_add'] = summarize(submits)
+            results['excel_append'] = summarize(appends)
+            results['compact_journal'] = summarize(compaction)
+
+        stdout, sys.stdout = sys.stdout, quiet
+        try:
+            results['rebuild_excel'] = summarize(timed(app_module.rebuild_excel, args.repeat))
+        finally:
+            sys.stdout = stdout
+        results['rebuild_excel']['rows_per_second'] = (
+            round(total / (results['rebuild_excel']['p50_ms'] / 1000))
+            if results['rebuild_excel']['p50_ms'] else None
+        )
+        results['excel_file_bytes'] = os.path.getsize(excel_file)
+
+        page = (db.session.query(Visitor).order_by(Visitor.created_at.desc())
+                .limit(args.page).all())
+        results['to_dict_page'] = summarize(timed(
+            lambda: [visitor.to_dict() for visitor in page], args.repeat * 20))
+        results['tuple_page'] = summarize(timed(
+            lambda: app_module.fetch_page(db.session, Visitor, 'created_at',
+                                          app_module.VISITOR_FIELDS, args.page,
+                                          formatters=app_module.VISITOR_FORMATTERS),
+            args.repeat * 20))
+
+        import encoding
+        rows, _ = app_module.fetch_page(db.session, Visitor, 'created_at',
+                                        app_module.VISITOR_FIELDS, args.page,
+                                        formatters=app_module.VISITOR_FORMATTERS)
+        payload = {'visitors': rows, 'next_cursor': None}
+        encodings = {
+            'stdlib_json_page': lambda: json.dumps(
+                {'visitors': [visitor.to_dict() for visitor in page]}, sort_keys=True),
+            'encode_records_page': lambda: encoding.encode(payload),
+            'encode_columns_page': lambda: encoding.encode(payload, layout='columns'),
+            'encode_gzip_page': lambda: encoding.encode(payload, coding='gzip'),
+        }
+        if encoding.msgpack is not None:
+            encodings['encode_msgpack_page'] = lambda: encoding.encode(payload, encoding.MSGPACK)
+        for name, encode in encodings.items():
+            results[name] = summarize(timed(encode, args.repeat * 20))
+        for name, layout, coding in (('records', 'records', None), ('columns', 'columns', None),
+                                     ('records_gzip', 'records', 'gzip')):
+            results[f'page_bytes_{name}'] = len(encoding.encode(payload, layout=layout,
+                                                                coding=coding)[0])
+        db.session.rollback()
+
+    quiet.close()
+    for name, stats in results.items():
+        if isinstance(stats, dict):
+            print(f"   {name:24} p50 {stats['p50_ms']:>10.3f} ms   p99 {stats['p99_ms']:>10.3f} ms")
+
+    report = {
+        'benchmark': 'micro',
+        'environment': environment(),
+        'visitors': total,
+        'page_size': args.page,
+        'results': results,
+    }
+    save_report('micro', report, args.output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
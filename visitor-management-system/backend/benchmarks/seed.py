@@ -0,0 +1,124 @@
+"""
+Seed the benchmark database with generated visitors
+
+    python -m benchmarks.seed --size 10k|100k|1m [--workdir DIR] [--reset]
+
+Visitors are spread over the last --days days (mostly office hours) with
+a fixed random seed, so the same size always gives the same data. The
+analytics rollups and the Excel log are rebuilt afterwards, so the app
+starts in the state it would have reached by adding them one by one.
+"""
+import argparse
+import glob
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.common import DEFAULT_WORKDIR, environment, load_app, parse_size, save_report
+
+INSERT_CHUNK = 5000
+
+FIRST_NAMES = ['Aarav', 'Priya', 'Rahul', 'Ananya', 'Vikram', 'Divya', 'Arjun', 'Meera',
+               'Karthik', 'Sneha', 'John', 'Maria', 'Wei', 'Fatima', 'Lucas', 'Emma']
+LAST_NAMES = ['Sharma', 'Iyer', 'Reddy', 'Nair', 'Kumar', 'Patel', 'Singh', 'Rao',
+              'Smith', 'Garcia', 'Chen', 'Khan', 'Silva', 'Müller', 'Brown', 'Das']
+PURPOSES = ['Interview', 'Meeting', 'Training', 'Delivery', 'Demo', 'Admission enquiry',
+            'Vendor visit', 'Maintenance', 'Guest lecture', 'Other']
+COMMENTS = ['', '', '', 'Met HR', 'Needs visitor badge', 'Follow-up next week',
+            'Brought laptop', 'Parking pass issued']
+
+
+def generate(count, days, seed=42):
+    """Yield visitor dicts, oldest first"""
+    rng = random.Random(seed)
+    now = datetime.utcnow().replace(microsecond=0)
+    start = now - timedelta(days=days)
+    step = (now - start) / max(count, 1)
+
+    for i in range(count):
+        moment = start + step * i
+        # Most visits land between 08:00 and 19:00
+        hour = min(max(int(rng.gauss(13, 3)), 0), 23)
+        created_at = moment.replace(hour=hour, minute=rng.randrange(60), second=rng.randrange(60))
+        yield {
+            'name': f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+            'phone': f'9{rng.randrange(10**9):09d}',
+            'date': created_at.strftime('%Y-%m-%d'),
+            'purpose': rng.choice(PURPOSES),
+            'comments': rng.choice(COMMENTS),
+            'created_at': created_at,
+        }
+
+
+def _reset(workdir):
+    for path in glob.glob(os.path.join(workdir, 'visitors.db*')) + \
+            glob.glob(os.path.join(workdir, 'visitors_log.*')):
+        os.remove(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Seed the benchmark database')
+    parser.add_argument('--size', default='10k', help='10k, 100k, 1m or a number (default: 10k)')
+    parser.add_argument('--days', type=int, default=365, help='history to spread visits over')
+    parser.add_argument('--seed', type=int, default=42, help='random seed')
+    parser.add_argument('--workdir', default=DEFAULT_WORKDIR, help=f'default: {DEFAULT_WORKDIR}')
+    parser.add_argument('--reset', action='store_true', help='start from an empty database')
+    parser.add_argument('--no-excel', action='store_true', help='skip rebuilding the Excel log')
+    parser.add_argument('--output', help='report path (default: benchmarks/results/)')
+    args = parser.parse_args(argv)
+    try:
+        count = parse_size(args.size)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.reset:
+        _reset(os.path.abspath(args.workdir))
+    app_module = load_app(args.workdir)
+    app, db, Visitor = app_module.app, app_module.db, app_module.Visitor
+
+    phases = {}
+    with app.app_context():
+        print(f"🌱 Seeding {count} visitors into {args.workdir}...")
+        started = time.perf_counter()
+        batch = []
+        for seeded, visitor in enumerate(generate(count, args.days, args.seed), start=1):
+            batch.append(visitor)
+            if len(batch) >= INSERT_CHUNK:
+                db.session.execute(Visitor.__table__.insert(), batch)
+                db.session.commit()
+                batch = []
+                print(f"   ...{seeded} inserted")
+        if batch:
+            db.session.execute(Visitor.__table__.insert(), batch)
+            db.session.commit()
+        phases['insert_seconds'] = round(time.perf_counter() - started, 3)
+
+        # Also bumps the data version, so no cached list survives the seeding
+        started = time.perf_counter()
+        app_module.backfill_rollups()
+        phases['rollups_seconds'] = round(time.perf_counter() - started, 3)
+
+        if not args.no_excel:
+            started = time.perf_counter()
+            app_module.rebuild_excel()
+            phases['excel_seconds'] = round(time.perf_counter() - started, 3)
+
+        total = db.session.query(Visitor.id).count()
+
+    report = {
+        'benchmark': 'seed',
+        'environment': environment(),
+        'seeded': count,
+        'total_visitors': total,
+        'inserts_per_second': round(count / phases['insert_seconds']) if phases['insert_seconds'] else None,
+        'phases': phases,
+    }
+    print(f"✅ {total} visitors in the database ({report['inserts_per_second']} inserts/s)")
+    save_report('seed', report, args.output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,247 @@
+"""
+BULK VISITOR IMPORT
+Reads a batch of visitors from JSON, NDJSON, CSV or XLSX as a stream of
+records, validates each one with the app's own rules and hands the valid
+ones to the database in executemany chunks. The caller owns the
+transaction, so a batch is committed (or rolled back) as a whole.
+
+Command line (SQLite backend):
+    python bulk_import.py visitors.csv
+    python bulk_import.py walk_ins.xlsx --format xlsx
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import tempfile
+from datetime import date, datetime
+
+import openpyxl
+
+FORMATS = ('json', 'ndjson', 'csv', 'xlsx')
+INSERT_CHUNK = 500
+MAX_REPORTED_ERRORS = 1000
+
+# Uploads bigger than this are spooled to disk while the XLSX is read
+XLSX_SPOOL_BYTES = 8 * 1024 * 1024
+
+CONTENT_TYPES = {
+    'application/json': 'json',
+    'application/x-ndjson': 'ndjson',
+    'application/jsonl': 'ndjson',
+    'text/csv': 'csv',
+    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet': 'xlsx',
+}
+
+EXTENSIONS = {
+    '.json': 'json',
+    '.ndjson': 'ndjson',
+    '.jsonl': 'ndjson',
+    '.csv': 'csv',
+    '.xlsx': 'xlsx',
+}
+
+# Column headings from the Excel log (and common variants) -> field names
+HEADER_ALIASES = {
+    'phone number': 'phone',
+    'phone_number': 'phone',
+    'purpose of visit': 'purpose',
+    'comment': 'comments',
+}
+
+
+class ImportFormatError(ValueError):
+    """Raised when the upload cannot be read in the requested format"""
+
+
+def detect_format(content_type=None, filename=None, explicit=None):
+    """Pick the format from ?format=, the file extension or the content type"""
+    if explicit:
+        if explicit not in FORMATS:
+            raise ImportFormatError(f'format must be one of: {", ".join(FORMATS)}')
+        return explicit
+    if filename:
+        fmt = EXTENSIONS.get(os.path.splitext(filename)[1].lower())
+        if fmt:
+            return fmt
+    fmt = CONTENT_TYPES.get((content_type or '').split(';')[0].strip().lower())
+    if fmt:
+        return fmt
+    raise ImportFormatError('could not tell the upload format; pass ?format=json|ndjson|csv|xlsx')
+
+
+# ========================================
+# READERS
+# ========================================
+
+def _clean_key(key):
+    key = str(key or '').strip().lower()
+    return HEADER_ALIASES.get(key, key)
+
+
+def _clean_value(value):
+    """Everything is stored as text; spreadsheets hand us numbers and dates"""
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        value = value.date()
+    if isinstance(value, date):
+        return value.strftime('%Y-%m-%d')
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+def _record(mapping):
+    return {_clean_key(k): _clean_value(v) for k, v in mapping.items() if k is not None}
+
+
+def iter_records(stream, fmt):
+    """Yield one dict per visitor from a binary stream, without reading it all"""
+    if fmt == 'csv':
+        return _iter_csv(stream)
+    if fmt == 'ndjson':
+        return _iter_ndjson(stream)
+    if fmt == 'json':
+        return _iter_json(stream)
+    if fmt == 'xlsx':
+        return _iter_xlsx(stream)
+    raise ImportFormatError(f'format must be one of: {", ".join(FORMATS)}')
+
+
+def _text(stream):
+    if not isinstance(stream, io.BufferedIOBase):
+        stream = io.BufferedReader(stream)
+    return io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+
+
+def _iter_csv(stream):
+    try:
+        for row in csv.DictReader(_text(stream)):
+            yield _record(row)
+    except (csv.Error, UnicodeDecodeError) as e:
+        raise ImportFormatError(f'invalid CSV: {e}')
+
+
+def _iter_ndjson(stream):
+    for line_no, line in enumerate(_text(stream), start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError as e:
+            raise ImportFormatError(f'invalid JSON on line {line_no}: {e}')
+        yield _record(item) if isinstance(item, dict) else {}
+
+
+def _iter_json(stream):
+    # A JSON array has to be parsed whole; use NDJSON for very large batches
+    try:
+        items = json.load(_text(stream))
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ImportFormatError(f'invalid JSON: {e}')
+    if isinstance(items, dict):
+        items = items.get('visitors', [])
+    if not isinstance(items, list):
+        raise ImportFormatError('JSON body must be a list of visitors')
+    for item in items:
+        yield _record(item) if isinstance(item, dict) else {}
+
+
+def _iter_xlsx(stream):
+    # openpyxl needs a seekable file; large uploads spill to disk, not memory
+    with tempfile.SpooledTemporaryFile(max_size=XLSX_SPOOL_BYTES) as spool:
+        while True:
+            chunk = stream.read(64 * 1024)
+            if not chunk:
+                break
+            spool.write(chunk)
+        spool.seek(0)
+
+        try:
+            wb = openpyxl.load_workbook(spool, read_only=True, data_only=True)
+        except Exception as e:
+            raise ImportFormatError(f'invalid XLSX: {e}')
+        try:
+            rows = wb.active.iter_rows(values_only=True)
+            headers = next(rows, None)
+            if not headers:
+                return
+            for row in rows:
+                if any(value is not None for value in row):
+                    yield _record(dict(zip(headers, row)))
+        finally:
+            wb.close()
+
+
+# ========================================
+# IMPORT
+# ========================================
+
+def import_records(records, validate, insert_chunk, chunk_size=INSERT_CHUNK):
+    """
+    Validate records and pass the valid ones to insert_chunk() in lists of
+    chunk_size. validate(record) returns an error message or None.
+    Returns a report with per-row errors (row numbers start at 1).
+    """
+    report = {'inserted': 0, 'failed': 0, 'errors': []}
+    batch = []
+
+    for row_no, record in enumerate(records, start=1):
+        error = validate(record)
+        if error:
+            report['failed'] += 1
+            if len(report['errors']) < MAX_REPORTED_ERRORS:
+                report['errors'].append({'row': row_no, 'error': error})
+            continue
+
+        batch.append(record)
+        if len(batch) >= chunk_size:
+            insert_chunk(batch)
+            report['inserted'] += len(batch)
+            batch = []
+
+    if batch:
+        insert_chunk(batch)
+        report['inserted'] += len(batch)
+
+    report['errors_truncated'] = report['failed'] > len(report['errors'])
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Import visitors from a JSON, NDJSON, CSV or XLSX file')
+    parser.add_argument('path', help='file to import')
+    parser.add_argument('--format', choices=FORMATS,
+                        help='file format (default: from the extension)')
+    args = parser.parse_args(argv)
+
+    try:
+        fmt = detect_format(filename=args.path, explicit=args.format)
+    except ImportFormatError as e:
+        parser.error(str(e))
+
+    from app_smart_search import app, excel_exporter, import_visitors, initialize
+
+    initialize(app)
+
+    with open(args.path, 'rb') as upload, app.app_context():
+        try:
+            report = import_visitors(upload, fmt)
+        except ImportFormatError as e:
+            print(f"❌ {e}")
+            return 1
+    excel_exporter.flush()
+
+    print(f"✅ Imported {report['inserted']} visitors, {report['failed']} rejected")
+    for error in report['errors']:
+        print(f"   Row {error['row']}: {error['error']}")
+    return 0 if report['inserted'] or not report['failed'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -32,13 +32,15 @@ EXCEL_FILE_PATH = 'Inceptez_Visitors_Log.xlsx'
 # Get absolute path
 EXCEL_FILE_PATH = os.path.abspath(EXCEL_FILE_PATH)
 
-print(f"\n{'='*70}")
-print(f"📊 EXCEL FILE WILL BE SAVED TO:")
-print(f"   {EXCEL_FILE_PATH}")
-print(f"")
-print(f"💡 This is in the BACKEND folder - easy to find!")
-print(f"   Just look in: visitor-management-system/backend/")
-print(f"{'='*70}\n")
+# Run `python config.py` to see where the file goes (importing stays quiet)
+if __name__ == '__main__':
+    print(f"\n{'='*70}")
+    print(f"📊 EXCEL FILE WILL BE SAVED TO:")
+    print(f"   {EXCEL_FILE_PATH}")
+    print(f"")
+    print(f"💡 This is in the BACKEND folder - easy to find!")
+    print(f"   Just look in: visitor-management-system/backend/")
+    print(f"{'='*70}\n")
 
 
 
@@ -0,0 +1,167 @@
+"""
+RESPONSE ENCODING - Rows as tuples, fast JSON, MessagePack, compression
+List and search results go from the DB to the wire without per-row
+objects in between:
+  - fetch_page() and rows_by_ids() return Rows: the field names and the
+    tuples SQLAlchemy returned. Column formatters (created_at) run while
+    encoding, once per value.
+  - JSON is written by orjson when it is installed, stdlib json otherwise;
+    clients that send Accept: application/msgpack get MessagePack.
+  - ?layout=columns writes each Rows as one array per field
+    ({"id": [...], "name": [...]}) instead of one object per row: no
+    repeated keys, and no dict per row to build.
+  - Bodies of COMPRESS_MIN_BYTES or more are compressed with br or gzip,
+    whichever the client accepts.
+orjson, msgpack and brotli are optional: without them responses are
+stdlib JSON, JSON and gzip respectively.
+"""
+import gzip
+import json
+import os
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+JSON = 'application/json'
+MSGPACK = 'application/msgpack'
+# Older clients still ask for the pre-registration name
+MSGPACK_TYPES = (MSGPACK, 'application/x-msgpack')
+
+LAYOUTS = ('records', 'columns')
+
+# Smaller bodies are sent as they are: compressing them saves less than it costs
+COMPRESS_MIN_BYTES = int(os.getenv('RESPONSE_COMPRESS_MIN_BYTES', '1024'))
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+if orjson is not None:
+    # Sorted keys like Flask's provider, so bodies match across servers;
+    # datetimes go to _default() to keep Flask's HTTP-date format
+    ORJSON_OPTIONS = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+
+class EncodingError(ValueError):
+    """Raised for a bad ?layout= parameter"""
+
+
+class Rows:
+    """A result set as field names plus row tuples, formatted when encoded"""
+    __slots__ = ('fields', 'rows', 'formatters')
+
+    def __init__(self, fields, rows, formatters=None):
+        self.fields = list(fields)
+        self.rows = rows
+        formatters = formatters or {}
+        self.formatters = [(index, formatters[field]) for index, field in enumerate(self.fields)
+                           if field in formatters]
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        return iter(self.records())
+
+    def records(self):
+        """One dict per row"""
+        fields = self.fields
+        if not self.formatters:
+            return [dict(zip(fields, row)) for row in self.rows]
+        records = []
+        for row in self.rows:
+            values = list(row)
+            for index, fmt in self.formatters:
+                if values[index] is not None:
+                    values[index] = fmt(values[index])
+            records.append(dict(zip(fields, values)))
+        return records
+
+    def columns(self):
+        """One array per field"""
+        columns = dict(zip(self.fields, zip(*self.rows))) if self.rows else {}
+        for field in self.fields:
+            columns.setdefault(field, ())
+        for index, fmt in self.formatters:
+            field = self.fields[index]
+            columns[field] = [None if value is None else fmt(value) for value in columns[field]]
+        return columns
+
+
+def _default(layout='records'):
+    """Encoder fallback for what JSON and MessagePack cannot write themselves"""
+    def default(value):
+        if isinstance(value, Rows):
+            return value.columns() if layout == 'columns' else value.records()
+        # Dates (as HTTP dates), decimals, UUIDs: what Flask's provider writes
+        return DefaultJSONProvider.default(value)
+    return default
+
+
+def dumps(payload, layout='records'):
+    """Compact JSON bytes, sorted keys"""
+    if orjson is not None:
+        return orjson.dumps(payload, default=_default(layout), option=ORJSON_OPTIONS)
+    return json.dumps(payload, default=_default(layout), sort_keys=True,
+                      separators=(',', ':')).encode()
+
+
+def parse_layout(args):
+    """?layout=records (default) or columns"""
+    layout = args.get('layout') or 'records'
+    if layout not in LAYOUTS:
+        raise EncodingError(f'layout must be one of: {", ".join(LAYOUTS)}')
+    return layout
+
+
+def negotiate(accept):
+    """Media type for a werkzeug MIMEAccept: MessagePack if asked for and installed, else JSON"""
+    if msgpack is None:
+        return JSON
+    best = accept.best_match([JSON, *MSGPACK_TYPES], default=JSON)
+    return best if best in MSGPACK_TYPES else JSON
+
+
+def choose_coding(accept_encodings):
+    """'br', 'gzip' or None for a werkzeug Accept built from Accept-Encoding"""
+    return accept_encodings.best_match(['br', 'gzip'] if brotli is not None else ['gzip'])
+
+
+def encode(payload, media_type=JSON, layout='records', coding=None):
+    """
+    The response body for payload and the Content-Encoding it got (None
+    when it was too small to be worth compressing). Returns (body, coding).
+    """
+    if media_type in MSGPACK_TYPES:
+        body = msgpack.packb(payload, default=_default(layout), use_bin_type=True)
+    else:
+        body = dumps(payload, layout)
+    if not coding or len(body) < COMPRESS_MIN_BYTES:
+        return body, None
+    if coding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY), 'br'
+    # mtime=0: the same body always compresses to the same bytes
+    return gzip.compress(body, GZIP_LEVEL, mtime=0), 'gzip'
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask's JSON provider writing with orjson, so jsonify() gets it too"""
+
+    def dumps(self, obj, **kwargs):
+        # Pretty-printing (debug mode) and other options stay with stdlib json
+        if orjson is None or kwargs:
+            kwargs.setdefault('default', _default())
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=_default(), option=ORJSON_OPTIONS).decode()
@@ -0,0 +1,238 @@
+"""
+LIVE VISITOR FEED - Server-sent events
+Write paths publish a small delta after they commit (insert, delete,
+checkout), and every open GET .../visitors/stream receives it at once, so
+the frontend updates its list in place instead of refetching it.
+
+Event ids are the data version (see response_cache.py) the write
+committed, so they are the same sequence in every worker. The last
+EVENT_BUFFER events are kept in memory; a client that reconnects with
+Last-Event-ID gets what it missed from there. When the missed events are
+not all in this worker's buffer (too old, or written by another gunicorn
+worker) it gets a single `reset` event and reloads the list instead.
+
+Each open stream holds a worker thread, so run gunicorn with --threads.
+A worker keeps at most MAX_STREAMS of them open and answers 503 with
+Retry-After above that, so API calls always find a free thread; raise
+EVENT_STREAMS_PER_WORKER together with gunicorn's threads. Under the
+ASGI server (asgi.py) a stream is a coroutine waiting on an
+asyncio.Event instead, so hundreds of them cost no threads.
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+
+from flask import Response, json, jsonify, request
+
+# Events kept for Last-Event-ID resume
+EVENT_BUFFER = 1000
+
+# Keep-alive comment interval; the DB version is also checked this often
+HEARTBEAT_SECONDS = 10
+
+# A stream is closed after this long and the browser reconnects (and
+# resumes), so a vanished client cannot hold a thread for ever
+STREAM_MAX_SECONDS = 300
+
+# How long the browser waits before reconnecting
+RETRY_MS = 3000
+
+# Open streams per worker (Flask only); keep it below gunicorn's threads
+MAX_STREAMS = int(os.getenv('EVENT_STREAMS_PER_WORKER', '4'))
+
+# Retry-After for a stream turned away because the worker is full
+STREAMS_FULL_RETRY_SECONDS = 30
+
+# Writes touching more visitors than this publish `reset` instead
+MAX_EVENT_VISITORS = 100
+
+
+def _message(event_id, kind, data):
+    return f"id: {event_id}\nevent: {kind}\ndata: {data}\n\n"
+
+
+def parse_last_event_id(raw):
+    """Last-Event-ID header (or ?last_event_id=) as an int, or None"""
+    try:
+        return int(raw) if raw else None
+    except ValueError:
+        return None
+
+
+class EventFeed:
+    """Ring buffer of recent change events plus wake-ups for open streams"""
+
+    def __init__(self, size=EVENT_BUFFER):
+        self._events = deque(maxlen=size)
+        self._changed = threading.Condition()
+        # (event loop, asyncio.Event) of every open async stream
+        self._async_waiters = set()
+        self.published = 0
+        self.open_streams = 0
+        self.rejected_streams = 0
+
+    def publish(self, event_id, kind, payload):
+        """Record a committed change; event_id is the version the write made"""
+        # Serialized here, in the request, with the app's JSON settings
+        message = _message(event_id, kind, json.dumps(payload))
+        with self._changed:
+            self._events.append((event_id, message))
+            self.published += 1
+            self._changed.notify_all()
+            waiters = list(self._async_waiters)
+        for loop, wake in waiters:
+            # publish() may run on any thread, e.g. the ASGI server's executor
+            try:
+                loop.call_soon_threadsafe(wake.set)
+            except RuntimeError:
+                pass  # loop already closed
+
+    def acquire_stream(self, limit):
+        """Count a new thread-holding stream; False when `limit` are already open"""
+        with self._changed:
+            if self.open_streams >= limit:
+                self.rejected_streams += 1
+                return False
+            self.open_streams += 1
+            return True
+
+    def release_stream(self):
+        with self._changed:
+            self.open_streams -= 1
+
+    def _after(self, last_id):
+        """
+        Buffered messages newer than last_id, as long as they follow on
+        from it without a gap. Returns (messages, last id sent, gap).
+        """
+        messages, gap = [], False
+        with self._changed:
+            for event_id, message in self._events:
+                if event_id <= last_id:
+                    continue
+                if event_id != last_id + 1:
+                    gap = True
+                    break
+                messages.append(message)
+                last_id = event_id
+        return messages, last_id, gap
+
+    def last_event_id(self):
+        with self._changed:
+            return self._events[-1][0] if self._events else None
+
+    def _wait(self, last_id, timeout):
+        with self._changed:
+            newest = self._events[-1][0] if self._events else 0
+            if newest <= last_id:
+                self._changed.wait(timeout)
+
+    def stream(self, last_id, current_version, heartbeat=HEARTBEAT_SECONDS,
+               max_seconds=STREAM_MAX_SECONDS):
+        """
+        Yield the SSE response body. current_version() reads the data
+        version from the DB; it is called on connect and once per heartbeat.
+        """
+        yield f"retry: {RETRY_MS}\n\n"
+        version = current_version()
+        if last_id is None or last_id > version:
+            # New client: everything up to here is in the list it loads
+            last_id = version
+            yield _message(last_id, 'ready', '{}')
+
+        deadline = time.monotonic() + max_seconds
+        checked = time.monotonic()
+        while time.monotonic() < deadline:
+            messages, last_id, gap = self._after(last_id)
+            yield from messages
+
+            if gap or time.monotonic() - checked >= heartbeat:
+                checked = time.monotonic()
+                version = current_version()
+                pending, _, gap = self._after(last_id)
+                if gap or (version > last_id and not pending):
+                    # Missed writes we have no events for: reload
+                    last_id = max(version, self.last_event_id() or 0)
+                    yield _message(last_id, 'reset', '{}')
+                elif not messages:
+                    yield ": keep-alive\n\n"
+
+            self._wait(last_id, heartbeat)
+
+    async def astream(self, last_id, current_version, heartbeat=HEARTBEAT_SECONDS,
+                      max_seconds=STREAM_MAX_SECONDS):
+        """
+        stream() for asyncio servers: current_version is a coroutine
+        function, and waiting for the next event does not hold a thread.
+        """
+        wake = asyncio.Event()
+        waiter = (asyncio.get_running_loop(), wake)
+        with self._changed:
+            self._async_waiters.add(waiter)
+        try:
+            yield f"retry: {RETRY_MS}\n\n"
+            version = await current_version()
+            if last_id is None or last_id > version:
+                last_id = version
+                yield _message(last_id, 'ready', '{}')
+
+            deadline = time.monotonic() + max_seconds
+            checked = time.monotonic()
+            while time.monotonic() < deadline:
+                # Cleared before reading, so a publish from here on wakes us
+                wake.clear()
+                messages, last_id, gap = self._after(last_id)
+                for message in messages:
+                    yield message
+
+                if gap or time.monotonic() - checked >= heartbeat:
+                    checked = time.monotonic()
+                    version = await current_version()
+                    pending, _, gap = self._after(last_id)
+                    if gap or (version > last_id and not pending):
+                        last_id = max(version, self.last_event_id() or 0)
+                        yield _message(last_id, 'reset', '{}')
+                    elif not messages:
+                        yield ": keep-alive\n\n"
+
+                if (self.last_event_id() or 0) <= last_id:
+                    try:
+                        await asyncio.wait_for(wake.wait(), heartbeat)
+                    except asyncio.TimeoutError:
+                        pass
+        finally:
+            with self._changed:
+                self._async_waiters.discard(waiter)
+
+    def stats(self):
+        return {
+            'buffered': len(self._events),
+            'published': self.published,
+            'last_event_id': self.last_event_id(),
+            'open_streams': self.open_streams,
+            'rejected_streams': self.rejected_streams,
+        }
+
+
+def stream_response(feed, current_version, max_streams=MAX_STREAMS):
+    """
+    text/event-stream response for the request's Last-Event-ID, or 503
+    with Retry-After when this worker already has max_streams open
+    """
+    if not feed.acquire_stream(max_streams):
+        response = jsonify({'error': 'Too many open event streams, retry later'})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(STREAMS_FULL_RETRY_SECONDS)
+        return response
+    last_id = parse_last_event_id(
+        request.headers.get('Last-Event-ID') or request.args.get('last_event_id'))
+    response = Response(
+        feed.stream(last_id, current_version),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+    # Runs when the server closes the response: stream ended or client gone
+    response.call_on_close(feed.release_stream)
+    return response
@@ -0,0 +1,166 @@
+"""
+WRITE-BEHIND EXCEL EXPORTER
+Request handlers hand visitor changes to a background thread and return
+straight away. The thread waits up to EXPORT_DELAY seconds to gather a
+burst of changes, coalesces them and applies them to the Excel log in a
+single journal write - 50 check-ins or 100 deletes in one burst cost one
+append. The database stays the source of truth; the journal catches up
+within EXPORT_DELAY, and the workbook itself when the journal is next
+compacted (excel_sink.py).
+"""
+import atexit
+import queue
+import threading
+import time
+
+EXPORT_DELAY = 2.0
+MAX_BATCH = 1000
+
+
+class ExcelExporter:
+    """Background queue of visitor-change events for the Excel log"""
+
+    def __init__(self, export_fn, delay=EXPORT_DELAY, max_batch=MAX_BATCH, on_error=None):
+        # export_fn(rows, deleted_ids) applies one coalesced batch
+        self.export_fn = export_fn
+        # on_error() runs after a batch failed and was dropped, e.g. to reconcile
+        self.on_error = on_error
+        self.delay = delay
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stopping = False
+        self._in_flight = 0
+
+        self.flushes = 0
+        self.errors = 0
+        self.last_flush_at = None
+        self.last_flush_lag = None
+        self.last_batch_size = 0
+
+    # ========================================
+    # PRODUCER SIDE (request handlers)
+    # ========================================
+
+    def submit_add(self, row):
+        """Queue a new visitor row (spreadsheet columns without the ID)"""
+        self._submit('add', [row])
+
+    def submit_adds(self, rows):
+        """Queue a batch of new visitor rows as a single event"""
+        self._submit('add', list(rows))
+
+    def submit_delete(self, visitor_ids):
+        """Queue a batch of deleted visitor ids"""
+        self._submit('delete', list(visitor_ids))
+
+    def _submit(self, kind, payload):
+        self._ensure_started()
+        self._queue.put((kind, payload, time.monotonic()))
+
+    def queue_depth(self):
+        """Events queued or gathered into the batch not yet written"""
+        return self._queue.qsize() + self._in_flight
+
+    def stats(self):
+        """Queue depth and how far behind the last flush ran"""
+        return {
+            'queue_depth': self.queue_depth(),
+            'flushes': self.flushes,
+            'errors': self.errors,
+            'last_batch_size': self.last_batch_size,
+            'last_flush_lag_seconds': (
+                round(self.last_flush_lag, 3) if self.last_flush_lag is not None else None
+            ),
+            'last_flush_at': self.last_flush_at,
+        }
+
+    def flush(self, timeout=None):
+        """Block until everything queued so far has been written"""
+        if self._thread is None:
+            return True
+        done = threading.Event()
+        self._queue.put(('barrier', done, time.monotonic()))
+        return done.wait(timeout)
+
+    def shutdown(self, timeout=30):
+        """Flush pending events and stop the worker (registered with atexit)"""
+        if self._thread is None or self._stopping:
+            return
+        self.flush(timeout)
+        self._stopping = True
+        self._queue.put(('stop', None, time.monotonic()))
+        self._thread.join(timeout)
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='excel-exporter', daemon=True
+                )
+                self._thread.start()
+                atexit.register(self.shutdown)
+
+    # ========================================
+    # CONSUMER SIDE (worker thread)
+    # ========================================
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.delay
+
+            # Gather the rest of the burst, but never wait on a barrier/stop
+            while (len(batch) < self.max_batch
+                   and batch[-1][0] not in ('barrier', 'stop')):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._in_flight = len(batch)
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            self._in_flight = len(batch)
+            self._apply(batch)
+            self._in_flight = 0
+
+            for kind, payload, _ in batch:
+                if kind == 'barrier':
+                    payload.set()
+                elif kind == 'stop':
+                    return
+
+    def _apply(self, batch):
+        events = [e for e in batch if e[0] in ('add', 'delete')]
+        if not events:
+            return
+
+        rows = [
+            row
+            for kind, payload, _ in events if kind == 'add'
+            for row in payload
+        ]
+        deleted_ids = [
+            visitor_id
+            for kind, payload, _ in events if kind == 'delete'
+            for visitor_id in payload
+        ]
+
+        try:
+            self.export_fn(rows, deleted_ids)
+        except Exception as e:
+            self.errors += 1
+            print(f"❌ Error exporting {len(events)} changes to Excel: {e}")
+            if self.on_error:
+                self.on_error()
+        finally:
+            oldest = min(enqueued for _, _, enqueued in events)
+            self.flushes += 1
+            self.last_batch_size = len(events)
+            self.last_flush_lag = time.monotonic() - oldest
+            self.last_flush_at = time.strftime('%Y-%m-%d %H:%M:%S')
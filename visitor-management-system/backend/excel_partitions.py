@@ -0,0 +1,326 @@
+"""
+PARTITIONED EXCEL LOG - One workbook per period plus a manifest
+Optional layout (EXCEL_PARTITION=month|quarter|year) for logs that have
+grown too big to rewrite or open comfortably. Next to the configured log
+path (say visitors_log.xlsx) it keeps:
+  - visitors_log-2026-02.xlsx, ...   one workbook per period, each with
+    its own journal and its own 1..n ID column
+  - visitors_log.manifest.json       the partitions with their row
+    counts, record-ID ranges and periods
+
+New rows always go to the current period's partition, deletes are
+journaled only in the partitions whose record-ID range holds them, and
+compaction rewrites only partitions with journaled changes, so the cost
+of a write no longer depends on how much history the log holds.
+PartitionedExcelSink has the same interface as ExcelSink. Manifest
+updates hold a file lock next to the manifest (file_lock.py), and a
+manifest rewritten by another process is read again.
+"""
+import itertools
+import json
+import os
+import tempfile
+import threading
+from datetime import datetime, timedelta
+
+from excel_sink import COMPACT_EVERY, HEADERS, ExcelSink, file_stamp, read_header, write_workbook
+from file_lock import FileLock
+
+EXCEL_PARTITION = os.getenv('EXCEL_PARTITION', '').lower()
+PERIODS = ('month', 'quarter', 'year')
+
+MANIFEST_VERSION = 1
+
+
+def partition_key(moment, period):
+    """'2026-02' (month), '2026-Q1' (quarter) or '2026' (year) for a datetime"""
+    if period == 'month':
+        return f'{moment.year}-{moment.month:02d}'
+    if period == 'quarter':
+        return f'{moment.year}-Q{(moment.month - 1) // 3 + 1}'
+    if period == 'year':
+        return f'{moment.year}'
+    raise ValueError(f'partition period must be one of: {", ".join(PERIODS)}')
+
+
+def partition_bounds(key, period):
+    """[start, end) datetimes of the period a partition key names"""
+    if period == 'month':
+        year, month = (int(part) for part in key.split('-'))
+        start = datetime(year, month, 1)
+        end = datetime(year + month // 12, month % 12 + 1, 1)
+    elif period == 'quarter':
+        year, quarter = key.split('-Q')
+        year, first_month = int(year), (int(quarter) - 1) * 3 + 1
+        start = datetime(year, first_month, 1)
+        end = datetime(year + (first_month + 3 > 12), (first_month + 2) % 12 + 1, 1)
+    elif period == 'year':
+        start = datetime(int(key), 1, 1)
+        end = datetime(int(key) + 1, 1, 1)
+    else:
+        raise ValueError(f'partition period must be one of: {", ".join(PERIODS)}')
+    return start, end
+
+
+class PartitionedExcelSink:
+    """ExcelSink over one workbook per period, indexed by a JSON manifest"""
+
+    def __init__(self, period=EXCEL_PARTITION, compact_every=COMPACT_EVERY):
+        if period not in PERIODS:
+            raise ValueError(f'EXCEL_PARTITION must be one of: {", ".join(PERIODS)}')
+        self.period = period
+        self.compact_every = compact_every
+        # Guards the manifest in memory; never held while a workbook is written
+        self._lock = threading.RLock()
+        self._file_locks = {}
+        self._sinks = {}
+        self._manifest = None
+        self._manifest_for = None
+        self._manifest_stamp = None
+
+    # ========================================
+    # PATHS
+    # ========================================
+
+    @staticmethod
+    def manifest_path(excel_path):
+        return os.path.splitext(excel_path)[0] + '.manifest.json'
+
+    @staticmethod
+    def partition_path(excel_path, key):
+        stem, ext = os.path.splitext(excel_path)
+        return f'{stem}-{key}{ext or ".xlsx"}'
+
+    def _sink(self, excel_path, key):
+        """Journal/compaction state of one partition"""
+        with self._lock:
+            sink = self._sinks.get(key)
+            if sink is None:
+                sink = self._sinks[key] = ExcelSink(self.compact_every)
+            return sink
+
+    # ========================================
+    # MANIFEST
+    # ========================================
+
+    def _load(self, excel_path):
+        """The manifest for excel_path, kept in memory until another process rewrites it"""
+        path = self.manifest_path(excel_path)
+        stamp = file_stamp(path)
+        with self._lock:
+            return self._loaded(excel_path, path, stamp)
+
+    def _loaded(self, excel_path, path, stamp):
+        if self._manifest is None or self._manifest_for != excel_path or stamp != self._manifest_stamp:
+            manifest = {'period': self.period, 'version': MANIFEST_VERSION, 'partitions': {}}
+            if os.path.exists(path):
+                with open(path, encoding='utf-8') as f:
+                    saved = json.load(f)
+                if saved.get('period') == self.period:
+                    manifest['partitions'] = {entry['key']: entry for entry in saved['partitions']}
+                else:
+                    # Period changed: the old partitions are left alone and rebuilt over
+                    print(f"⚠️ {path} is partitioned by {saved.get('period')}, not {self.period}")
+            self._manifest, self._manifest_for, self._manifest_stamp = manifest, excel_path, stamp
+        return self._manifest
+
+    def _save(self, excel_path):
+        """Write the manifest atomically"""
+        path = self.manifest_path(excel_path)
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            manifest = self._load(excel_path)
+            payload = dict(manifest, partitions=[dict(manifest['partitions'][key])
+                                                 for key in sorted(manifest['partitions'])])
+        fd, tmp_path = tempfile.mkstemp(prefix='.manifest-', suffix='.json', dir=directory)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(payload, f, indent=2)
+        os.chmod(tmp_path, 0o644)
+        with self._lock:
+            os.replace(tmp_path, path)
+            self._manifest_stamp = file_stamp(path)
+
+    def _entry(self, excel_path, key):
+        with self._lock:
+            partitions = self._load(excel_path)['partitions']
+            entry = partitions.get(key)
+            if entry is None:
+                start, end = partition_bounds(key, self.period)
+                entry = partitions[key] = {
+                    'key': key,
+                    'file': os.path.basename(self.partition_path(excel_path, key)),
+                    'from': start.date().isoformat(),
+                    'to': (end - timedelta(days=1)).date().isoformat(),
+                    'rows': 0,
+                    'first_record_id': None,
+                    'last_record_id': None,
+                    'updated_at': None,
+                }
+            return entry
+
+    def _widen(self, entry, record_ids):
+        if not record_ids:
+            return
+        low, high = min(record_ids), max(record_ids)
+        with self._lock:
+            if entry['first_record_id'] is None or low < entry['first_record_id']:
+                entry['first_record_id'] = low
+            if entry['last_record_id'] is None or high > entry['last_record_id']:
+                entry['last_record_id'] = high
+
+    def _entries(self, excel_path):
+        """A copy of the manifest entries, oldest first"""
+        with self._lock:
+            return [dict(entry) for _, entry in sorted(self._load(excel_path)['partitions'].items())]
+
+    def partitions(self, excel_path):
+        """Manifest entries, oldest first, with absolute paths and pending changes"""
+        entries = []
+        for entry in self._entries(excel_path):
+            path = self.partition_path(excel_path, entry['key'])
+            entries.append(dict(entry, path=os.path.abspath(path),
+                                exists=os.path.exists(path),
+                                pending=self._sink(excel_path, entry['key']).pending(path)))
+        return entries
+
+    def damaged(self, excel_path):
+        """Keys of partitions whose workbook is missing or has another layout"""
+        return [entry['key'] for entry in self._entries(excel_path)
+                if read_header(self.partition_path(excel_path, entry['key'])) != HEADERS]
+
+    # ========================================
+    # ExcelSink INTERFACE
+    # ========================================
+
+    def exclusive(self, excel_path):
+        """Cross-process lock on the manifest; partition writes take their own lock inside it"""
+        with self._lock:
+            lock = self._file_locks.get(excel_path)
+            if lock is None:
+                lock = self._file_locks[excel_path] = FileLock(self.manifest_path(excel_path) + '.lock')
+            return lock
+
+    def pending(self, excel_path):
+        return sum(self._sink(excel_path, entry['key']).pending(self.partition_path(excel_path, entry['key']))
+                   for entry in self._entries(excel_path))
+
+    def workbook_rows(self, excel_path):
+        return sum(entry['rows'] for entry in self._entries(excel_path))
+
+    def append(self, excel_path, rows, now=None, compact=True):
+        """Journal rows into the current period's partition; returns their IDs"""
+        rows = list(rows)
+        key = partition_key(now or datetime.utcnow(), self.period)
+        with self.exclusive(excel_path):
+            entry = self._entry(excel_path, key)
+            self._widen(entry, [row[-1] for row in rows])
+            sink = self._sink(excel_path, key)
+            path = self.partition_path(excel_path, key)
+            ids = sink.append(path, rows, compact)
+            if sink.pending(path) == 0:
+                # append() compacted the partition
+                self._compacted(excel_path, key)
+            self._save(excel_path)
+            return ids
+
+    def delete(self, excel_path, record_ids, compact=True):
+        """Journal tombstones in the partitions whose ID range holds each id"""
+        record_ids = [int(record_id) for record_id in record_ids]
+        with self.exclusive(excel_path):
+            partitions = self._load(excel_path)['partitions']
+            for key, entry in partitions.items():
+                if entry['first_record_id'] is None:
+                    continue
+                hits = [record_id for record_id in record_ids
+                        if entry['first_record_id'] <= record_id <= entry['last_record_id']]
+                if not hits:
+                    continue
+                sink = self._sink(excel_path, key)
+                path = self.partition_path(excel_path, key)
+                sink.delete(path, hits, compact)
+                if sink.pending(path) == 0:
+                    self._compacted(excel_path, key)
+            self._save(excel_path)
+
+    def compact(self, excel_path):
+        """Fold the journals of partitions with pending changes; others are untouched"""
+        with self.exclusive(excel_path):
+            partitions = self._load(excel_path)['partitions']
+            folded = 0
+            for key in sorted(partitions):
+                sink = self._sink(excel_path, key)
+                path = self.partition_path(excel_path, key)
+                if sink.pending(path):
+                    folded += sink.compact(path)
+                    self._compacted(excel_path, key)
+            if folded:
+                self._save(excel_path)
+            return folded
+
+    def _compacted(self, excel_path, key):
+        rows = self._sink(excel_path, key).workbook_rows(self.partition_path(excel_path, key))
+        with self._lock:
+            entry = self._entry(excel_path, key)
+            entry['rows'] = rows
+            entry['updated_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+    def reset(self, excel_path, next_id=None):
+        """Drop every partition's journal (the workbooks were rebuilt from the DB)"""
+        with self.exclusive(excel_path):
+            for key in self._load(excel_path)['partitions']:
+                self._sink(excel_path, key).reset(self.partition_path(excel_path, key))
+
+    # ========================================
+    # REBUILD FROM THE DATABASE
+    # ========================================
+
+    def rebuild(self, excel_path, rows, only=None):
+        """
+        Regenerate partitions from (created_at, name, phone, date, purpose,
+        comments, record id) rows ordered by created_at. With only=key the
+        rows must be that partition's and nothing else is touched; without
+        it partitions that no longer have rows are dropped from the manifest.
+        Returns the number of rows written.
+        """
+        with self.exclusive(excel_path):
+            partitions = self._load(excel_path)['partitions']
+            written = set()
+            total = 0
+            grouped = itertools.groupby(rows, key=lambda row: partition_key(row[0], self.period))
+            for key, group in grouped:
+                if only is not None and key != only:
+                    continue
+                record_ids = []
+
+                def numbered():
+                    for idx, row in enumerate(group, start=1):
+                        record_ids.append(row[-1])
+                        yield [idx] + list(row[1:])
+
+                entry = self._entry(excel_path, key)
+                count = write_workbook(self.partition_path(excel_path, key), numbered())
+                with self._lock:
+                    entry['first_record_id'] = entry['last_record_id'] = None
+                    self._widen(entry, record_ids)
+                self._sink(excel_path, key).reset(self.partition_path(excel_path, key), next_id=count + 1)
+                self._compacted(excel_path, key)
+                written.add(key)
+                total += count
+
+            if only is not None and only not in written:
+                # Every visitor of the period is gone
+                self._drop(excel_path, only)
+            elif only is None:
+                for key in set(partitions) - written:
+                    self._drop(excel_path, key)
+            self._save(excel_path)
+            return total
+
+    def _drop(self, excel_path, key):
+        with self._lock:
+            self._load(excel_path)['partitions'].pop(key, None)
+        path = self.partition_path(excel_path, key)
+        self._sink(excel_path, key).reset(path)
+        if os.path.exists(path):
+            os.remove(path)
@@ -0,0 +1,135 @@
+"""
+SMART EXCEL FILE FINDER - Cached
+Remembers where the Excel log lives so the request path does no config
+parsing and a single stat. The full search (config.ini, then the usual
+home-directory folders) only runs again when the file disappears or
+someone edits config.ini by hand.
+"""
+import configparser
+import os
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+CONFIG_FILE = 'config.ini'
+DEFAULT_EXCEL_FILE = 'visitors_log.xlsx'
+
+# How often (seconds) to look at config.ini's mtime for hand edits
+CONFIG_RECHECK_SECONDS = 5.0
+
+
+def _file_signature(path):
+    """(mtime, inode) of a file, or None if it is missing"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_ino
+
+
+class ExcelPathResolver:
+    """Resolves and caches the Excel log location"""
+
+    def __init__(self, config_file=CONFIG_FILE, default_file=DEFAULT_EXCEL_FILE, probe=None):
+        self.config_file = config_file
+        self.default_file = default_file
+        # probe(path) names the file whose presence shows the log is at path
+        # (the manifest, for a partitioned log)
+        self.probe = probe or (lambda path: path)
+        self._lock = threading.Lock()
+        self._path = None
+        self._saved_path = None
+        self._config_signature = None
+        self._config_checked_at = 0.0
+        self.searches = 0
+
+    def resolve(self):
+        """Current Excel path; one stat when nothing has changed"""
+        with self._lock:
+            if self._path is not None and not self._config_changed():
+                if os.path.exists(self.probe(self._path)):
+                    return self._path
+                print(f"🔍 Excel file moved! Searching for new location...")
+            self._path = self._search()
+            return self._path
+
+    def invalidate(self):
+        """Forget the cached location; the next resolve() searches again"""
+        with self._lock:
+            self._path = None
+            self._config_signature = None
+
+    # ========================================
+    # SLOW PATH
+    # ========================================
+
+    def _config_changed(self):
+        """Throttled mtime/inode check of config.ini"""
+        now = time.monotonic()
+        if now - self._config_checked_at < CONFIG_RECHECK_SECONDS:
+            return False
+        self._config_checked_at = now
+        return _file_signature(self.config_file) != self._config_signature
+
+    def _read_config(self):
+        self._config_signature = _file_signature(self.config_file)
+        self._config_checked_at = time.monotonic()
+        self._saved_path = None
+        if self._config_signature is None:
+            return None
+
+        config = configparser.ConfigParser()
+        config.read(self.config_file)
+        if 'FILE_LOCATION' in config:
+            self._saved_path = config['FILE_LOCATION'].get('excel_path', self.default_file)
+        return self._saved_path
+
+    def _search(self):
+        """Get Excel file path from config or search for it"""
+        self.searches += 1
+        saved_path = self._read_config()
+        if saved_path:
+            # Check if file exists at saved location
+            if os.path.exists(self.probe(saved_path)):
+                print(f"✅ Excel file found at: {saved_path}")
+                return saved_path
+            print(f"⚠️ Excel file not found at saved location: {saved_path}")
+            print(f"🔍 Searching for Excel file...")
+
+        # Search for Excel file in common locations
+        home = Path.home()
+        search_locations = [
+            self.default_file,  # Current directory
+            os.path.join(os.getcwd(), self.default_file),
+            os.path.join(home, 'Desktop', self.default_file),
+            os.path.join(home, 'Documents', self.default_file),
+            os.path.join(home, 'Downloads', self.default_file),
+            os.path.join(home, 'Documents', 'Inceptez_Visitors', self.default_file),
+        ]
+
+        for location in search_locations:
+            if os.path.exists(self.probe(location)):
+                print(f"✅ Excel file found at: {location}")
+                self._save(location)
+                return location
+
+        # If not found anywhere, create in backend folder
+        print(f"📝 Creating new Excel file at: {self.default_file}")
+        self._save(self.default_file)
+        return self.default_file
+
+    def _save(self, path):
+        """Save Excel file path to config (only when it actually changed)"""
+        if path == self._saved_path:
+            return
+        config = configparser.ConfigParser()
+        config['FILE_LOCATION'] = {
+            'excel_path': path,
+            'last_updated': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        }
+        with open(self.config_file, 'w') as configfile:
+            config.write(configfile)
+        self._saved_path = path
+        self._config_signature = _file_signature(self.config_file)
+        print(f"💾 Saved Excel file location to config: {path}")
@@ -0,0 +1,399 @@
+"""
+EXCEL RECONCILER - Repair drift between the DB and the Excel log in place
+The exporter drops a batch it failed to write, and a workbook edited by
+hand or restored from a backup no longer matches the DB. Instead of
+regenerating the whole log (rebuild_excel()), the reconciler finds the
+rows that differ and journals only those:
+  - Every workbook write saves per-chunk checksums next to the workbook
+    (excel_sink.py): the row count and digest sum of each CHECKSUM_CHUNK
+    record ids. A workbook changed by anything else is scanned once.
+  - The DB is read in id order and summed the same way; only chunks whose
+    checksums differ are compared row by row.
+  - A high-water mark (last id/created_at reconciled, kept in
+    <log>.reconcile.json) makes regular runs incremental: they only read
+    the chunks from the mark on, which is where failed exports land. A
+    full run compares every chunk, so old rows deleted or edited behind
+    the exporter's back are caught too.
+Missing rows are appended, rows the DB no longer has are tombstoned and
+stale rows get both, through the sink's journal like any export: a few
+missed rows cost a few PK range reads and one journal write. The next
+compaction (the exporter's next batch, or the next run) folds them in.
+
+Runs every EXCEL_RECONCILE_SECONDS in each worker (a full run every
+EXCEL_RECONCILE_FULL_EVERY runs, and straight after a failed export), or:
+
+    python excel_reconcile.py run [--full]
+"""
+import argparse
+import itertools
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from excel_partitions import PartitionedExcelSink, partition_key
+from excel_sink import (CHECKSUM_CHUNK, RECORD_ID_INDEX, ChunkChecksums, chunk_start, load_checksums,
+                        read_rows, row_digest, scan_checksums, workbook_record_ids, workbook_stamp)
+from file_lock import FileLock
+
+# Seconds between background runs; 0 turns the background task off
+RECONCILE_SECONDS = float(os.getenv('EXCEL_RECONCILE_SECONDS', '300'))
+
+# Every n-th background run compares every chunk, not just those past the mark
+RECONCILE_FULL_EVERY = int(os.getenv('EXCEL_RECONCILE_FULL_EVERY', '12'))
+
+# DB rows fetched at a time while summing chunks
+RECONCILE_READ = 1000
+
+
+# ========================================
+# STATE (<log>.reconcile.json)
+# ========================================
+
+def state_path(excel_path):
+    return os.path.splitext(excel_path)[0] + '.reconcile.json'
+
+
+def lock_path(excel_path):
+    return os.path.splitext(excel_path)[0] + '.reconcile.lock'
+
+
+def load_state(excel_path):
+    state = {'watermark': None, 'data_version': None, 'workbooks': {}, 'last_run': None}
+    path = state_path(excel_path)
+    if os.path.exists(path):
+        try:
+            with open(path, encoding='utf-8') as f:
+                state.update(json.load(f))
+        except ValueError:
+            print(f"⚠️ Ignoring unreadable {path}; the next run compares every chunk")
+    return state
+
+
+def save_state(excel_path, state):
+    path = state_path(excel_path)
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.reconcile-', suffix='.json', dir=directory)
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2)
+    os.chmod(tmp_path, 0o644)
+    os.replace(tmp_path, path)
+
+
+# ========================================
+# CHECKSUMS ON BOTH SIDES
+# ========================================
+
+def workbooks(sink, excel_path):
+    """(path, first record id, last record id) of each workbook; ids are None for a single log"""
+    if isinstance(sink, PartitionedExcelSink):
+        return [(entry['path'], entry['first_record_id'], entry['last_record_id'])
+                for entry in sink.partitions(excel_path) if entry['exists']]
+    return [(excel_path, None, None)] if os.path.exists(excel_path) else []
+
+
+def workbook_checksums(paths, chunk_size=CHECKSUM_CHUNK):
+    """Checksums of all workbooks, and how many had to be scanned because they changed"""
+    total, scanned = ChunkChecksums(chunk_size), 0
+    for path in paths:
+        checksums = load_checksums(path, chunk_size)
+        if checksums is None:
+            checksums = scan_checksums(path, chunk_size)
+            scanned += 1
+        total.merge(checksums)
+    return total, scanned
+
+
+def _visitor_rows(session, model, low=None, high=None):
+    """(id, created_at, name, phone, date, purpose, comments) by id, low <= id < high"""
+    query = session.query(model.id, model.created_at, model.name, model.phone, model.date,
+                          model.purpose, model.comments)
+    if low is not None:
+        query = query.filter(model.id >= low)
+    if high is not None:
+        query = query.filter(model.id < high)
+    return query.order_by(model.id).yield_per(RECONCILE_READ)
+
+
+def _excel_row(row):
+    """The visitor columns journaled for a DB row, as visitor_row() gives them"""
+    record_id, _, name, phone, date, purpose, comments = row
+    return [name, phone, date, purpose, comments or '', record_id]
+
+
+def _digest(row):
+    return row_digest(_excel_row(row))
+
+
+def db_checksums(session, model, since=0, chunk_size=CHECKSUM_CHUNK):
+    """Checksums of the DB rows from id `since` on, and the newest row as a watermark"""
+    checksums, newest = ChunkChecksums(chunk_size), None
+    for row in _visitor_rows(session, model, since):
+        checksums.add(row[0], _digest(row))
+        newest = row
+    if newest is None:
+        return checksums, None
+    return checksums, {'id': newest[0],
+                       'created_at': newest[1].isoformat(' ', 'seconds') if newest[1] else None}
+
+
+# ========================================
+# RECONCILE
+# ========================================
+
+def _workbook_digests(workbook_list, chunks, chunk_size):
+    """record id -> digests of its rows in the workbooks, for ids in the given chunks only"""
+    low = min(chunks)
+    high = max(chunks) + chunk_size
+    digests = {}
+    for path, first, last in workbook_list:
+        if first is not None and (last < low or first >= high):
+            continue
+        for row in read_rows(path):
+            if len(row) <= RECORD_ID_INDEX or not isinstance(row[RECORD_ID_INDEX], int):
+                continue
+            record_id = row[RECORD_ID_INDEX]
+            if chunk_start(record_id, chunk_size) in chunks:
+                digests.setdefault(record_id, []).append(row_digest(row[1:RECORD_ID_INDEX + 1]))
+    return digests
+
+
+def plan_repairs(session, model, workbook_list, expected, actual, differing, tail, chunk_size):
+    """
+    Tombstones and DB rows to (re)append for the chunks that differ.
+    A chunk one side does not have at all is replaced as a whole. A chunk
+    at or past the watermark (rows added since the last run, where failed
+    exports land) first gets just the rows whose ids the workbook lacks,
+    which settles it when that makes the checksums agree. Other chunks are
+    compared row by row.
+    """
+    tombstones, rows, compare, tail_chunks = set(), [], [], []
+    for start in differing:
+        wanted, have = expected.get(start)[0], actual.get(start)[0]
+        if have == 0:
+            rows.extend(_visitor_rows(session, model, start, start + chunk_size))
+        elif wanted == 0:
+            tombstones.update(range(start, start + chunk_size))
+        elif start >= tail:
+            tail_chunks.append(start)
+        else:
+            compare.append(start)
+
+    if tail_chunks:
+        present = [workbook_record_ids(path) for path, _, _ in workbook_list]
+        for start in tail_chunks:
+            missing = [row for row in _visitor_rows(session, model, start, start + chunk_size)
+                       if not any(row[0] in ids for ids in present)]
+            patched = ChunkChecksums(chunk_size, {start: list(actual.get(start))})
+            for row in missing:
+                patched.add(row[0], _digest(row))
+            if missing and patched.get(start) == expected.get(start):
+                rows.extend(missing)
+            else:
+                compare.append(start)
+
+    if compare:
+        in_workbook = _workbook_digests(workbook_list, set(compare), chunk_size)
+        for start in compare:
+            for row in _visitor_rows(session, model, start, start + chunk_size):
+                found = in_workbook.pop(row[0], None)
+                if found == [_digest(row)]:
+                    continue
+                if found:
+                    # Stale or duplicated: drop what is there, write it again
+                    tombstones.add(row[0])
+                rows.append(row)
+        # Left over: in the workbook but no longer in the DB
+        tombstones.update(in_workbook)
+    # Appended in id order, like the exporter writes them
+    rows.sort(key=lambda row: row[0])
+    return tombstones, rows
+
+
+def apply_repairs(sink, excel_path, tombstones, rows):
+    """Journal the repairs; tombstones first, so rows written again replace the old ones"""
+    if tombstones:
+        sink.delete(excel_path, sorted(tombstones), compact=False)
+    if isinstance(sink, PartitionedExcelSink):
+        # Each row goes back to the partition of the period it was made in
+        for _, group in itertools.groupby(rows, key=lambda row: partition_key(row[1], sink.period)):
+            group = list(group)
+            sink.append(excel_path, [_excel_row(row) for row in group], now=group[0][1], compact=False)
+    elif rows:
+        sink.append(excel_path, [_excel_row(row) for row in rows], compact=False)
+
+
+def reconcile(session, model, sink, excel_path, version=None, full=False, compact=False,
+              chunk_size=CHECKSUM_CHUNK):
+    """
+    Bring the Excel log in line with the DB. version is the current data
+    version: an incremental run with nothing written since the last run
+    stops straight away. compact=True also folds the repairs into the
+    workbook before returning. Returns a report of what was checked and fixed.
+    """
+    started = time.perf_counter()
+    report = {'mode': 'full' if full else 'incremental', 'skipped': None, 'chunks_checked': 0,
+              'chunks_differing': 0, 'appended': 0, 'removed': 0, 'workbooks_scanned': 0}
+    lock = FileLock(lock_path(excel_path))
+    if not lock.try_acquire():
+        report['skipped'] = 'another process is reconciling this log'
+        return report
+    try:
+        # Held throughout, so the exporter cannot write between reading and repairing
+        with sink.exclusive(excel_path):
+            sink.compact(excel_path)
+            state = load_state(excel_path)
+            watermark = state['watermark']
+            stamps = {os.path.basename(path): workbook_stamp(path)
+                      for path, _, _ in workbooks(sink, excel_path)}
+            if (not full and watermark is not None and version is not None
+                    and version == state['data_version'] and stamps == state['workbooks']):
+                report['skipped'] = 'nothing written since the last run'
+                return report
+
+            since = 0 if full or watermark is None else chunk_start(watermark['id'] + 1, chunk_size)
+            tail = chunk_start(watermark['id'] + 1, chunk_size) if watermark else float('inf')
+            workbook_list = workbooks(sink, excel_path)
+            expected, newest = db_checksums(session, model, since, chunk_size)
+            actual, report['workbooks_scanned'] = workbook_checksums(
+                [path for path, _, _ in workbook_list], chunk_size)
+
+            starts = sorted(start for start in set(expected.chunks) | set(actual.chunks)
+                            if start >= since)
+            differing = [start for start in starts if expected.get(start) != actual.get(start)]
+            report['chunks_checked'] = len(starts)
+            report['chunks_differing'] = len(differing)
+
+            if differing:
+                tombstones, rows = plan_repairs(session, model, workbook_list, expected, actual,
+                                                differing, tail, chunk_size)
+                apply_repairs(sink, excel_path, tombstones, rows)
+                report['appended'] = len(rows)
+                report['removed'] = len(tombstones)
+
+            report['seconds'] = round(time.perf_counter() - started, 4)
+            if differing and compact:
+                sink.compact(excel_path)
+            state.update(
+                watermark=newest or watermark,
+                data_version=version,
+                workbooks={os.path.basename(path): workbook_stamp(path)
+                           for path, _, _ in workbooks(sink, excel_path)},
+                last_run=dict(report, at=datetime.now().isoformat(timespec='seconds')),
+            )
+            save_state(excel_path, state)
+    finally:
+        lock.release()
+
+    if differing:
+        print(f"✅ Reconciled Excel log: {len(differing)} of {len(starts)} chunks differed, "
+              f"{report['appended']} rows journaled, {report['removed']} ids tombstoned "
+              f"in {report['seconds'] * 1000:.0f} ms")
+    return report
+
+
+# ========================================
+# BACKGROUND TASK
+# ========================================
+
+class ReconcileTask:
+    """
+    Daemon thread calling job(full) every `interval` seconds inside the
+    Flask app context; request() runs it early, e.g. after a failed export,
+    and stop() ends it after the run in progress
+    """
+
+    def __init__(self, job, interval=RECONCILE_SECONDS, full_every=RECONCILE_FULL_EVERY):
+        self.job = job
+        self.interval = interval
+        self.full_every = max(full_every, 1)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = False
+
+        self.runs = 0
+        self.errors = 0
+        self.last_run_at = None
+        self.last_report = None
+
+    def ensure_started(self, flask_app):
+        if self.interval <= 0 or self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, args=(flask_app,),
+                                                name='excel-reconcile', daemon=True)
+                self._thread.start()
+
+    def request(self):
+        """Reconcile soon instead of at the next interval"""
+        self._wake.set()
+
+    def stop(self, timeout=30):
+        """End the thread, waiting up to timeout for a run in progress"""
+        if self._thread is None or self._stopping:
+            return
+        self._stopping = True
+        self._wake.set()
+        self._thread.join(timeout)
+
+    def _run(self, flask_app):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stopping:
+                return
+            self._fire(flask_app, full=(self.runs + 1) % self.full_every == 0)
+
+    def _fire(self, flask_app, full):
+        try:
+            with flask_app.app_context():
+                self.last_report = self.job(full)
+            self.runs += 1
+            self.last_run_at = datetime.now().isoformat(timespec='seconds')
+        except Exception as e:
+            self.errors += 1
+            print(f"⚠️ Excel reconcile failed: {e}")
+
+    def stats(self):
+        return {
+            'interval_seconds': self.interval,
+            'runs': self.runs,
+            'errors': self.errors,
+            'last_run_at': self.last_run_at,
+            'last_report': self.last_report,
+        }
+
+
+# ========================================
+# COMMAND LINE
+# ========================================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Repair drift between the DB and the Excel log')
+    parser.add_argument('command', choices=['run'],
+                        help='run: append, patch or drop the Excel rows that differ from the DB')
+    parser.add_argument('--full', action='store_true',
+                        help='compare every chunk, not just those past the high-water mark')
+    args = parser.parse_args(argv)
+
+    from app_smart_search import app, initialize, reconcile_excel
+    initialize(app)
+
+    print(f"🔄 Reconciling the Excel log ({'full' if args.full else 'incremental'})...")
+    with app.app_context():
+        report = reconcile_excel(full=args.full, compact=True)
+    if report['skipped']:
+        print(f"✅ Nothing to do: {report['skipped']}")
+    else:
+        print(f"✅ {report['chunks_differing']} of {report['chunks_checked']} chunks differed: "
+              f"{report['appended']} rows appended, {report['removed']} ids tombstoned")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
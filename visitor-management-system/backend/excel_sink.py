@@ -0,0 +1,618 @@
+"""
+APPEND-OPTIMIZED EXCEL SINK
+New visitor rows go to a small line-per-row journal file next to the
+workbook, which costs the same no matter how big the spreadsheet is. The
+journal is folded into the xlsx in one pass every COMPACT_EVERY rows, or
+by the first write after it is COMPACT_AFTER_SECONDS old (and at
+startup), so the cost of rewriting the workbook is shared by many
+check-ins. Writes hold an OS lock on a file next to the journal
+(file_lock.py), so gunicorn workers sharing the log never lose each
+other's rows.
+
+Deletes are journaled too, as tombstones keyed on the hidden Record ID
+column (the DB id). Compaction drops tombstoned rows and renumbers the
+sequential ID column in the same pass, so a delete never triggers a
+rebuild from the database.
+
+Workbooks are always written as a stream (write-only mode, shared named
+styles) to a temp file that is renamed over the old one, so memory stays
+flat and readers never see a half-written file. Every write also records
+per-chunk checksums of the rows it wrote next to the workbook, which
+excel_reconcile.py compares with the database.
+"""
+import bisect
+import itertools
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import zlib
+
+import openpyxl
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, PatternFill, Alignment, Border, Side, NamedStyle
+
+from file_lock import FileLock
+
+COMPACT_EVERY = 200
+
+# Longest a journaled change waits for the next write to fold it in (0: by count only)
+COMPACT_AFTER_SECONDS = int(os.getenv('EXCEL_COMPACT_AFTER_SECONDS', '300'))
+
+SHEET_TITLE = "Visitors Log"
+HEADERS = ['ID', 'Name', 'Phone Number', 'Date', 'Purpose of Visit', 'Comments', 'Record ID']
+COLUMN_WIDTHS = {'A': 8, 'B': 25, 'C': 18, 'D': 15, 'E': 30, 'F': 40}
+
+# Hidden column holding the DB id, so deletes can find their row
+RECORD_ID_COLUMN = 'G'
+RECORD_ID_INDEX = HEADERS.index('Record ID')
+
+HEADER_FILL = PatternFill(start_color='4472C4', end_color='4472C4', fill_type='solid')
+HEADER_FONT = Font(bold=True, color='FFFFFF', size=12)
+THIN_BORDER = Border(
+    left=Side(style='thin'),
+    right=Side(style='thin'),
+    top=Side(style='thin'),
+    bottom=Side(style='thin')
+)
+
+
+# ========================================
+# WORKBOOK LAYOUT
+# ========================================
+
+HEADER_STYLE = 'visitor_header'
+DATA_STYLE = 'visitor_data'
+
+
+def _named_styles():
+    """Header and data-row styles, registered once per workbook"""
+    header = NamedStyle(name=HEADER_STYLE)
+    header.fill = HEADER_FILL
+    header.font = HEADER_FONT
+    header.alignment = Alignment(horizontal='center', vertical='center')
+    header.border = THIN_BORDER
+
+    data = NamedStyle(name=DATA_STYLE)
+    data.border = THIN_BORDER
+    data.alignment = Alignment(vertical='center')
+    return header, data
+
+
+def write_workbook(excel_path, rows):
+    """
+    Stream rows (ID first) into a fresh log workbook at excel_path.
+    Rows may be any iterable, e.g. a chunked DB cursor. The file is written
+    next to the target and atomically renamed into place, and its chunk
+    checksums are saved alongside. Returns the number of data rows written.
+    """
+    wb = openpyxl.Workbook(write_only=True)
+    for style in _named_styles():
+        wb.add_named_style(style)
+
+    ws = wb.create_sheet(SHEET_TITLE)
+    for column, width in COLUMN_WIDTHS.items():
+        ws.column_dimensions[column].width = width
+    ws.column_dimensions[RECORD_ID_COLUMN].hidden = True
+
+    def styled(values, style):
+        cells = []
+        for value in values:
+            cell = WriteOnlyCell(ws, value=value)
+            cell.style = style
+            cells.append(cell)
+        return cells
+
+    ws.append(styled(HEADERS, HEADER_STYLE))
+    checksums = ChunkChecksums()
+    record_ids = []
+    count = 0
+    for row in rows:
+        ws.append(styled(row, DATA_STYLE))
+        checksums.add_row(row)
+        record_ids.append(row[RECORD_ID_INDEX] if len(row) > RECORD_ID_INDEX else None)
+        count += 1
+
+    excel_dir = os.path.dirname(os.path.abspath(excel_path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.visitors_log-', suffix='.xlsx', dir=excel_dir)
+    os.close(fd)
+    try:
+        wb.save(tmp_path)
+        # mkstemp creates the file owner-only; keep the log's usual permissions
+        if os.path.exists(excel_path):
+            shutil.copymode(excel_path, tmp_path)
+        else:
+            os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, excel_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    save_checksums(excel_path, checksums, count, record_ids)
+    return count
+
+
+def read_rows(excel_path):
+    """Stream the data rows of an existing log workbook"""
+    if not os.path.exists(excel_path):
+        return
+    wb = openpyxl.load_workbook(excel_path, read_only=True)
+    try:
+        for row in wb.active.iter_rows(min_row=2, values_only=True):
+            if any(value is not None for value in row):
+                yield row
+    finally:
+        wb.close()
+
+
+def read_header(excel_path):
+    """Header row of an existing log workbook, or None if there is no file"""
+    if not os.path.exists(excel_path):
+        return None
+    wb = openpyxl.load_workbook(excel_path, read_only=True)
+    try:
+        for row in wb.active.iter_rows(max_row=1, values_only=True):
+            return list(row)
+        return []
+    finally:
+        wb.close()
+
+
+# ========================================
+# CHUNK CHECKSUMS (compared by excel_reconcile.py)
+# ========================================
+
+# Record ids per checksum chunk
+CHECKSUM_CHUNK = 500
+
+
+def row_digest(values):
+    """crc32 of a row's (name, phone, date, purpose, comments, record id)"""
+    text = '\x1f'.join('' if value is None else str(value) for value in values)
+    return zlib.crc32(text.encode('utf-8'))
+
+
+def chunk_start(record_id, chunk_size=CHECKSUM_CHUNK):
+    return record_id - record_id % chunk_size
+
+
+class ChunkChecksums:
+    """
+    Row count and digest sum per chunk of record ids. Sums do not depend on
+    row order, so a workbook and the DB agree exactly when their chunks do.
+    """
+
+    def __init__(self, chunk_size=CHECKSUM_CHUNK, chunks=None):
+        self.chunk_size = chunk_size
+        # chunk start -> [rows, digest sum]
+        self.chunks = chunks if chunks is not None else {}
+
+    def add(self, record_id, digest):
+        chunk = self.chunks.setdefault(chunk_start(record_id, self.chunk_size), [0, 0])
+        chunk[0] += 1
+        chunk[1] = (chunk[1] + digest) & 0xFFFFFFFFFFFFFFFF
+
+    def add_row(self, row):
+        """A workbook row: ID, the visitor columns, record id"""
+        if len(row) > RECORD_ID_INDEX and isinstance(row[RECORD_ID_INDEX], int):
+            self.add(row[RECORD_ID_INDEX], row_digest(row[1:RECORD_ID_INDEX + 1]))
+
+    def merge(self, other):
+        for start, (count, total) in other.chunks.items():
+            chunk = self.chunks.setdefault(start, [0, 0])
+            chunk[0] += count
+            chunk[1] = (chunk[1] + total) & 0xFFFFFFFFFFFFFFFF
+
+    def get(self, start):
+        return tuple(self.chunks.get(start, (0, 0)))
+
+
+def checksum_path(excel_path):
+    return os.path.splitext(excel_path)[0] + '.checksums.json'
+
+
+def workbook_stamp(excel_path):
+    stat = os.stat(excel_path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def save_checksums(excel_path, checksums, rows, record_ids=None):
+    """
+    Record checksums, data rows and (if given) the record ids for the
+    workbook as it is on disk now (atomically)
+    """
+    path = checksum_path(excel_path)
+    payload = {
+        'chunk_size': checksums.chunk_size,
+        'workbook': workbook_stamp(excel_path),
+        'rows': rows,
+        'chunks': {str(start): chunk for start, chunk in sorted(checksums.chunks.items())},
+    }
+    if record_ids is not None:
+        payload['record_ids'] = id_ranges(record_ids)
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.checksums-', suffix='.json', dir=directory)
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(payload, f)
+    os.chmod(tmp_path, 0o644)
+    os.replace(tmp_path, path)
+
+
+def _saved_checksums(excel_path):
+    """
+    What save_checksums() recorded, or None when there is nothing or the
+    workbook was changed since (e.g. edited and saved by hand)
+    """
+    path = checksum_path(excel_path)
+    if not os.path.exists(path) or not os.path.exists(excel_path):
+        return None
+    try:
+        with open(path, encoding='utf-8') as f:
+            saved = json.load(f)
+    except ValueError:
+        return None
+    return saved if saved.get('workbook') == workbook_stamp(excel_path) else None
+
+
+def load_checksums(excel_path, chunk_size=CHECKSUM_CHUNK):
+    """The checksums saved with the workbook, or None if it changed since"""
+    saved = _saved_checksums(excel_path)
+    if saved is None or saved.get('chunk_size') != chunk_size:
+        return None
+    return ChunkChecksums(chunk_size, {int(start): chunk for start, chunk in saved['chunks'].items()})
+
+
+def saved_row_count(excel_path):
+    """
+    Data rows of a workbook written by write_workbook() and untouched
+    since, without opening it; None otherwise. Such a workbook also has the
+    current layout.
+    """
+    saved = _saved_checksums(excel_path)
+    return saved.get('rows') if saved else None
+
+
+def scan_checksums(excel_path, chunk_size=CHECKSUM_CHUNK):
+    """Checksums read from the workbook itself (one streaming pass), saved for next time"""
+    checksums = ChunkChecksums(chunk_size)
+    record_ids = []
+    count = 0
+    for row in read_rows(excel_path):
+        checksums.add_row(row)
+        record_ids.append(row[RECORD_ID_INDEX] if len(row) > RECORD_ID_INDEX else None)
+        count += 1
+    if os.path.exists(excel_path):
+        save_checksums(excel_path, checksums, count, record_ids)
+    return checksums
+
+
+# ========================================
+# RECORD IDS IN A WORKBOOK
+# ========================================
+
+def id_ranges(record_ids):
+    """Integer ids as sorted [first, last] runs; a log's ids are mostly consecutive"""
+    ranges = []
+    for record_id in sorted({value for value in record_ids if isinstance(value, int)}):
+        if ranges and record_id == ranges[-1][1] + 1:
+            ranges[-1][1] = record_id
+        else:
+            ranges.append([record_id, record_id])
+    return ranges
+
+
+class IdRanges:
+    """Membership test over id_ranges() runs"""
+
+    def __init__(self, ranges):
+        self.ranges = ranges
+        self._starts = [first for first, _ in ranges]
+
+    def __contains__(self, record_id):
+        index = bisect.bisect_right(self._starts, record_id) - 1
+        return index >= 0 and record_id <= self.ranges[index][1]
+
+
+def workbook_record_ids(excel_path):
+    """
+    Record ids in the workbook, from what write_workbook() saved; a
+    workbook changed since (or written before ids were saved) is scanned once
+    """
+    saved = _saved_checksums(excel_path)
+    if (saved is None or 'record_ids' not in saved) and os.path.exists(excel_path):
+        scan_checksums(excel_path)
+        saved = _saved_checksums(excel_path)
+    return IdRanges(saved.get('record_ids', []) if saved else [])
+
+
+def visitor_row(visitor):
+    """Spreadsheet columns for a visitor, without the sequential ID"""
+    return [
+        visitor.name,
+        visitor.phone,
+        visitor.date,
+        visitor.purpose,
+        visitor.comments or '',
+        visitor.id
+    ]
+
+
+# ========================================
+# JOURNAL + COMPACTION
+# ========================================
+
+def journal_path(excel_path):
+    """Journal kept next to its workbook: visitors_log.xlsx -> visitors_log.journal"""
+    return os.path.splitext(excel_path)[0] + '.journal'
+
+
+def journal_lock_path(excel_path):
+    return journal_path(excel_path) + '.lock'
+
+
+def file_stamp(path):
+    """(size, mtime, inode) of a file, or None if there is none; changes with every write"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+
+class ExcelSink:
+    """
+    Journals appended rows and deletes, folds them into the workbook in
+    batches. Every write holds the file lock next to the journal, and the
+    counts kept in memory are dropped whenever the journal or workbook was
+    changed by another process.
+
+    The counts have a lock of their own, held only while they are read or
+    updated (never while a workbook is written), so pending() and
+    workbook_rows() answer during a compaction or rebuild.
+    """
+
+    def __init__(self, compact_every=COMPACT_EVERY, compact_after=COMPACT_AFTER_SECONDS):
+        self.compact_every = compact_every
+        self.compact_after = compact_after
+        # Guards the cached counts below, not the files
+        self._lock = threading.RLock()
+        self._file_locks = {}
+        self._file_locks_guard = threading.Lock()
+        self._seen = None
+        self._forget()
+
+    def _forget(self):
+        self._next_id = None
+        self._pending = None
+        self._workbook_rows = None
+        self._workbook_ids = None
+
+    def exclusive(self, excel_path):
+        """
+        The cross-process lock on a workbook and its journal, for callers
+        that read, compare and then write (excel_reconcile.py)
+        """
+        with self._file_locks_guard:
+            lock = self._file_locks.get(excel_path)
+            if lock is None:
+                lock = self._file_locks[excel_path] = FileLock(journal_lock_path(excel_path))
+            return lock
+
+    def _stamp(self, excel_path):
+        return excel_path, file_stamp(journal_path(excel_path)), file_stamp(excel_path)
+
+    def _refresh(self, excel_path):
+        """Drop the cached counts if the files are not as this process last left them"""
+        seen = self._stamp(excel_path)
+        if seen != self._seen:
+            self._forget()
+            self._seen = seen
+
+    def _wrote(self, excel_path):
+        """Record the files as this process just left them, cached counts up to date"""
+        self._seen = self._stamp(excel_path)
+
+    def workbook_rows(self, excel_path):
+        """Data rows in the workbook itself (journaled changes not included)"""
+        with self._lock:
+            self._refresh(excel_path)
+            if self._workbook_rows is None:
+                self._workbook_rows = self._count_workbook_rows(excel_path)
+            return self._workbook_rows
+
+    def pending(self, excel_path):
+        """Number of journaled changes not yet in the workbook"""
+        with self._lock:
+            self._refresh(excel_path)
+            if self._pending is None:
+                rows, deleted = self._read_journal(excel_path)
+                self._pending = len(rows) + len(deleted)
+            return self._pending
+
+    def append(self, excel_path, rows, compact=True):
+        """
+        Journal rows (lists of visitor columns) with sequential IDs.
+        Returns the IDs given to the rows; they are final unless a delete
+        is compacted first, which renumbers everything after it. With
+        compact=False the caller compacts when it is done.
+        """
+        with self.exclusive(excel_path):
+            with self._lock:
+                pending = self.pending(excel_path)
+                if self._next_id is None:
+                    journaled, deleted = self._read_journal(excel_path)
+                    removed = [record_id for record_id in deleted if record_id in self._record_ids(excel_path)]
+                    self._next_id = (self.workbook_rows(excel_path)
+                                     + len(journaled) - len(removed) + 1)
+
+                ids = []
+                with self._open_journal(excel_path) as journal:
+                    for row in rows:
+                        ids.append(self._next_id)
+                        journal.write(json.dumps([self._next_id] + list(row)) + '\n')
+                        self._next_id += 1
+                self._pending = pending + len(ids)
+                self._wrote(excel_path)
+                due = compact and self._due(excel_path)
+
+            if due:
+                self.compact(excel_path)
+            return ids
+
+    def delete(self, excel_path, record_ids, compact=True):
+        """
+        Journal one tombstone for a batch of deleted DB ids. Only ids that
+        are in the log (and not already tombstoned) move later IDs down.
+        """
+        record_ids = list(dict.fromkeys(int(record_id) for record_id in record_ids))
+        if not record_ids:
+            return
+        with self.exclusive(excel_path):
+            with self._lock:
+                pending = self.pending(excel_path)
+                if self._next_id is not None:
+                    journaled, deleted = self._read_journal(excel_path)
+                    live = {row[RECORD_ID_INDEX] for row in journaled}
+                    present = [record_id for record_id in record_ids
+                               if record_id in live
+                               or (record_id not in deleted and record_id in self._record_ids(excel_path))]
+                with self._open_journal(excel_path) as journal:
+                    journal.write(json.dumps({'delete': record_ids}) + '\n')
+                if self._next_id is not None:
+                    self._next_id -= len(present)
+                self._pending = pending + len(record_ids)
+                self._wrote(excel_path)
+                due = compact and self._due(excel_path)
+
+            if due:
+                self.compact(excel_path)
+
+    def _record_ids(self, excel_path):
+        if self._workbook_ids is None:
+            self._workbook_ids = workbook_record_ids(excel_path)
+        return self._workbook_ids
+
+    def _open_journal(self, excel_path):
+        """The journal, opened for appending; a new one starts with the time it was started"""
+        path = journal_path(excel_path)
+        new = not os.path.exists(path)
+        journal = open(path, 'a', encoding='utf-8')
+        if new:
+            journal.write(json.dumps({'started': time.time()}) + '\n')
+        return journal
+
+    def _due(self, excel_path):
+        """Enough changes journaled, or the oldest has waited long enough"""
+        if self._pending >= self.compact_every:
+            return True
+        if not self.compact_after or not self._pending:
+            return False
+        started = self._journal_started(excel_path)
+        return started is not None and time.time() - started >= self.compact_after
+
+    @staticmethod
+    def _journal_started(excel_path):
+        try:
+            with open(journal_path(excel_path), encoding='utf-8') as journal:
+                entry = json.loads(journal.readline())
+        except (FileNotFoundError, ValueError):
+            return None
+        return entry.get('started') if isinstance(entry, dict) else None
+
+    def compact(self, excel_path):
+        """
+        Fold the journal into the workbook in one streaming pass: drop
+        tombstoned rows, append new ones and renumber the ID column.
+        """
+        with self.exclusive(excel_path):
+            rows, deleted = self._read_journal(excel_path)
+            if not rows and not deleted:
+                with self._lock:
+                    self._refresh(excel_path)
+                    self._pending = 0
+                return 0
+
+            count = 0
+
+            def renumbered():
+                nonlocal count
+                kept = (row for row in read_rows(excel_path)
+                        if len(row) <= RECORD_ID_INDEX or row[RECORD_ID_INDEX] not in deleted)
+                for row in itertools.chain(kept, rows):
+                    row = list(row)
+                    count += 1
+                    row[0] = count
+                    yield row
+
+            write_workbook(excel_path, renumbered())
+            self.reset(excel_path, next_id=count + 1)
+            print(f"✅ Compacted {len(rows)} new and {len(deleted)} deleted rows into {excel_path}")
+            return len(rows) + len(deleted)
+
+    def reset(self, excel_path, next_id=None):
+        """Drop the journal, e.g. after the workbook was rebuilt from the DB"""
+        with self.exclusive(excel_path), self._lock:
+            path = journal_path(excel_path)
+            if os.path.exists(path):
+                os.remove(path)
+            self._forget()
+            if next_id:
+                # Every caller passes next_id right after writing the workbook
+                self._pending = 0
+                self._next_id = next_id
+                self._workbook_rows = next_id - 1
+            self._wrote(excel_path)
+
+    @staticmethod
+    def _read_journal(excel_path):
+        """
+        Journaled rows and the set of tombstoned record ids. A tombstone
+        drops the rows journaled before it; rows journaled after it (a row
+        written again by excel_reconcile.py) are kept.
+        """
+        rows, deleted = [], set()
+        path = journal_path(excel_path)
+        try:
+            journal = open(path, encoding='utf-8')
+        except FileNotFoundError:
+            return rows, deleted
+        with journal:
+            for line in journal:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A torn last line from a crash mid-write
+                    print(f"⚠️ Skipping unreadable journal line in {path}")
+                    continue
+                if isinstance(entry, dict):
+                    ids = set(entry.get('delete', []))
+                    deleted.update(ids)
+                    if rows and ids:
+                        rows = [row for row in rows if row[RECORD_ID_INDEX] not in ids]
+                else:
+                    rows.append(entry)
+        return rows, deleted
+
+    @staticmethod
+    def _count_workbook_rows(excel_path):
+        """Data rows in the workbook; read_only mode only parses the sheet dimension"""
+        if not os.path.exists(excel_path):
+            return 0
+        saved = saved_row_count(excel_path)
+        if saved is not None:
+            return saved
+        wb = openpyxl.load_workbook(excel_path, read_only=True)
+        try:
+            ws = wb.active
+            max_row = ws.max_row
+            if max_row is None:
+                # No dimension tag saved; count the rows once
+                max_row = sum(1 for _ in ws.iter_rows(values_only=True))
+            return max(max_row - 1, 0)
+        finally:
+            wb.close()
@@ -0,0 +1,115 @@
+"""
+CROSS-PROCESS FILE LOCK
+Gunicorn workers (and CLI runs) share the Excel log, its journal and the
+reconciler state, so their writes take turns through an OS lock on a
+small lock file next to them: fcntl.flock() on POSIX, msvcrt.locking()
+on Windows. The OS drops the lock when the holder's file is closed or its
+process dies, so there is nothing stale to detect or break, however long
+a compaction or rebuild takes. The lock file itself stays on disk.
+
+FileLock is re-entrant within a process and serializes its threads with
+a lock of its own. acquire(blocking=False) / try_acquire() return False
+straight away when another process holds it (excel_reconcile.py skips
+its run then).
+"""
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# How often a blocking acquire retries where the OS cannot wait (Windows)
+POLL_SECONDS = 0.05
+
+
+def _lock_fd(fd, blocking):
+    """Lock an open file; False if blocking=False and another process holds it"""
+    if fcntl is not None:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            return True
+        except BlockingIOError:
+            return False
+    while True:
+        try:
+            # Locks the first byte; the file may be empty
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            if not blocking:
+                return False
+            time.sleep(POLL_SECONDS)
+
+
+def _unlock_fd(fd):
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    else:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+
+class FileLock:
+    """Exclusive lock on `path` across processes and threads; usable as a context manager"""
+
+    def __init__(self, path):
+        self.path = path
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    def acquire(self, blocking=True):
+        """Take the lock; with blocking=False returns False instead of waiting"""
+        if not self._thread_lock.acquire(blocking):
+            return False
+        if self._depth == 0:
+            try:
+                locked = self._lock_file(blocking)
+            except BaseException:
+                self._thread_lock.release()
+                raise
+            if not locked:
+                self._thread_lock.release()
+                return False
+        self._depth += 1
+        return True
+
+    def try_acquire(self):
+        return self.acquire(blocking=False)
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0:
+            fd, self._fd = self._fd, None
+            try:
+                _unlock_fd(fd)
+            finally:
+                os.close(fd)
+        self._thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def _lock_file(self, blocking):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            locked = _lock_fd(fd, blocking)
+        except BaseException:
+            os.close(fd)
+            raise
+        if not locked:
+            os.close(fd)
+            return False
+        self._fd = fd
+        return True
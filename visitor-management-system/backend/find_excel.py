@@ -10,21 +10,24 @@ print("="*70)
 print("🔍 FINDING AND UPDATING EXCEL FILE...")
 print("="*70)
 
-# First, trigger rebuild to ensure latest data
+# First, bring the log up to date with the database
 print("\n🔄 Updating Excel with latest database data...")
 print("   (This ensures all visitors are in the Excel file)\n")
 
-# Import and run the rebuild function
+# Import and run the reconciler
 try:
     # Add current directory to path
     sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
     
-    # Import Flask app
-    from app import app, rebuild_excel, EXCEL_FILE
+    # Import Flask app (the SQLite backend that owns the Excel log); importing
+    # is cheap - no schema checks or Excel compaction, just the reconcile below
+    import app_smart_search
+    from app_smart_search import app, reconcile_excel
     
-    # Use app context to access database
+    # Only rows that differ from the database are rewritten (excel_reconcile.py)
     with app.app_context():
-        rebuild_excel()
+        reconcile_excel(full=True, compact=True)
+    EXCEL_FILE = app_smart_search.EXCEL_FILE
     
     # Now find and open the file
     print("\n📂 Excel file location:")
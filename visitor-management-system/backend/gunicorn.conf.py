@@ -0,0 +1,20 @@
+"""
+GUNICORN SETTINGS - picked up automatically when gunicorn starts in backend/
+One-time setup (tables, indexes, Excel log) runs once in the master before
+any worker is forked, so workers only import the app and start serving.
+Safe with --preload: setup closes its DB connections before the fork, and
+the background threads (Excel exporter and reconciler, profiler,
+auto-checkout, kiosk outbox) start lazily in workers.
+"""
+import importlib
+
+# Open event streams each hold a thread; each worker keeps at most
+# EVENT_STREAMS_PER_WORKER (events.py, default 4) of them, so raise both
+# together and keep the difference for API calls
+threads = 8
+
+
+def on_starting(server):
+    # "app:app" -> module "app"; works for app_smart_search:app too
+    module_name = server.app.app_uri.split(':', 1)[0]
+    importlib.import_module(module_name).initialize()
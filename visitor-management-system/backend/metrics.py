@@ -0,0 +1,302 @@
+"""
+METRICS - Request and phase timing, exposed for Prometheus
+  - visitor_request_seconds: latency histogram per route, method and status
+  - visitor_phase_seconds: histogram per phase of work (DB statements and
+    commits, Excel path lookup, journal append, compaction, rebuild, JSON)
+  - gauges read at scrape time: Excel file size and rows, DB pool usage
+    and whatever else an app registers
+GET /metrics returns them in the Prometheus text format. No client
+library is needed; the format is plain text.
+
+Slow-request profiler (off unless PROFILE_SLOW_MS is set): while a request
+runs, a background thread samples its stack every PROFILE_INTERVAL_MS.
+Requests slower than PROFILE_SLOW_MS have their samples written to
+PROFILE_DIR as collapsed stacks, one "frame;frame;frame count" line per
+distinct stack, ready for flamegraph.pl or speedscope.
+"""
+import bisect
+import functools
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+from flask import g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+PROFILE_SLOW_MS = float(os.getenv('PROFILE_SLOW_MS', '0'))
+PROFILE_INTERVAL_MS = float(os.getenv('PROFILE_INTERVAL_MS', '5'))
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _label_text(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+class Histogram:
+    """Cumulative-bucket histogram with labels"""
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0, 0.0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += 1
+            series[2] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted(self._series.items())
+            series = [(labels, list(counts), total, sum_) for labels, (counts, total, sum_) in series]
+        for labels, counts, total, sum_ in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket'
+                             f'{_label_text(self.labels + ("le",), labels + (repr(bound),))} {cumulative}')
+            lines.append(f'{self.name}_bucket{_label_text(self.labels + ("le",), labels + ("+Inf",))} {total}')
+            lines.append(f'{self.name}_count{_label_text(self.labels, labels)} {total}')
+            lines.append(f'{self.name}_sum{_label_text(self.labels, labels)} {sum_:.6f}')
+        return lines
+
+
+class Gauge:
+    """Value read at scrape time: fn() returns a number or {label value: number}"""
+
+    def __init__(self, name, help, fn, label=None):
+        self.name, self.help, self.fn, self.label = name, help, fn, label
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} gauge']
+        try:
+            value = self.fn()
+        except Exception as e:
+            lines.append(f'# {self.name} unavailable: {e}')
+            return lines
+        if isinstance(value, dict):
+            for key, number in sorted(value.items()):
+                if number is not None:
+                    lines.append(f'{self.name}{_label_text((self.label,), (key,))} {number}')
+        elif value is not None:
+            lines.append(f'{self.name} {value}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name, help, fn, label=None):
+        return self.add(Gauge(name, help, fn, label))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+REQUEST_SECONDS = registry.add(Histogram(
+    'visitor_request_seconds', 'Time to handle a request, by route',
+    labels=('method', 'route', 'status')))
+
+PHASE_SECONDS = registry.add(Histogram(
+    'visitor_phase_seconds', 'Time spent in each phase of request and export work',
+    labels=('phase',)))
+
+
+@contextmanager
+def phase(name):
+    """Time a block of work as one observation of visitor_phase_seconds"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        PHASE_SECONDS.observe(time.perf_counter() - started, name)
+
+
+def timed(name):
+    """Decorator form of phase()"""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with phase(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+# Every SQL statement, whichever app or thread runs it
+@event.listens_for(Engine, 'before_cursor_execute')
+def _statement_started(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _statement_finished(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('metrics_started')
+    if started:
+        PHASE_SECONDS.observe(time.perf_counter() - started.pop(), 'db_execute')
+
+
+def pool_stats(engine):
+    """Connections held by the pool, checked out and in overflow"""
+    pool = engine.pool
+    stats = {}
+    for key in ('size', 'checkedin', 'checkedout', 'overflow'):
+        fn = getattr(pool, key, None)
+        if callable(fn):
+            # QueuePool reports unused overflow slots as a negative overflow
+            stats[key] = max(fn(), 0)
+    return stats
+
+
+# ========================================
+# SLOW-REQUEST PROFILER
+# ========================================
+
+class SamplingProfiler:
+    """Samples the stacks of registered threads on a background thread"""
+
+    def __init__(self, interval_ms=PROFILE_INTERVAL_MS, output_dir=PROFILE_DIR):
+        self.interval = interval_ms / 1000
+        self.output_dir = output_dir
+        self._active = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self.dumps = 0
+
+    def start(self, thread_id):
+        samples = Counter()
+        with self._lock:
+            self._active[thread_id] = samples
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='sampling-profiler',
+                                                daemon=True)
+                self._thread.start()
+        return samples
+
+    def stop(self, thread_id):
+        with self._lock:
+            return self._active.pop(thread_id, None)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._active:
+                    continue
+                frames = sys._current_frames()
+                for thread_id, samples in self._active.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        samples[_collapse(frame)] += 1
+
+    def dump(self, samples, label, elapsed):
+        """Write collapsed stacks for one slow request; returns the path"""
+        os.makedirs(self.output_dir, exist_ok=True)
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+        slug = re.sub(r'[^A-Za-z0-9]+', '_', label).strip('_') or 'request'
+        path = os.path.join(self.output_dir, f'{stamp}_{slug}_{int(elapsed * 1000)}ms.folded')
+        with open(path, 'w') as f:
+            for stack, count in samples.most_common():
+                f.write(f'{stack} {count}\n')
+        self.dumps += 1
+        return path
+
+
+def _collapse(frame):
+    """Root-first 'file:function;...' line for one stack"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+# ========================================
+# FLASK WIRING
+# ========================================
+
+def instrument(app, engine_fn, gauges=()):
+    """
+    Time every request of a Flask app, register its gauges and serve
+    GET /metrics. engine_fn() returns the app's SQLAlchemy engine (it needs
+    an app context, so it is looked up at scrape time).
+    """
+    profiler = SamplingProfiler() if PROFILE_SLOW_MS > 0 else None
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_started = time.perf_counter()
+        if profiler:
+            g.metrics_samples = profiler.start(threading.get_ident())
+
+    @app.after_request
+    def _record_request(response):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        REQUEST_SECONDS.observe(elapsed, request.method, route, response.status_code)
+
+        if profiler and g.pop('metrics_samples', None) is not None:
+            samples = profiler.stop(threading.get_ident())
+            if samples and elapsed * 1000 >= PROFILE_SLOW_MS:
+                path = profiler.dump(samples, f'{request.method} {route}', elapsed)
+                print(f"🐢 Slow request {request.method} {request.path} "
+                      f"({elapsed * 1000:.0f} ms) - stacks saved to {path}")
+        return response
+
+    if profiler:
+        @app.teardown_request
+        def _stop_profiling(exc):
+            # Requests that raised never reach after_request
+            profiler.stop(threading.get_ident())
+
+    # Gauges belong to this app; the histograms are shared by the process
+    app_gauges = Registry()
+    app_gauges.gauge('visitor_db_pool_connections', 'Database pool connections by state',
+                     lambda: pool_stats(engine_fn()), label='state')
+    for gauge in gauges:
+        app_gauges.add(gauge)
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        return app.response_class(registry.render() + app_gauges.render(),
+                                  content_type=CONTENT_TYPE)
+
+    return profiler
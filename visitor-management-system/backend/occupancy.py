@@ -0,0 +1,68 @@
+"""
+LIVE OCCUPANCY - Who is in the building right now
+Keeps the open visits (checked in, not yet checked out) in memory so the
+count and the roll-call list are answered without touching the visitors
+table. The set is loaded from the open-visits index at startup and
+updated on every check-in and checkout.
+
+Each worker remembers the data version (see response_cache.py) its set
+matches. A write by this worker moves it forward in step; a write by any
+other worker shows up as a version it did not expect, and the set is
+reloaded from the index on the next read.
+"""
+import threading
+
+
+class Occupancy:
+    """In-memory set of open visits, keyed by visitor id"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._visitors = {}
+        self._version = None
+        self.reloads = 0
+
+    def is_current(self, version):
+        return self._version is not None and self._version == version
+
+    def load(self, visitors, version):
+        """Replace the set with the open visits read from the DB"""
+        with self._lock:
+            self._visitors = {v['id']: v for v in visitors}
+            self._version = version
+            self.reloads += 1
+
+    def check_in(self, visitors, version):
+        """Record new open visits written in the transaction that made `version`"""
+        with self._lock:
+            self._advance(version)
+            for visitor in visitors:
+                self._visitors[visitor['id']] = visitor
+
+    def check_out(self, visitor_ids, version):
+        """Drop visits closed in the transaction that made `version`"""
+        with self._lock:
+            self._advance(version)
+            for visitor_id in visitor_ids:
+                self._visitors.pop(visitor_id, None)
+
+    def invalidate(self):
+        """Force a reload on the next read"""
+        with self._lock:
+            self._version = None
+
+    def _advance(self, version):
+        # Only step forward if nothing else was written since our last sync
+        if self._version is not None and version == self._version + 1:
+            self._version = version
+        else:
+            self._version = None
+
+    def count(self):
+        return len(self._visitors)
+
+    def snapshot(self):
+        """Open visits, longest in the building first"""
+        with self._lock:
+            visitors = list(self._visitors.values())
+        return sorted(visitors, key=lambda v: (v['check_in'] is None, v['check_in'], v['id']))
@@ -0,0 +1,312 @@
+"""
+KIOSK OUTBOX - Durable local buffer for check-ins and checkouts
+Optional (KIOSK_OUTBOX=<path of a SQLite file>) for kiosks in front of a
+MySQL server that may be slow or restarting. With it on, app.py writes
+check-ins and checkouts to an embedded SQLite outbox and answers 202 at
+once; a background thread per worker drains the outbox to MySQL:
+  - Every check-in carries a client-generated id (client_id, a UUID the
+    kiosk sends or the server makes up), so it is known before MySQL has
+    seen it and can be checked out by it.
+  - Entries go to MySQL oldest first, OUTBOX_BATCH at a time, as
+    idempotent upserts keyed by client_id (ON DUPLICATE KEY on MySQL, ON
+    CONFLICT on SQLite): a batch replayed after a crash changes nothing.
+  - A failed batch is retried with exponential backoff (with jitter) up
+    to OUTBOX_BACKOFF_MAX seconds. A batch rejected for its data, not for
+    a connection problem, is retried one entry at a time; an entry that
+    still fails OUTBOX_MAX_ATTEMPTS times is set aside as dead.
+  - Entries are leased while a batch is applied, and only the oldest
+    entries are ever taken, so workers sharing the file drain it in order.
+stats() reports the backlog, the age of the oldest unsynced entry and the
+dead entries (GET /outbox, and the visitor_outbox_* gauges).
+
+Lists, search and headcounts read MySQL, so they show a buffered entry
+once it is drained.
+"""
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import DataError, IntegrityError, ProgrammingError
+
+# Path of the outbox database; empty turns the outbox off
+KIOSK_OUTBOX = os.getenv('KIOSK_OUTBOX', '')
+
+# Entries applied to the server per transaction
+OUTBOX_BATCH = int(os.getenv('OUTBOX_BATCH', '200'))
+
+# Retry delays: base * 2^attempts, at most the max
+OUTBOX_BACKOFF_BASE = float(os.getenv('OUTBOX_BACKOFF_BASE', '0.5'))
+OUTBOX_BACKOFF_MAX = float(os.getenv('OUTBOX_BACKOFF_MAX', '60'))
+
+# Failures of an entry rejected for its data before it is set aside
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', '8'))
+
+# Longest wait between looks at the outbox when there is nothing to send
+OUTBOX_IDLE_SECONDS = 1.0
+
+# A batch lease outlives a worker that died applying it by this long
+LEASE_SECONDS = 120
+
+CHECKIN = 'checkin'
+CHECKOUT = 'checkout'
+
+# Errors no retry will fix; anything else (connection lost, timeouts) is retried
+PERMANENT_ERRORS = (IntegrityError, DataError, ProgrammingError, KeyError, TypeError, ValueError)
+
+OutboxEntry = namedtuple('OutboxEntry', 'seq kind key payload accepted_at attempts')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    accepted_at TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    retry_at REAL NOT NULL DEFAULT 0,
+    last_error TEXT,
+    dead INTEGER NOT NULL DEFAULT 0
+);
+CREATE UNIQUE INDEX IF NOT EXISTS ux_outbox_kind_key ON outbox (kind, key);
+CREATE INDEX IF NOT EXISTS ix_outbox_dead_seq ON outbox (dead, seq);
+"""
+
+
+def _timestamp(moment):
+    # Fixed width, so the oldest entry is also the smallest string
+    return moment.isoformat(timespec='microseconds')
+
+
+def upsert_new(table, rows, key, dialect):
+    """
+    INSERT that leaves rows whose `key` already exists as they are: ON
+    DUPLICATE KEY UPDATE key = key on MySQL, ON CONFLICT DO NOTHING on SQLite
+    """
+    if dialect == 'mysql':
+        statement = mysql_insert(table).values(rows)
+        return statement.on_duplicate_key_update({key: statement.inserted[key]})
+    if dialect == 'sqlite':
+        return sqlite_insert(table).values(rows).on_conflict_do_nothing(index_elements=[key])
+    raise ValueError(f'no idempotent insert for {dialect}')
+
+
+class Outbox:
+    """
+    SQLite-backed queue of check-ins and checkouts, drained by a daemon
+    thread calling apply(entries) inside the Flask app context
+    """
+
+    def __init__(self, path, apply, batch_size=OUTBOX_BATCH):
+        self.path = path
+        self.apply = apply
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._conn = None
+        self._conn_pid = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._wake = threading.Event()
+        # After a batch was rejected for its data: send one at a time up to this seq
+        self._single_until = 0
+
+        self.synced = 0
+        self.batches = 0
+        self.errors = 0
+        self.last_error = None
+        self.last_synced_at = None
+
+    # ========================================
+    # LOCAL STORAGE
+    # ========================================
+
+    def _connection(self):
+        # One connection per process: a connection must not cross a fork
+        if self._conn is None or self._conn_pid != os.getpid():
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            # An accepted check-in must survive a power cut
+            conn.execute('PRAGMA synchronous=FULL')
+            conn.executescript(SCHEMA)
+            self._conn, self._conn_pid = conn, os.getpid()
+        return self._conn
+
+    def _transaction(self, work):
+        """Run work(conn) in one write transaction"""
+        with self._lock:
+            conn = self._connection()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                result = work(conn)
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+            return result
+
+    # ========================================
+    # PRODUCER SIDE (request handlers)
+    # ========================================
+
+    def add(self, kind, key, payload, accepted_at=None):
+        """
+        Durably queue one entry. The same (kind, key) twice - a kiosk
+        retrying its request - is queued once. Returns True if it was new.
+        """
+        accepted_at = accepted_at or datetime.utcnow()
+        added = self._transaction(lambda conn: conn.execute(
+            'INSERT OR IGNORE INTO outbox (kind, key, payload, accepted_at) VALUES (?, ?, ?, ?)',
+            (kind, key, json.dumps(payload), _timestamp(accepted_at))
+        ).rowcount)
+        self._wake.set()
+        return bool(added)
+
+    # ========================================
+    # CONSUMER SIDE (drain thread)
+    # ========================================
+
+    def claim(self, limit):
+        """
+        Lease the oldest live entries whose retry time has come, stopping at
+        the first that is leased or backing off, so order is kept
+        """
+        def work(conn):
+            now = time.time()
+            rows = conn.execute(
+                'SELECT seq, kind, key, payload, accepted_at, attempts, retry_at FROM outbox '
+                'WHERE dead = 0 ORDER BY seq LIMIT ?', (limit,)
+            ).fetchall()
+            entries = []
+            for seq, kind, key, payload, accepted_at, attempts, retry_at in rows:
+                if retry_at > now:
+                    break
+                entries.append(OutboxEntry(seq, kind, key, json.loads(payload),
+                                           datetime.fromisoformat(accepted_at), attempts))
+            if entries:
+                conn.execute(f'UPDATE outbox SET retry_at = ? WHERE seq IN ({_marks(entries)})',
+                             [now + LEASE_SECONDS] + [entry.seq for entry in entries])
+            return entries
+        return self._transaction(work)
+
+    def done(self, entries):
+        self._transaction(lambda conn: conn.execute(
+            f'DELETE FROM outbox WHERE seq IN ({_marks(entries)})', [entry.seq for entry in entries]))
+
+    def release(self, entries):
+        """Give leased entries back for an immediate retry"""
+        self._transaction(lambda conn: conn.execute(
+            f'UPDATE outbox SET retry_at = 0 WHERE seq IN ({_marks(entries)})',
+            [entry.seq for entry in entries]))
+
+    def retry_later(self, entries, error, permanent=False):
+        """Count a failed attempt and back off; permanent failures eventually go dead"""
+        attempts = max(entry.attempts for entry in entries) + 1
+        delay = min(OUTBOX_BACKOFF_BASE * 2 ** attempts, OUTBOX_BACKOFF_MAX) * random.uniform(0.5, 1.0)
+        dead = permanent and attempts >= OUTBOX_MAX_ATTEMPTS
+        self._transaction(lambda conn: conn.execute(
+            'UPDATE outbox SET attempts = attempts + 1, last_error = ?, retry_at = ?, dead = ? '
+            f'WHERE seq IN ({_marks(entries)})',
+            [error[:500], time.time() + delay, int(dead)] + [entry.seq for entry in entries]))
+        return dead
+
+    def drain_once(self, flask_app):
+        """Send one batch; returns the number of entries synced"""
+        limit = 1 if self._single_until else self.batch_size
+        entries = self.claim(limit)
+        if not entries:
+            return 0
+        try:
+            with flask_app.app_context():
+                self.apply(entries)
+        except Exception as e:
+            self.errors += 1
+            self.last_error = _describe(e)
+            permanent = isinstance(e, PERMANENT_ERRORS)
+            if permanent and len(entries) > 1:
+                # Find the entry at fault: retry this stretch one entry at a time
+                self._single_until = entries[-1].seq
+                self.release(entries)
+            elif self.retry_later(entries, self.last_error, permanent):
+                print(f"❌ Outbox entry {entries[0].seq} set aside after "
+                      f"{OUTBOX_MAX_ATTEMPTS} attempts: {self.last_error}")
+                if entries[-1].seq >= self._single_until:
+                    self._single_until = 0
+            else:
+                print(f"⚠️ Outbox sync failed, will retry: {self.last_error}")
+            return 0
+
+        self.done(entries)
+        if self._single_until and entries[-1].seq >= self._single_until:
+            self._single_until = 0
+        self.synced += len(entries)
+        self.batches += 1
+        self.last_synced_at = datetime.now().isoformat(timespec='seconds')
+        return len(entries)
+
+    def ensure_started(self, flask_app):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, args=(flask_app,),
+                                                name='kiosk-outbox', daemon=True)
+                self._thread.start()
+
+    def _run(self, flask_app):
+        while True:
+            try:
+                synced = self.drain_once(flask_app)
+            except Exception as e:
+                # The outbox file itself failed (disk full, locked for too long)
+                self.errors += 1
+                self.last_error = _describe(e)
+                print(f"⚠️ Outbox unavailable: {self.last_error}")
+                synced = 0
+            if not synced:
+                self._wake.wait(OUTBOX_IDLE_SECONDS)
+                self._wake.clear()
+
+    # ========================================
+    # REPORTING
+    # ========================================
+
+    def stats(self):
+        with self._lock:
+            backlog, oldest, dead = self._connection().execute(
+                'SELECT COALESCE(SUM(dead = 0), 0), MIN(CASE WHEN dead = 0 THEN accepted_at END), '
+                'COALESCE(SUM(dead), 0) FROM outbox'
+            ).fetchone()
+        age = None
+        if oldest is not None:
+            age = round((datetime.utcnow() - datetime.fromisoformat(oldest)).total_seconds(), 3)
+        return {
+            'enabled': True,
+            'path': os.path.abspath(self.path),
+            'backlog': backlog,
+            'oldest_age_seconds': age,
+            'dead': dead,
+            'synced': self.synced,
+            'batches': self.batches,
+            'errors': self.errors,
+            'last_error': self.last_error,
+            'last_synced_at': self.last_synced_at,
+        }
+
+
+def _describe(error):
+    # SQLAlchemy errors carry the statement and parameters on later lines
+    first_line = (str(error).splitlines() or [''])[0]
+    return f'{type(error).__name__}: {first_line}'
+
+
+def _marks(entries):
+    return ', '.join('?' * len(entries))
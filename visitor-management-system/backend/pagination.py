@@ -0,0 +1,129 @@
+"""
+KEYSET PAGINATION - Shared by the visitor list endpoints
+Pages are ordered newest first on (timestamp, id) and addressed by an
+opaque cursor, so fetching a page costs the same no matter how big the
+table gets. Rows without a timestamp come last, by id.
+"""
+import base64
+import json
+from datetime import datetime
+
+from encoding import Rows
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+
+
+class PaginationError(ValueError):
+    """Raised for a bad limit, cursor or fields parameter"""
+
+
+# ========================================
+# CURSORS
+# ========================================
+
+def encode_cursor(sort_value, row_id):
+    """Pack the last row's (timestamp or None, id) into an opaque URL-safe token"""
+    sort_value = None if sort_value is None else sort_value.isoformat()
+    payload = json.dumps([sort_value, row_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Unpack a token made by encode_cursor()"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        sort_value, row_id = json.loads(base64.urlsafe_b64decode(padded))
+        if sort_value is not None:
+            sort_value = datetime.fromisoformat(sort_value)
+        return sort_value, int(row_id)
+    except (ValueError, TypeError):
+        raise PaginationError('cursor is invalid')
+
+
+# ========================================
+# QUERY PARAMETERS
+# ========================================
+
+def parse_limit(raw):
+    """Read the ?limit= parameter, clamped to MAX_LIMIT"""
+    if raw in (None, ''):
+        return DEFAULT_LIMIT
+    try:
+        limit = int(raw)
+    except ValueError:
+        raise PaginationError('limit must be a number')
+    if limit < 1:
+        raise PaginationError('limit must be at least 1')
+    return min(limit, MAX_LIMIT)
+
+
+def parse_fields(raw, allowed):
+    """Read the ?fields= parameter (comma separated); default is every field"""
+    if not raw:
+        return list(allowed)
+    fields = []
+    for field in raw.split(','):
+        field = field.strip()
+        if not field:
+            continue
+        if field not in allowed:
+            raise PaginationError(f'unknown field: {field}')
+        if field not in fields:
+            fields.append(field)
+    return fields or list(allowed)
+
+
+# ========================================
+# PAGE FETCH
+# ========================================
+
+def fetch_page(session, model, sort_field, fields, limit, cursor=None, formatters=None,
+               sources=None):
+    """
+    Fetch one page of rows, newest first.
+    Only the requested columns are selected and rows stay plain tuples, so
+    no ORM objects or per-row dicts are built; formatters run when the
+    page is encoded (see encoding.py). Returns (Rows, next_cursor).
+    sources lists column namespaces (models or Table.c) to read instead of
+    model alone, e.g. live and archived visitors; their pages are merged.
+    """
+    # Always select the keyset columns so the next cursor can be built
+    select_fields = list(fields)
+    for key in ('id', sort_field):
+        if key not in select_fields:
+            select_fields.append(key)
+    sort_index, id_index = select_fields.index(sort_field), select_fields.index('id')
+
+    rows = []
+    for source in sources or [model]:
+        sort_col = getattr(source, sort_field)
+        id_col = source.id
+        query = session.query(*[getattr(source, f) for f in select_fields])
+        if cursor:
+            last_sort, last_id = decode_cursor(cursor)
+            if last_sort is None:
+                # Into the rows without a timestamp, which sort last
+                query = query.filter(sort_col.is_(None), id_col < last_id)
+            else:
+                query = query.filter(
+                    (sort_col < last_sort) | ((sort_col == last_sort) & (id_col < last_id))
+                    | sort_col.is_(None)
+                )
+        rows.extend(query.order_by(sort_col.desc(), id_col.desc()).limit(limit + 1).all())
+    if sources and len(sources) > 1:
+        # Same order as the SQL: newest first, NULL timestamps last
+        rows.sort(key=lambda row: (row[sort_index] is not None, row[sort_index], row[id_index]),
+                  reverse=True)
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    next_cursor = None
+    if has_more and rows:
+        last = rows[-1]
+        next_cursor = encode_cursor(last[sort_index], last[id_index])
+    if len(select_fields) > len(fields):
+        # The keyset columns were appended after the requested ones
+        rows = [row[:len(fields)] for row in rows]
+    return Rows(fields, rows, formatters), next_cursor
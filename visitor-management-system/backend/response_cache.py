@@ -0,0 +1,174 @@
+"""
+VERSIONED RESPONSE CACHE + CONDITIONAL GET
+A one-row data_version table is bumped inside every transaction that
+changes visitors. List and search responses are tagged with that version:
+  - a client that already has it gets 304 Not Modified (ETag/Last-Modified)
+  - otherwise the serialized body is served from an in-memory cache keyed
+    by (version, request URL, representation) and only built on a miss.
+    Bodies are encoded as the client asked (JSON or MessagePack, records or
+    columns, compressed or not; see encoding.py) and cached that way.
+Because the version lives in the database, every gunicorn worker sees the
+same version and caches can never serve data older than the last commit.
+"""
+import threading
+import zlib
+from collections import OrderedDict
+from datetime import datetime
+
+from flask import current_app, request
+from sqlalchemy import Column, DateTime, Integer, MetaData, Table, select, update
+
+from encoding import EncodingError, JSON, choose_coding, encode, negotiate, parse_layout
+from metrics import phase
+
+CACHE_ENTRIES = 256
+
+data_version = Table(
+    'data_version', MetaData(),
+    Column('id', Integer, primary_key=True),
+    Column('version', Integer, nullable=False),
+    Column('updated_at', DateTime, nullable=False),
+)
+
+
+def ensure_version_table(engine):
+    """Create the data_version table and its single row if missing"""
+    data_version.create(engine, checkfirst=True)
+    with engine.begin() as conn:
+        if conn.execute(select(data_version.c.id)).first() is None:
+            conn.execute(data_version.insert().values(
+                id=1, version=1, updated_at=datetime.utcnow().replace(microsecond=0)))
+
+
+def bump_version(session):
+    """
+    Mark the visitor data as changed; call before the write's commit.
+    Returns the new version.
+    """
+    # Never ahead of the clock: a burst of writes shares a second instead
+    # of pushing Last-Modified into the future (see last_modified())
+    _, previous = current_version(session)
+    updated_at = datetime.utcnow().replace(microsecond=0)
+    if previous and previous > updated_at:
+        updated_at = previous
+    session.execute(
+        update(data_version)
+        .where(data_version.c.id == 1)
+        .values(version=data_version.c.version + 1, updated_at=updated_at)
+    )
+    # Read back inside the transaction: the row is now locked by this write
+    return current_version(session)[0]
+
+
+def current_version(session):
+    """(version, updated_at) - a single primary-key read"""
+    row = session.execute(
+        select(data_version.c.version, data_version.c.updated_at)
+        .where(data_version.c.id == 1)
+    ).first()
+    return (row.version, row.updated_at) if row else (0, None)
+
+
+class ResponseCache:
+    """Small LRU of encoded response bodies keyed by (version, URL, representation)"""
+
+    def __init__(self, max_entries=CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+            return body
+
+    def put(self, key, body):
+        with self._lock:
+            self._entries[key] = body
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+def version_etag(version, shape, media_type=JSON):
+    """Weak ETag value for one version of one request URL in one media type"""
+    if media_type != JSON:
+        shape = f'{shape} {media_type}'
+    # crc32, not hash(): ETags must match across gunicorn workers
+    return f'v{version}-{zlib.crc32(shape.encode()):08x}'
+
+
+def last_modified(updated_at, now=None):
+    """
+    Last-Modified for a version, or None while its second is still running:
+    Last-Modified has one-second resolution and writes in the same second
+    share updated_at, so a client could otherwise keep a stale date. The
+    ETag tells versions apart either way.
+    """
+    now = (now or datetime.utcnow()).replace(microsecond=0)
+    return updated_at if updated_at and updated_at < now else None
+
+
+def is_not_modified(etag, updated_at, if_none_match, if_modified_since):
+    """
+    Whether a conditional GET can be answered with 304. if_none_match is a
+    werkzeug ETags set (or None), if_modified_since a datetime (or None).
+    """
+    if if_none_match:
+        return if_none_match.contains_weak(etag)
+    return bool(updated_at and if_modified_since
+                and if_modified_since.replace(tzinfo=None) >= updated_at)
+
+
+def cached_json(session, cache, build):
+    """
+    Serve build()'s payload for the current request with ETag and
+    Last-Modified, answering 304 when the client is up to date and reusing
+    the cached body when another client already asked the same thing.
+    """
+    try:
+        layout = parse_layout(request.args)
+    except EncodingError as e:
+        return current_app.json.response({'error': str(e)}), 400
+    media_type = negotiate(request.accept_mimetypes)
+    version, updated_at = current_version(session)
+    shape = request.full_path
+    etag = version_etag(version, shape, media_type)
+
+    if is_not_modified(etag, updated_at, request.if_none_match, request.if_modified_since):
+        response = current_app.response_class(status=304)
+    else:
+        coding = choose_coding(request.accept_encodings)
+        key = (version, shape, media_type, coding)
+        cached = cache.get(key)
+        if cached is None:
+            payload = build()
+            with phase('encode'):
+                cached = encode(payload, media_type, layout, coding)
+            cache.put(key, cached)
+        body, content_encoding = cached
+        response = current_app.response_class(body, mimetype=media_type)
+        if content_encoding:
+            response.content_encoding = content_encoding
+
+    response.vary.update(('Accept', 'Accept-Encoding'))
+    response.set_etag(etag, weak=True)
+    if last_modified(updated_at):
+        response.last_modified = updated_at
+    # Let browsers keep the body but always revalidate it
+    response.cache_control.no_cache = True
+    return response
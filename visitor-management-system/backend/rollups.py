@@ -0,0 +1,346 @@
+"""
+VISIT ANALYTICS ROLLUPS
+Visit counts per day, per hour and per purpose, plus completed visits and
+total stay time (check_out - check_in) so average stay is one division.
+The rollup tables are updated inside the same transaction as the write
+that changes a visit (check-in, checkout, delete), so the stats endpoints
+read a handful of small rows instead of scanning the visitors table.
+
+Buckets use the stored timestamps, which are UTC. A visit's checkout and
+stay are counted on the day and purpose of its check-in.
+
+Rebuilding from history (first deployment, or after editing rows by hand):
+    python rollups.py backfill              # SQLite backend
+    python rollups.py backfill --app app    # MySQL backend
+"""
+import argparse
+import sys
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import (BigInteger, Column, Date, Integer, MetaData, String, Table,
+                        delete, func, select, update)
+
+# Visitors read per backfill chunk
+BACKFILL_CHUNK = 5000
+
+# Stats cover the last 30 days unless ?from=/?to= say otherwise
+DEFAULT_DAYS = 30
+
+metadata = MetaData()
+
+rollup_day = Table(
+    'visit_rollup_day', metadata,
+    Column('day', Date, primary_key=True),
+    Column('visits', Integer, nullable=False, default=0),
+    Column('completed', Integer, nullable=False, default=0),
+    Column('stay_seconds', BigInteger, nullable=False, default=0),
+)
+
+rollup_hour = Table(
+    'visit_rollup_hour', metadata,
+    Column('day', Date, primary_key=True),
+    Column('hour', Integer, primary_key=True, autoincrement=False),
+    Column('visits', Integer, nullable=False, default=0),
+)
+
+rollup_purpose = Table(
+    'visit_rollup_purpose', metadata,
+    Column('day', Date, primary_key=True),
+    Column('purpose', String(255), primary_key=True),
+    Column('visits', Integer, nullable=False, default=0),
+    Column('completed', Integer, nullable=False, default=0),
+    Column('stay_seconds', BigInteger, nullable=False, default=0),
+)
+
+ROLLUP_TABLES = (rollup_day, rollup_hour, rollup_purpose)
+
+
+class StatsError(ValueError):
+    """Raised for a bad stats request"""
+
+
+def ensure_rollup_tables(engine):
+    """Create the rollup tables if missing"""
+    metadata.create_all(engine, checkfirst=True)
+
+
+# ========================================
+# DELTAS
+# ========================================
+
+def _purpose_key(purpose):
+    # Part of the primary key, so never NULL and never longer than the column
+    return (purpose or '')[:255]
+
+
+def stay_seconds(check_in, check_out):
+    """Whole seconds between check-in and checkout (never negative)"""
+    return max(int((check_out - check_in).total_seconds()), 0)
+
+
+class RollupDelta:
+    """
+    Counter changes gathered while a write runs, applied with apply() in
+    the write's transaction: one upsert per touched bucket, however many
+    visitors the write covered.
+    """
+
+    def __init__(self):
+        self.days = defaultdict(lambda: [0, 0, 0])
+        self.hours = defaultdict(int)
+        self.purposes = defaultdict(lambda: [0, 0, 0])
+
+    def visit(self, check_in, purpose, sign=1):
+        """Count a check-in (sign=-1 takes it back)"""
+        day, purpose = check_in.date(), _purpose_key(purpose)
+        self.days[day][0] += sign
+        self.hours[(day, check_in.hour)] += sign
+        self.purposes[(day, purpose)][0] += sign
+
+    def stay(self, check_in, purpose, seconds, sign=1):
+        """Count a completed visit of `seconds` (sign=-1 takes it back)"""
+        day, purpose = check_in.date(), _purpose_key(purpose)
+        for counters in (self.days[day], self.purposes[(day, purpose)]):
+            counters[1] += sign
+            counters[2] += sign * seconds
+
+    def remove(self, check_in, purpose, check_out=None):
+        """Take back everything a deleted visit contributed"""
+        if check_in is None:
+            return
+        self.visit(check_in, purpose, sign=-1)
+        if check_out is not None:
+            self.stay(check_in, purpose, stay_seconds(check_in, check_out), sign=-1)
+
+    def apply(self, session):
+        """Add the gathered changes to the rollup tables; call before commit"""
+        _increment(session, rollup_day, ('day',), [
+            {'day': day, 'visits': v, 'completed': c, 'stay_seconds': s}
+            for day, (v, c, s) in self.days.items() if v or c or s
+        ])
+        _increment(session, rollup_hour, ('day', 'hour'), [
+            {'day': day, 'hour': hour, 'visits': v}
+            for (day, hour), v in self.hours.items() if v
+        ])
+        _increment(session, rollup_purpose, ('day', 'purpose'), [
+            {'day': day, 'purpose': purpose, 'visits': v, 'completed': c, 'stay_seconds': s}
+            for (day, purpose), (v, c, s) in self.purposes.items() if v or c or s
+        ])
+
+
+def _increment(session, table, keys, rows):
+    """Upsert rows, adding their counters to any existing bucket"""
+    if not rows:
+        return
+    counters = [name for name in rows[0] if name not in keys]
+    dialect = session.get_bind().dialect.name
+
+    # Dialect modules are imported here, not at the top: the PostgreSQL one
+    # alone costs every worker tens of milliseconds of boot time
+    if dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        insert = dialect_insert(table)
+        session.execute(insert.on_conflict_do_update(
+            index_elements=list(keys),
+            set_={name: table.c[name] + insert.excluded[name] for name in counters},
+        ), rows)
+    elif dialect in ('mysql', 'mariadb'):
+        from sqlalchemy.dialects.mysql import insert as dialect_insert
+        insert = dialect_insert(table)
+        session.execute(insert.on_duplicate_key_update(
+            {name: table.c[name] + insert.inserted[name] for name in counters}
+        ), rows)
+    else:
+        for row in rows:
+            match = [table.c[key] == row[key] for key in keys]
+            changed = session.execute(update(table).where(*match).values(
+                {name: table.c[name] + row[name] for name in counters}
+            )).rowcount
+            if not changed:
+                session.execute(table.insert().values(row))
+
+
+# ========================================
+# BACKFILL
+# ========================================
+
+def backfill(session, id_column, check_in_column, purpose_column,
+             check_out_column=None, chunk_size=BACKFILL_CHUNK, lock=None, archive=None):
+    """
+    Rebuild every rollup from the visitors table, reading it in id order,
+    chunk_size rows at a time. archive, if given, is the same columns of
+    the archive table, counted too. Runs as one transaction; lock(session),
+    if given, is called first so concurrent writers wait instead of being
+    counted twice. Returns the number of visitors counted.
+    """
+    if lock:
+        lock(session)
+    for table in ROLLUP_TABLES:
+        session.execute(delete(table))
+
+    columns = [id_column, check_in_column, purpose_column]
+    if check_out_column is not None:
+        columns.append(check_out_column)
+
+    counted = 0
+    for source in [columns] + ([list(archive)] if archive else []):
+        counted = _count_visits(session, source, chunk_size, counted)
+
+    session.commit()
+    return counted
+
+
+def _count_visits(session, columns, chunk_size, counted):
+    """Add one table's visits to the rollups; returns the running total"""
+    id_column, last_id = columns[0], None
+    while True:
+        query = select(*columns).order_by(id_column).limit(chunk_size)
+        if last_id is not None:
+            query = query.where(id_column > last_id)
+        rows = session.execute(query).all()
+        if not rows:
+            break
+
+        delta = RollupDelta()
+        for row in rows:
+            check_in, purpose = row[1], row[2]
+            if check_in is None:
+                continue
+            delta.visit(check_in, purpose)
+            if len(columns) > 3 and row[3] is not None:
+                delta.stay(check_in, purpose, stay_seconds(check_in, row[3]))
+        delta.apply(session)
+
+        counted += len(rows)
+        last_id = rows[-1][0]
+        print(f"   ...{counted} visitors counted")
+    return counted
+
+
+# ========================================
+# STATS QUERIES (rollup tables only)
+# ========================================
+
+def _parse_day(raw, name):
+    if not raw:
+        return None
+    try:
+        return datetime.strptime(raw, '%Y-%m-%d').date()
+    except ValueError:
+        raise StatsError(f'{name} must be a date like 2026-02-07')
+
+
+def parse_range(args, today=None):
+    """?from=&to= (inclusive, YYYY-MM-DD); defaults to the last DEFAULT_DAYS days"""
+    today = today or datetime.utcnow().date()
+    end = _parse_day(args.get('to'), 'to') or today
+    start = _parse_day(args.get('from'), 'from') or end - timedelta(days=DEFAULT_DAYS - 1)
+    if start > end:
+        raise StatsError('from must not be after to')
+    return start, end
+
+
+def _average(seconds, completed):
+    return round(seconds / completed) if completed else None
+
+
+def _in_range(table, start, end):
+    return (table.c.day >= start, table.c.day <= end)
+
+
+def summary(session, start, end):
+    """Totals for the range"""
+    row = session.execute(
+        select(func.coalesce(func.sum(rollup_day.c.visits), 0),
+               func.coalesce(func.sum(rollup_day.c.completed), 0),
+               func.coalesce(func.sum(rollup_day.c.stay_seconds), 0))
+        .where(*_in_range(rollup_day, start, end))
+    ).one()
+    visits, completed, seconds = (int(value) for value in row)
+    return {
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'visits': visits,
+        'completed': completed,
+        'average_stay_seconds': _average(seconds, completed),
+    }
+
+
+def daily(session, start, end):
+    """One entry per day that had visits, oldest first"""
+    rows = session.execute(
+        select(rollup_day.c.day, rollup_day.c.visits,
+               rollup_day.c.completed, rollup_day.c.stay_seconds)
+        .where(*_in_range(rollup_day, start, end), rollup_day.c.visits > 0)
+        .order_by(rollup_day.c.day)
+    )
+    return [
+        {'day': day.isoformat(), 'visits': visits, 'completed': completed,
+         'average_stay_seconds': _average(seconds, completed)}
+        for day, visits, completed, seconds in rows
+    ]
+
+
+def hourly(session, start, end):
+    """Check-ins per hour of day (0-23, UTC) across the range"""
+    rows = session.execute(
+        select(rollup_hour.c.hour, func.sum(rollup_hour.c.visits))
+        .where(*_in_range(rollup_hour, start, end))
+        .group_by(rollup_hour.c.hour)
+    )
+    counts = {hour: int(visits) for hour, visits in rows}
+    return [{'hour': hour, 'visits': counts.get(hour, 0)} for hour in range(24)]
+
+
+def by_purpose(session, start, end):
+    """Visits per purpose across the range, busiest first"""
+    visits = func.sum(rollup_purpose.c.visits)
+    completed = func.sum(rollup_purpose.c.completed)
+    seconds = func.sum(rollup_purpose.c.stay_seconds)
+    rows = session.execute(
+        select(rollup_purpose.c.purpose, visits, completed, seconds)
+        .where(*_in_range(rollup_purpose, start, end))
+        .group_by(rollup_purpose.c.purpose)
+        .having(visits > 0)
+        .order_by(visits.desc(), rollup_purpose.c.purpose)
+    )
+    return [
+        {'purpose': purpose, 'visits': int(v), 'completed': int(c),
+         'average_stay_seconds': _average(int(s), int(c))}
+        for purpose, v, c, s in rows
+    ]
+
+
+# ========================================
+# COMMAND LINE
+# ========================================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Visit analytics rollups')
+    parser.add_argument('command', choices=['backfill'],
+                        help='backfill: rebuild the rollups from the visitors table')
+    parser.add_argument('--app', choices=['app_smart_search', 'app'], default='app_smart_search',
+                        help='backend whose database to use (default: app_smart_search)')
+    parser.add_argument('--chunk', type=int, default=BACKFILL_CHUNK,
+                        help=f'visitors read per chunk (default: {BACKFILL_CHUNK})')
+    args = parser.parse_args(argv)
+
+    if args.app == 'app':
+        from app import app, backfill_rollups, initialize
+    else:
+        from app_smart_search import app, backfill_rollups, initialize
+    initialize(app)
+
+    print(f"🔄 Rebuilding visit rollups from {args.app} visitors...")
+    with app.app_context():
+        counted = backfill_rollups(args.chunk)
+    print(f"✅ Rollups rebuilt from {counted} visitors")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
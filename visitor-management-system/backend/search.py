@@ -0,0 +1,210 @@
+"""
+SMART SEARCH - Indexed visitor lookup
+SQLite: an FTS5 table over name, phone, purpose and comments (ranked with
+bm25) plus a trigram FTS5 table over phone numbers for suffix/contains
+lookups. Both are external-content tables kept in sync by triggers, so
+every write path (single, bulk, batched delete) updates them.
+Phone prefixes use the ordinary B-tree index on the phone column.
+
+MySQL: a FULLTEXT index on (name, purpose) queried in boolean mode.
+"""
+import re
+
+from sqlalchemy import text
+
+from encoding import Rows
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+MAX_OFFSET = 10000
+PHONE_MATCHES = ('prefix', 'suffix', 'contains')
+
+# bm25 column weights: name, phone, purpose, comments
+BM25_WEIGHTS = '10.0, 5.0, 2.0, 1.0'
+
+_TERM = re.compile(r'\w+', re.UNICODE)
+
+
+class SearchError(ValueError):
+    """Raised for a bad search request"""
+
+
+# ========================================
+# QUERY PARAMETERS
+# ========================================
+
+def parse_search_args(args):
+    """Validate ?q=&phone=&phone_match=&limit=&offset="""
+    q = (args.get('q') or '').strip()
+    phone = re.sub(r'[^0-9+]', '', args.get('phone') or '')
+    phone_match = args.get('phone_match') or 'prefix'
+
+    if not q and not phone:
+        raise SearchError('q or phone is required')
+    if q and not _TERM.findall(q):
+        raise SearchError('q has no searchable words')
+    if phone_match not in PHONE_MATCHES:
+        raise SearchError(f'phone_match must be one of: {", ".join(PHONE_MATCHES)}')
+    if phone and phone_match != 'prefix' and len(phone) < 3:
+        raise SearchError(f'phone {phone_match} search needs at least 3 digits')
+
+    try:
+        limit = min(int(args.get('limit') or DEFAULT_LIMIT), MAX_LIMIT)
+        offset = int(args.get('offset') or 0)
+    except ValueError:
+        raise SearchError('limit and offset must be numbers')
+    if limit < 1 or offset < 0:
+        raise SearchError('limit must be at least 1 and offset not negative')
+    if offset > MAX_OFFSET:
+        raise SearchError(f'offset must be at most {MAX_OFFSET}; narrow the search instead')
+
+    return q, phone, phone_match, limit, offset
+
+
+def fts_query(q):
+    """Turn free text into an FTS5 query: every word, as a prefix, must match"""
+    return ' AND '.join(f'"{term}"*' for term in _TERM.findall(q))
+
+
+def boolean_query(q):
+    """Turn free text into a MySQL boolean-mode FULLTEXT query"""
+    return ' '.join(f'+{term}*' for term in _TERM.findall(q))
+
+
+def _prefix_range(prefix):
+    """Upper bound for a B-tree range scan over strings starting with prefix"""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+# ========================================
+# SQLITE FTS5 INDEX
+# ========================================
+
+def _sqlite_schema(table):
+    fts = f'{table}_fts'
+    phone_fts = f'{table}_phone_fts'
+    return [
+        f"""CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(
+            name, phone, purpose, comments,
+            content='{table}', content_rowid='id', prefix='2 3'
+        )""",
+        f"""CREATE VIRTUAL TABLE IF NOT EXISTS {phone_fts} USING fts5(
+            phone, content='{table}', content_rowid='id', tokenize='trigram'
+        )""",
+        f"""CREATE TRIGGER IF NOT EXISTS {table}_search_ai AFTER INSERT ON {table} BEGIN
+            INSERT INTO {fts}(rowid, name, phone, purpose, comments)
+                VALUES (new.id, new.name, new.phone, new.purpose, new.comments);
+            INSERT INTO {phone_fts}(rowid, phone) VALUES (new.id, new.phone);
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {table}_search_ad AFTER DELETE ON {table} BEGIN
+            INSERT INTO {fts}({fts}, rowid, name, phone, purpose, comments)
+                VALUES ('delete', old.id, old.name, old.phone, old.purpose, old.comments);
+            INSERT INTO {phone_fts}({phone_fts}, rowid, phone)
+                VALUES ('delete', old.id, old.phone);
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {table}_search_au AFTER UPDATE ON {table} BEGIN
+            INSERT INTO {fts}({fts}, rowid, name, phone, purpose, comments)
+                VALUES ('delete', old.id, old.name, old.phone, old.purpose, old.comments);
+            INSERT INTO {phone_fts}({phone_fts}, rowid, phone)
+                VALUES ('delete', old.id, old.phone);
+            INSERT INTO {fts}(rowid, name, phone, purpose, comments)
+                VALUES (new.id, new.name, new.phone, new.purpose, new.comments);
+            INSERT INTO {phone_fts}(rowid, phone) VALUES (new.id, new.phone);
+        END""",
+    ]
+
+
+def sqlite_search_index_exists(engine, table):
+    """True if ensure_sqlite_search_index() has set up the FTS5 tables"""
+    with engine.connect() as conn:
+        return conn.execute(
+            text("SELECT 1 FROM sqlite_master WHERE name = :name"),
+            {'name': f'{table}_fts'}
+        ).first() is not None
+
+
+def ensure_sqlite_search_index(engine, table):
+    """
+    Create the FTS5 tables and sync triggers if missing, and index existing
+    rows the first time. Returns False if this SQLite build lacks FTS5.
+    """
+    with engine.begin() as conn:
+        existing = conn.execute(
+            text("SELECT name FROM sqlite_master WHERE name = :name"),
+            {'name': f'{table}_fts'}
+        ).first()
+        try:
+            for statement in _sqlite_schema(table):
+                conn.execute(text(statement))
+        except Exception as e:
+            print(f"⚠️ Search index unavailable (SQLite without FTS5?): {e}")
+            return False
+        if not existing:
+            conn.execute(text(f"INSERT INTO {table}_fts({table}_fts) VALUES ('rebuild')"))
+            conn.execute(text(f"INSERT INTO {table}_phone_fts({table}_phone_fts) VALUES ('rebuild')"))
+            print(f"✅ Built search index for {table}")
+    return True
+
+
+def search_sqlite(session, table, q, phone, phone_match, limit, offset):
+    """
+    Ranked visitor ids for a search (best match first, newest first when
+    there is no text query). Returns (ids, has_more).
+    """
+    joins, where, params = [], [], {'limit': limit + 1, 'offset': offset}
+
+    if q:
+        joins.append(f'JOIN {table}_fts ON {table}_fts.rowid = v.id')
+        where.append(f'{table}_fts MATCH :q')
+        params['q'] = fts_query(q)
+        order = f'bm25({table}_fts, {BM25_WEIGHTS}), v.id DESC'
+    else:
+        order = 'v.created_at DESC, v.id DESC'
+
+    if phone and phone_match == 'prefix':
+        where.append('v.phone >= :phone_lo AND v.phone < :phone_hi')
+        params['phone_lo'] = phone
+        params['phone_hi'] = _prefix_range(phone)
+    elif phone:
+        joins.append(f'JOIN {table}_phone_fts ON {table}_phone_fts.rowid = v.id')
+        if phone_match == 'suffix':
+            # Trigram index narrows the candidates; the second check anchors the end
+            where.append(f'{table}_phone_fts.phone LIKE :phone_like AND v.phone LIKE :phone_like')
+            params['phone_like'] = f'%{phone}'
+        else:
+            where.append(f'{table}_phone_fts.phone LIKE :phone_like')
+            params['phone_like'] = f'%{phone}%'
+
+    sql = (
+        f"SELECT v.id FROM {table} v {' '.join(joins)} "
+        f"WHERE {' AND '.join(where)} ORDER BY {order} LIMIT :limit OFFSET :offset"
+    )
+    ids = [row[0] for row in session.execute(text(sql), params)]
+    return ids[:limit], len(ids) > limit
+
+
+# ========================================
+# RESULT ROWS
+# ========================================
+
+def rows_by_ids(session, model, fields, ids, formatters=None, sources=None):
+    """
+    Fetch the requested columns for ids, keeping the ranked order, as Rows
+    (see encoding.py). With sources (models or Table.c), ids not found in
+    one are looked up in the next.
+    """
+    if not ids:
+        return Rows(fields, [], formatters)
+    select_fields = list(fields) if 'id' in fields else list(fields) + ['id']
+    id_index = select_fields.index('id')
+
+    by_id = {}
+    for source in sources or [model]:
+        missing = [i for i in ids if i not in by_id]
+        if not missing:
+            break
+        rows = (session.query(*[getattr(source, f) for f in select_fields])
+                .filter(source.id.in_(missing)))
+        for row in rows:
+            by_id[row[id_index]] = row[:len(fields)]
+    return Rows(fields, [by_id[i] for i in ids if i in by_id], formatters)
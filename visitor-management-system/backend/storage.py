@@ -0,0 +1,115 @@
+"""
+STORAGE - Database setup shared by both backends
+Picks the database from the environment (DATABASE_URL, else the app's
+default) and tunes the engine for it:
+  - MySQL: sized connection pool, pre-ping and recycling so workers never
+    get a dead connection after MySQL restarts or idles them out
+  - SQLite: WAL journal (readers no longer block the writer),
+    synchronous=NORMAL and a busy timeout instead of "database is locked"
+Also creates the tables, and the nullable columns and indexes missing
+from existing tables.
+The ASGI server (asgi.py) reaches the same database through the asyncio
+drivers named in ASYNC_DRIVERS.
+"""
+import os
+import sqlite3
+
+from sqlalchemy import event, inspect, text
+from sqlalchemy.engine import Engine
+
+# MySQL pool, per gunicorn worker
+POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '5'))
+POOL_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '10'))
+POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', '30'))
+POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '1800'))
+
+# How long a SQLite writer waits for the lock before giving up
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+
+# Blocking driver -> asyncio driver for the same database
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'sqlite+pysqlite': 'sqlite+aiosqlite',
+    'mysql': 'mysql+aiomysql',
+    'mysql+pymysql': 'mysql+aiomysql',
+}
+
+
+def database_url(default):
+    """DATABASE_URL from the environment, else the app's default"""
+    return os.getenv('DATABASE_URL') or default
+
+
+def engine_options(url):
+    """SQLAlchemy engine options for the chosen backend"""
+    if url.startswith('sqlite'):
+        return {'connect_args': {'timeout': SQLITE_BUSY_TIMEOUT_MS / 1000}}
+    return {
+        'pool_size': POOL_SIZE,
+        'max_overflow': POOL_MAX_OVERFLOW,
+        'pool_timeout': POOL_TIMEOUT,
+        'pool_recycle': POOL_RECYCLE,
+        'pool_pre_ping': True,
+    }
+
+
+def configure(app, default_url):
+    """Point a Flask app at its database; call before SQLAlchemy(app)"""
+    url = database_url(default_url)
+    app.config['SQLALCHEMY_DATABASE_URI'] = url
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(url)
+    return url
+
+
+def async_url(url):
+    """The same database (a sqlalchemy URL object) behind its asyncio driver"""
+    driver = ASYNC_DRIVERS.get(url.drivername)
+    if driver is None:
+        raise ValueError(f'no asyncio driver for {url.drivername}')
+    return url.set(drivername=driver)
+
+
+@event.listens_for(Engine, 'connect')
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    """Tune every new SQLite connection (other databases are left alone)"""
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        tune_sqlite(dbapi_connection)
+
+
+def tune_sqlite(dbapi_connection):
+    """WAL, synchronous=NORMAL and the busy timeout for one SQLite connection"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute(f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}')
+    cursor.close()
+
+
+def create_schema(db, *models):
+    """Create missing tables, then columns and indexes create_all() skips on existing tables"""
+    db.create_all()
+    for model in models:
+        add_missing_columns(db.engine, model.__table__)
+        for index in model.__table__.indexes:
+            index.create(db.engine, checkfirst=True)
+
+
+def add_missing_columns(engine, table):
+    """ALTER TABLE ... ADD COLUMN for nullable columns added to the model since the table was made"""
+    existing = {column['name'] for column in inspect(engine).get_columns(table.name)}
+    preparer = engine.dialect.identifier_preparer
+    for column in table.columns:
+        if column.name in existing or not column.nullable:
+            continue
+        with engine.begin() as conn:
+            conn.execute(text(f'ALTER TABLE {preparer.format_table(table)} '
+                              f'ADD COLUMN {preparer.format_column(column)} '
+                              f'{column.type.compile(engine.dialect)}'))
+        print(f"✅ Added column {table.name}.{column.name}")
+
+
+def describe(engine):
+    """Printable database location with the password hidden"""
+    return engine.url.render_as_string(hide_password=True)
+
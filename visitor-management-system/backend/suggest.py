@@ -0,0 +1,306 @@
+"""
+RETURNING-VISITOR TYPEAHEAD - In-memory prefix index
+GET .../visitors/suggest?q= answers every keystroke from memory: the most
+recent details (name, phone, purpose, comments) of returning visitors
+whose name words or phone number start with what was typed.
+
+A visitor is identified by their phone digits (by name when there is no
+phone). Visitors are kept in segments of SEGMENT_SIZE by when they were
+last seen, each a sorted array of (term, visitor key) pairs, so a prefix
+lookup is a bisect plus a forward scan per segment. Lookups walk the
+segments newest first and stop as soon as they have enough matches: a
+common prefix like "pr" only reads the newest segment, however many
+visitors the index holds. The index is loaded from the newest
+SUGGEST_LOAD_ROWS visits, updated in place on check-in and delete, and
+holds at most SUGGEST_MAX_VISITORS visitors: adding one more evicts the
+one seen least recently.
+
+Like occupancy.py it remembers the data version it matches. Writes made
+through this process move it forward in step; anything else (another
+gunicorn worker, bulk scripts, archival) makes it stale, and it reloads,
+at most once every SUGGEST_SYNC_SECONDS, on the next lookup.
+"""
+import bisect
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+SUGGEST_MAX_VISITORS = int(os.getenv('SUGGEST_MAX_VISITORS', '20000'))
+SUGGEST_LOAD_ROWS = int(os.getenv('SUGGEST_LOAD_ROWS', '50000'))
+SUGGEST_SYNC_SECONDS = float(os.getenv('SUGGEST_SYNC_SECONDS', '5'))
+
+DEFAULT_LIMIT = 8
+MAX_LIMIT = 20
+MIN_QUERY_LENGTH = 2
+
+# Visitors per recency segment
+SEGMENT_SIZE = 512
+
+# Index entries looked at per lookup, for queries whose words rarely occur together
+SCAN_LIMIT = 2000
+
+# Recent visits kept per visitor, so deleting the newest falls back to the one before
+KEEP_VISITS = 3
+
+_WORD = re.compile(r'\w+', re.UNICODE)
+
+# Sorts after every character, so (prefix + _LAST_CHAR,) bounds a prefix range
+_LAST_CHAR = chr(0x10FFFF)
+
+
+class SuggestError(ValueError):
+    """Raised for a bad suggest request"""
+
+
+def parse_suggest_args(args):
+    """?q=&limit="""
+    q = (args.get('q') or '').strip()
+    if len(q) < MIN_QUERY_LENGTH:
+        raise SuggestError(f'q must be at least {MIN_QUERY_LENGTH} characters')
+    try:
+        limit = min(int(args.get('limit') or DEFAULT_LIMIT), MAX_LIMIT)
+    except ValueError:
+        raise SuggestError('limit must be a number')
+    if limit < 1:
+        raise SuggestError('limit must be at least 1')
+    return q, limit
+
+
+def _digits(phone):
+    return re.sub(r'\D', '', phone or '')
+
+
+def _key(name, phone):
+    digits = _digits(phone)
+    return f'p:{digits}' if digits else f'n:{(name or "").strip().lower()}'
+
+
+def _terms(name, phone):
+    """Searchable prefixes of a visitor: each name word, and the phone digits"""
+    terms = {word.lower() for word in _WORD.findall(name or '')}
+    digits = _digits(phone)
+    if digits:
+        terms.add(digits)
+    return terms
+
+
+class _Segment:
+    """Visitors last seen in one stretch of time, with their terms sorted"""
+    __slots__ = ('terms', 'size')
+
+    def __init__(self):
+        self.terms = []
+        self.size = 0
+
+    def insert(self, key, terms):
+        for term in terms:
+            bisect.insort(self.terms, (term, key))
+
+    def remove(self, key, terms):
+        for term in terms:
+            index = bisect.bisect_left(self.terms, (term, key))
+            if index < len(self.terms) and self.terms[index] == (term, key):
+                del self.terms[index]
+
+
+class SuggestIndex:
+    """Prefix index of returning visitors, most recently seen kept"""
+
+    def __init__(self, max_visitors=SUGGEST_MAX_VISITORS):
+        self.max_visitors = max_visitors
+        self._lock = threading.Lock()
+        # key -> {'visits': [visit, ...] newest first, 'count': n, 'terms': set,
+        #         'segment': _Segment}, least recently seen first
+        self._visitors = OrderedDict()
+        self._by_id = {}
+        # Oldest first; only the last one takes new visitors
+        self._segments = [_Segment()]
+        self._version = None
+        self._checked_at = 0.0
+        self.reloads = 0
+        self.evictions = 0
+
+    # ========================================
+    # SYNC WITH THE DATABASE
+    # ========================================
+
+    def needs_sync(self):
+        """True once per SUGGEST_SYNC_SECONDS; the caller then checks the data version"""
+        now = time.monotonic()
+        if self._version is not None and now - self._checked_at < SUGGEST_SYNC_SECONDS:
+            return False
+        self._checked_at = now
+        return True
+
+    def is_current(self, version):
+        return self._version is not None and self._version == version
+
+    def load(self, visits, version):
+        """
+        Replace the index with visits read newest first, each a dict with
+        id, name, phone, purpose, comments and last_visit
+        """
+        visitors, by_id = OrderedDict(), {}
+        for visit in visits:
+            key = _key(visit['name'], visit['phone'])
+            entry = visitors.get(key)
+            if entry is None:
+                if len(visitors) >= self.max_visitors:
+                    continue
+                entry = visitors[key] = {'visits': [], 'count': 0,
+                                         'terms': _terms(visit['name'], visit['phone'])}
+            entry['count'] += 1
+            if len(entry['visits']) < KEEP_VISITS:
+                entry['visits'].append(visit)
+                by_id[visit['id']] = key
+
+        # Read newest first; least recently seen goes to the front
+        visitors = OrderedDict(reversed(visitors.items()))
+        segments = []
+        for position, (key, entry) in enumerate(visitors.items()):
+            if position % SEGMENT_SIZE == 0:
+                segments.append(_Segment())
+            segment = entry['segment'] = segments[-1]
+            segment.terms.extend((term, key) for term in entry['terms'])
+            segment.size += 1
+        for segment in segments:
+            segment.terms.sort()
+
+        with self._lock:
+            self._visitors, self._by_id = visitors, by_id
+            self._segments = segments or [_Segment()]
+            self._version = version
+            self._checked_at = time.monotonic()
+            self.reloads += 1
+
+    def invalidate(self):
+        with self._lock:
+            self._version = None
+
+    def _advance(self, version):
+        # Only step forward if nothing else was written since our last sync
+        if self._version is not None and version == self._version + 1:
+            self._version = version
+        else:
+            self._version = None
+
+    # ========================================
+    # INCREMENTAL UPDATES
+    # ========================================
+
+    def add(self, visits, version):
+        """Record check-ins committed in the transaction that made `version`"""
+        with self._lock:
+            self._advance(version)
+            for visit in visits:
+                key = _key(visit['name'], visit['phone'])
+                entry = self._visitors.get(key)
+                if entry is None:
+                    entry = self._visitors[key] = {'visits': [], 'count': 0, 'terms': set(),
+                                                   'segment': None}
+                else:
+                    self._visitors.move_to_end(key)
+                    self._leave(key, entry)
+                entry['count'] += 1
+                entry['visits'].insert(0, visit)
+                self._by_id[visit['id']] = key
+                for dropped in entry['visits'][KEEP_VISITS:]:
+                    self._by_id.pop(dropped['id'], None)
+                del entry['visits'][KEEP_VISITS:]
+                entry['terms'] = _terms(visit['name'], visit['phone'])
+                self._join(key, entry)
+            while len(self._visitors) > self.max_visitors:
+                key, entry = self._visitors.popitem(last=False)
+                self._forget(key, entry)
+                self.evictions += 1
+
+    def remove(self, visit_ids, version):
+        """Drop visits deleted in the transaction that made `version`"""
+        with self._lock:
+            self._advance(version)
+            for visit_id in visit_ids:
+                key = self._by_id.pop(visit_id, None)
+                entry = self._visitors.get(key)
+                if entry is None:
+                    continue
+                entry['visits'] = [v for v in entry['visits'] if v['id'] != visit_id]
+                entry['count'] -= 1
+                if not entry['visits']:
+                    del self._visitors[key]
+                    self._forget(key, entry)
+                    continue
+                # The visitor's terms follow their latest remaining visit
+                latest = entry['visits'][0]
+                terms = _terms(latest['name'], latest['phone'])
+                segment = entry['segment']
+                segment.remove(key, entry['terms'] - terms)
+                segment.insert(key, terms - entry['terms'])
+                entry['terms'] = terms
+
+    def _join(self, key, entry):
+        """Put a visitor in the newest segment"""
+        segment = self._segments[-1]
+        if segment.size >= SEGMENT_SIZE:
+            segment = _Segment()
+            self._segments.append(segment)
+        segment.insert(key, entry['terms'])
+        segment.size += 1
+        entry['segment'] = segment
+
+    def _leave(self, key, entry):
+        """Take a visitor out of their segment, dropping the segment once empty"""
+        segment = entry['segment']
+        segment.remove(key, entry['terms'])
+        segment.size -= 1
+        if segment.size == 0 and segment is not self._segments[-1]:
+            self._segments.remove(segment)
+
+    def _forget(self, key, entry):
+        self._leave(key, entry)
+        for visit in entry['visits']:
+            self._by_id.pop(visit['id'], None)
+
+    # ========================================
+    # LOOKUP
+    # ========================================
+
+    def suggest(self, q, limit=DEFAULT_LIMIT):
+        """
+        Returning visitors matching every word of q (a word matches a name
+        word or the phone digits by prefix), most recently seen first
+        """
+        words = {word.lower() for word in _WORD.findall(q)}
+        if not words:
+            return []
+        matches = []
+        scanned = 0
+        with self._lock:
+            for segment in reversed(self._segments):
+                # Scan the word with the fewest entries here, check the rest per visitor
+                terms = segment.terms
+                ranges = [(bisect.bisect_left(terms, (word,)),
+                           bisect.bisect_left(terms, (word + _LAST_CHAR,)), word) for word in words]
+                low, high, first = min(ranges, key=lambda r: r[1] - r[0])
+                high = min(high, low + SCAN_LIMIT - scanned)
+                scanned += high - low
+                rest = words - {first}
+                for key in {key for _, key in terms[low:high]}:
+                    entry = self._visitors[key]
+                    if all(any(term.startswith(word) for term in entry['terms']) for word in rest):
+                        matches.append((entry['visits'][0], entry['count']))
+                # Older segments only hold visitors seen before these
+                if len(matches) >= limit or scanned >= SCAN_LIMIT:
+                    break
+
+        matches.sort(key=lambda match: (match[0]['last_visit'], match[0]['id']), reverse=True)
+        return [dict(visit, visits=count) for visit, count in matches[:limit]]
+
+    def stats(self):
+        return {
+            'visitors': len(self._visitors),
+            'segments': len(self._segments),
+            'reloads': self.reloads,
+            'evictions': self.evictions,
+        }
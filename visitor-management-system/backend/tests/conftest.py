@@ -0,0 +1,55 @@
+"""
+Shared fixtures. The backend modules are imported from the directory
+above, the way app.py imports them.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def excel_path(tmp_path):
+    """Where a test's log workbook goes (its journal and sidecars go next to it)"""
+    return str(tmp_path / 'visitors_log.xlsx')
+
+
+@pytest.fixture(scope='session')
+def workdir(tmp_path_factory):
+    """
+    A scratch working directory for the apps, which keep config.ini, the
+    SQLite DB and the Excel log relative to it. The app modules read their
+    settings at import, so tests import them only after this fixture ran.
+    """
+    path = tmp_path_factory.mktemp('backend')
+    previous = os.getcwd()
+    os.chdir(path)
+    os.environ['DATABASE_URL'] = f"sqlite:///{path / 'visitors.db'}"
+    os.environ['EXCEL_RECONCILE_SECONDS'] = '0'
+    yield path
+    os.chdir(previous)
+
+
+@pytest.fixture(scope='session')
+def smart_search(workdir):
+    """app_smart_search, set up once on the scratch database"""
+    import app_smart_search
+    app_smart_search.initialize(app_smart_search.app)
+    yield app_smart_search
+    # Write queued Excel changes while the scratch directory is still current
+    app_smart_search.excel_exporter.shutdown()
+
+
+@pytest.fixture(scope='session')
+def kiosk(workdir):
+    """app.py (the kiosk backend), set up once on a scratch database of its own"""
+    shared = os.environ['DATABASE_URL']
+    os.environ['DATABASE_URL'] = f"sqlite:///{workdir / 'kiosk.db'}"
+    try:
+        import app
+    finally:
+        os.environ['DATABASE_URL'] = shared
+    app.initialize(app.app)
+    return app
@@ -0,0 +1,76 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import Column, DateTime, Integer, String, create_engine, insert, select, text
+from sqlalchemy.orm import Session, declarative_base
+
+from archive import archive_old, archive_table, ensure_archive_table
+
+Base = declarative_base()
+
+CUTOFF = datetime(2025, 1, 1)
+
+
+class Visit(Base):
+    __tablename__ = 'archive_test_visit'
+    __table_args__ = ({'sqlite_autoincrement': True},)
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String(100), nullable=False)
+    created_at = Column(DateTime)
+
+
+@pytest.fixture
+def session():
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    ensure_archive_table(engine, Visit)
+    with Session(engine) as session:
+        session.add_all(Visit(name=f'Old {n}', created_at=datetime(2024, 1, n)) for n in range(1, 6))
+        session.add(Visit(name='Recent', created_at=datetime(2026, 1, 1)))
+        session.commit()
+        yield session
+
+
+def live_ids(session):
+    return session.scalars(select(Visit.id).order_by(Visit.id)).all()
+
+
+def archived_ids(session):
+    table = archive_table(Visit)
+    return session.scalars(select(table.c.id).order_by(table.c.id)).all()
+
+
+def test_moves_old_rows_and_keeps_their_ids(session):
+    assert archive_old(session, Visit, Visit.created_at, CUTOFF, chunk_size=2) == 5
+    assert archived_ids(session) == [1, 2, 3, 4, 5]
+    assert live_ids(session) == [6]
+
+
+def test_archived_ids_are_not_handed_out_again(session):
+    session.add(Visit(name='Old newest', created_at=datetime(2024, 2, 1)))
+    session.commit()
+    # Everything old is archived but the newest row, which is then deleted
+    archive_old(session, Visit, Visit.created_at, datetime(2027, 1, 1))
+    session.query(Visit).delete()
+    # A restart that forgets the sequence (MySQL before 8.0 recomputes it from the live rows)
+    session.execute(text('UPDATE sqlite_sequence SET seq = 0'))
+    session.commit()
+    ensure_archive_table(session.get_bind(), Visit)
+
+    session.add(Visit(name='After', created_at=datetime(2026, 2, 1)))
+    session.commit()
+    assert archived_ids(session) == [1, 2, 3, 4, 5, 6]
+    assert live_ids(session) == [7]
+
+
+def test_rows_whose_id_is_already_archived_stay_live(session):
+    session.execute(insert(archive_table(Visit)),
+                    [{'id': 2, 'name': 'Archived earlier', 'created_at': datetime(2023, 1, 1),
+                      'archived_at': datetime(2024, 6, 1)}])
+    session.commit()
+
+    assert archive_old(session, Visit, Visit.created_at, CUTOFF) == 4
+    assert live_ids(session) == [2, 6]
+    table = archive_table(Visit)
+    assert session.scalar(select(table.c.name).where(table.c.id == 2)) == 'Archived earlier'
@@ -0,0 +1,59 @@
+import pytest
+
+pytest.importorskip('starlette')
+pytest.importorskip('httpx')
+
+from starlette.testclient import TestClient  # noqa: E402
+
+
+@pytest.fixture(scope='module')
+def client(smart_search):
+    import asgi
+    # Entering the client runs the lifespan: setup, async engine, reconciler
+    with TestClient(asgi.app) as client:
+        yield client
+
+
+def test_add_and_list_visitors(client):
+    response = client.post('/api/visitors', json={
+        'name': 'Ada Lovelace', 'phone': '5550100', 'date': '2026-02-09', 'purpose': 'Meeting'})
+    assert response.status_code == 201
+    visitor_id = response.json()['visitor']['id']
+
+    listing = client.get('/api/visitors')
+    assert listing.status_code == 200
+    assert visitor_id in [visitor['id'] for visitor in listing.json()['visitors']]
+    assert 'ETag' in listing.headers
+    assert client.get('/api/visitors', headers={'If-None-Match': listing.headers['ETag']}).status_code == 304
+
+
+def test_rejects_an_incomplete_visitor(client):
+    response = client.post('/api/visitors', json={'name': 'No Phone'})
+    assert response.status_code == 400
+    assert 'error' in response.json()
+
+
+def test_metrics_and_excel_location(client):
+    assert client.get('/metrics').status_code == 200
+    location = client.get('/api/excel-location')
+    assert location.status_code == 200
+    assert location.json()['exists']
+
+
+def test_export_streams_csv(client):
+    response = client.get('/api/visitors/export?format=csv')
+    assert response.status_code == 200
+    # Excel needs the BOM to read the CSV as UTF-8
+    assert response.text.splitlines()[0].lstrip('\ufeff').startswith('ID,Name')
+
+
+def test_export_error_is_json(client, monkeypatch):
+    import asgi
+
+    def broken(*args, **kwargs):
+        raise RuntimeError('database is gone')
+
+    monkeypatch.setattr(asgi, 'export_body', broken)
+    response = client.get('/api/visitors/export?format=csv')
+    assert response.status_code == 500
+    assert response.json() == {'error': 'database is gone'}
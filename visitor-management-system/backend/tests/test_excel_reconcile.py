@@ -0,0 +1,115 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import Column, DateTime, Integer, String, Text, create_engine
+from sqlalchemy.orm import Session, declarative_base
+
+from excel_reconcile import lock_path, reconcile
+from excel_sink import ExcelSink, read_rows, write_workbook
+from file_lock import FileLock
+
+Base = declarative_base()
+
+
+class Visitor(Base):
+    __tablename__ = 'visitor'
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String(100), nullable=False)
+    phone = Column(String(20), nullable=False)
+    date = Column(String(20), nullable=False)
+    purpose = Column(String(200), nullable=False)
+    comments = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+@pytest.fixture
+def session():
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        session.add_all(Visitor(id=record_id, name=f'Visitor {record_id}', phone='5550100',
+                                date='2026-02-09', purpose='Meeting', created_at=datetime(2026, 2, 9))
+                        for record_id in range(1, 11))
+        session.commit()
+        yield session
+
+
+def log_rows(session):
+    """The workbook rows the DB should produce, in id order"""
+    return [[index, visitor.name, visitor.phone, visitor.date, visitor.purpose,
+             visitor.comments or '', visitor.id]
+            for index, visitor in enumerate(session.query(Visitor).order_by(Visitor.id), start=1)]
+
+
+def records(excel_path):
+    return [(row[0], row[1], row[-1]) for row in read_rows(excel_path)]
+
+
+def run(session, sink, excel_path, **kwargs):
+    return reconcile(session, Visitor, sink, excel_path, compact=True, chunk_size=4, **kwargs)
+
+
+def test_repairs_a_missing_and_a_stale_row(session, excel_path):
+    rows = log_rows(session)
+    stale = list(rows[5])
+    stale[1] = 'Old name'
+    write_workbook(excel_path, rows[:2] + rows[3:5] + [stale] + rows[6:])
+    sink = ExcelSink(compact_every=100, compact_after=0)
+
+    report = run(session, sink, excel_path, full=True)
+
+    assert report['appended'] == 2
+    assert report['removed'] == 1
+    assert sorted(record_id for _, _, record_id in records(excel_path)) == list(range(1, 11))
+    assert ('Visitor 6', 6) in [(name, record_id) for _, name, record_id in records(excel_path)]
+    assert [index for index, _, _ in records(excel_path)] == list(range(1, 11))
+
+    again = run(session, sink, excel_path, full=True)
+    assert again['chunks_differing'] == 0
+
+
+def test_tail_chunk_gets_only_the_missing_rows(session, excel_path):
+    write_workbook(excel_path, log_rows(session))
+    sink = ExcelSink(compact_every=100, compact_after=0)
+    run(session, sink, excel_path)
+
+    # Two check-ins whose export failed, in the chunk past the watermark
+    session.add_all([Visitor(id=11, name='Visitor 11', phone='5550100', date='2026-02-10', purpose='Meeting'),
+                     Visitor(id=12, name='Visitor 12', phone='5550100', date='2026-02-10', purpose='Meeting')])
+    session.commit()
+    report = run(session, sink, excel_path)
+
+    assert report['appended'] == 2
+    assert report['removed'] == 0
+    # Rows already in the log keep their place and ID
+    assert [(index, record_id) for index, _, record_id in records(excel_path)] == \
+        [(record_id, record_id) for record_id in range(1, 13)]
+
+
+def test_stale_row_in_the_tail_chunk_is_compared(session, excel_path):
+    rows = log_rows(session)
+    write_workbook(excel_path, rows)
+    sink = ExcelSink(compact_every=100, compact_after=0)
+    run(session, sink, excel_path)
+
+    session.get(Visitor, 9).name = 'New name'
+    session.add(Visitor(id=11, name='Visitor 11', phone='5550100', date='2026-02-10', purpose='Meeting'))
+    session.commit()
+    report = run(session, sink, excel_path, full=True)
+
+    assert report['removed'] == 1
+    assert report['appended'] == 2
+    assert sorted(record_id for _, _, record_id in records(excel_path)) == list(range(1, 12))
+    assert ('New name', 9) in [(name, record_id) for _, name, record_id in records(excel_path)]
+
+
+def test_skips_while_another_process_reconciles(session, excel_path):
+    write_workbook(excel_path, log_rows(session))
+    holder = FileLock(lock_path(excel_path))
+    assert holder.try_acquire()
+    try:
+        report = run(session, ExcelSink(), excel_path)
+    finally:
+        holder.release()
+    assert report['skipped'] == 'another process is reconciling this log'
@@ -0,0 +1,102 @@
+import json
+
+from excel_sink import ExcelSink, journal_path, read_rows, workbook_record_ids, write_workbook
+from file_lock import FileLock
+
+
+def visitor(record_id):
+    return [f'Visitor {record_id}', '5550100', '2026-02-09', 'Meeting', '', record_id]
+
+
+def ids_and_records(excel_path):
+    return [(row[0], row[-1]) for row in read_rows(excel_path)]
+
+
+def test_append_journals_rows_without_touching_the_workbook(excel_path):
+    write_workbook(excel_path, [])
+    sink = ExcelSink(compact_every=100, compact_after=0)
+
+    assert sink.append(excel_path, [visitor(10), visitor(11)]) == [1, 2]
+    assert sink.append(excel_path, [visitor(12)]) == [3]
+
+    assert sink.pending(excel_path) == 3
+    assert sink.workbook_rows(excel_path) == 0
+    with open(journal_path(excel_path), encoding='utf-8') as journal:
+        lines = [json.loads(line) for line in journal]
+    assert 'started' in lines[0]
+    assert [line[0] for line in lines[1:]] == [1, 2, 3]
+
+
+def test_compact_drops_tombstoned_rows_and_renumbers(excel_path):
+    write_workbook(excel_path, [[1] + visitor(10), [2] + visitor(11)])
+    sink = ExcelSink(compact_every=100, compact_after=0)
+    sink.append(excel_path, [visitor(12), visitor(13)])
+
+    # One id in the workbook, one still in the journal, one never logged
+    sink.delete(excel_path, [11, 12, 99])
+    assert sink.compact(excel_path) == 4
+
+    assert ids_and_records(excel_path) == [(1, 10), (2, 13)]
+    assert sink.pending(excel_path) == 0
+    assert sink.workbook_rows(excel_path) == 2
+    assert 13 in workbook_record_ids(excel_path) and 11 not in workbook_record_ids(excel_path)
+    # IDs given out after the delete follow on from the renumbered rows
+    assert sink.append(excel_path, [visitor(14)]) == [3]
+
+
+def test_ids_given_before_compaction_match_the_compacted_workbook(excel_path):
+    write_workbook(excel_path, [[1] + visitor(10), [2] + visitor(11), [3] + visitor(12)])
+    sink = ExcelSink(compact_every=100, compact_after=0)
+    sink.delete(excel_path, [11])
+    ids = sink.append(excel_path, [visitor(13), visitor(14)])
+    sink.compact(excel_path)
+
+    assert ids == [3, 4]
+    assert ids_and_records(excel_path) == [(1, 10), (2, 12), (3, 13), (4, 14)]
+
+
+def test_compaction_by_count(excel_path):
+    write_workbook(excel_path, [])
+    sink = ExcelSink(compact_every=3, compact_after=0)
+    sink.append(excel_path, [visitor(1), visitor(2)])
+    assert sink.pending(excel_path) == 2
+
+    sink.append(excel_path, [visitor(3)])
+    assert sink.pending(excel_path) == 0
+    assert ids_and_records(excel_path) == [(1, 1), (2, 2), (3, 3)]
+
+
+def test_two_sinks_share_one_log(excel_path):
+    """Two workers (one sink each) keep IDs consecutive and see each other's writes"""
+    write_workbook(excel_path, [])
+    first = ExcelSink(compact_every=100, compact_after=0)
+    second = ExcelSink(compact_every=100, compact_after=0)
+
+    assert first.append(excel_path, [visitor(1), visitor(2)]) == [1, 2]
+    assert second.append(excel_path, [visitor(3)]) == [3]
+    assert first.append(excel_path, [visitor(4)]) == [4]
+    assert second.pending(excel_path) == 4
+
+    first.delete(excel_path, [2])
+    assert second.append(excel_path, [visitor(5)]) == [4]
+
+    second.compact(excel_path)
+    assert first.pending(excel_path) == 0
+    assert first.workbook_rows(excel_path) == 4
+    assert ids_and_records(excel_path) == [(1, 1), (2, 3), (3, 4), (4, 5)]
+    assert first.append(excel_path, [visitor(6)]) == [5]
+
+
+def test_counts_do_not_wait_for_the_file_lock(excel_path, tmp_path):
+    write_workbook(excel_path, [])
+    sink = ExcelSink(compact_every=100, compact_after=0)
+    sink.append(excel_path, [visitor(1)])
+
+    with sink.exclusive(excel_path):
+        # Another worker compacting or rebuilding holds the same lock file
+        other = FileLock(sink.exclusive(excel_path).path)
+        assert not other.try_acquire()
+        assert sink.pending(excel_path) == 1
+        assert sink.workbook_rows(excel_path) == 0
+    assert other.try_acquire()
+    other.release()
@@ -0,0 +1,43 @@
+import pytest
+
+
+@pytest.fixture
+def client(kiosk):
+    return kiosk.app.test_client()
+
+
+@pytest.fixture
+def events(kiosk, monkeypatch):
+    """(kind, payload) of every event the kiosk publishes during a test"""
+    published = []
+    monkeypatch.setattr(kiosk.visitor_feed, 'publish',
+                        lambda version, kind, payload: published.append((kind, payload)))
+    return published
+
+
+def check_in(client, name):
+    response = client.post('/add_visitor', json={'name': name, 'phone': '5550100', 'purpose': 'Meeting'})
+    assert response.status_code == 201
+    return response.get_json()['client_id']
+
+
+def visitor_id(kiosk, client_id):
+    with kiosk.app.app_context():
+        return kiosk.db.session.scalar(kiosk.db.select(kiosk.Visitor.id)
+                                       .where(kiosk.Visitor.client_id == client_id))
+
+
+def test_single_and_bulk_checkout_publish_the_same_shape(kiosk, client, events):
+    first = visitor_id(kiosk, check_in(client, 'Single'))
+    second = visitor_id(kiosk, check_in(client, 'Bulk one'))
+    third = visitor_id(kiosk, check_in(client, 'Bulk two'))
+
+    assert client.put(f'/checkout/{first}').status_code == 200
+    assert client.put('/checkout/bulk', json={'ids': [second, third]}).status_code == 200
+
+    checkouts = [payload for kind, payload in events if kind == 'checkout']
+    assert len(checkouts) == 2
+    assert [visit['id'] for visit in checkouts[0]['visitors']] == [first]
+    assert sorted(visit['id'] for visit in checkouts[1]['visitors']) == [second, third]
+    assert all(set(visit) == {'id', 'check_out'}
+               for payload in checkouts for visit in payload['visitors'])
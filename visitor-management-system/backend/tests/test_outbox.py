@@ -0,0 +1,89 @@
+import uuid
+
+import pytest
+
+import outbox as outbox_module
+from outbox import CHECKIN, Outbox
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(outbox_module, 'OUTBOX_BACKOFF_BASE', 0)
+    monkeypatch.setattr(outbox_module, 'OUTBOX_MAX_ATTEMPTS', 2)
+
+
+def checkin(name):
+    client_id = str(uuid.uuid4())
+    return client_id, {'client_id': client_id, 'name': name, 'phone': '5550100', 'purpose': 'Meeting'}
+
+
+def visits_for(kiosk, client_id):
+    with kiosk.app.app_context():
+        return kiosk.db.session.scalar(kiosk.db.select(kiosk.db.func.count())
+                                       .where(kiosk.Visitor.client_id == client_id))
+
+
+def test_a_replayed_check_in_is_recorded_once(kiosk, tmp_path):
+    box = Outbox(str(tmp_path / 'outbox.db'), kiosk.sync_outbox)
+    client_id, payload = checkin('Replayed')
+
+    assert box.add(CHECKIN, client_id, payload)
+    # The kiosk retries the request before it heard back
+    assert not box.add(CHECKIN, client_id, payload)
+    entries = box.claim(10)
+    assert len(entries) == 1
+
+    # Applied, then applied again as after a crash before done()
+    with kiosk.app.app_context():
+        kiosk.sync_outbox(entries)
+        kiosk.sync_outbox(entries)
+    box.release(entries)
+    assert box.drain_once(kiosk.app) == 1
+
+    assert visits_for(kiosk, client_id) == 1
+    assert box.stats()['backlog'] == 0
+
+
+def test_an_entry_rejected_for_its_data_is_set_aside(kiosk, tmp_path):
+    applied = []
+
+    def apply(entries):
+        if any(entry.payload['name'] == 'Bad' for entry in entries):
+            raise ValueError('bad visitor')
+        applied.extend(entry.payload['name'] for entry in entries)
+
+    box = Outbox(str(tmp_path / 'outbox.db'), apply)
+    for name in ('First', 'Bad', 'Last'):
+        box.add(CHECKIN, *checkin(name))
+
+    # The batch fails as a whole, then goes one entry at a time
+    assert box.drain_once(kiosk.app) == 0
+    assert box.drain_once(kiosk.app) == 1
+    for _ in range(5):
+        box.drain_once(kiosk.app)
+
+    stats = box.stats()
+    assert applied == ['First', 'Last']
+    assert stats['dead'] == 1
+    assert stats['backlog'] == 0
+    assert stats['last_error'] == 'ValueError: bad visitor'
+
+
+def test_a_connection_failure_is_retried_not_set_aside(kiosk, tmp_path):
+    failures = []
+
+    def apply(entries):
+        if len(failures) < 3:
+            failures.append(entries)
+            raise ConnectionError('server has gone away')
+
+    box = Outbox(str(tmp_path / 'outbox.db'), apply)
+    box.add(CHECKIN, *checkin('Patient'))
+
+    for _ in range(3):
+        assert box.drain_once(kiosk.app) == 0
+    assert box.stats()['dead'] == 0
+    assert box.stats()['backlog'] == 1
+
+    assert box.drain_once(kiosk.app) == 1
+    assert box.stats()['backlog'] == 0
@@ -0,0 +1,67 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import Column, DateTime, Integer, String, create_engine
+from sqlalchemy.orm import Session, declarative_base
+
+from pagination import PaginationError, decode_cursor, encode_cursor, fetch_page
+
+Base = declarative_base()
+
+
+class Visit(Base):
+    __tablename__ = 'pagination_test_visit'
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String(100))
+    created_at = Column(DateTime)
+
+
+@pytest.fixture
+def session():
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+
+
+def add(session, *created):
+    session.add_all(Visit(id=record_id, name=f'Visitor {record_id}', created_at=moment)
+                    for record_id, moment in enumerate(created, start=1))
+    session.commit()
+
+
+def walk(session, limit):
+    """Ids of every page in order, following the cursors"""
+    ids, cursor = [], None
+    while True:
+        rows, cursor = fetch_page(session, Visit, 'created_at', ['id'], limit, cursor)
+        ids.extend(row[0] for row in rows.rows)
+        if cursor is None:
+            return ids
+
+
+def test_cursor_round_trip():
+    moment = datetime(2026, 2, 9, 14, 30, 5)
+    assert decode_cursor(encode_cursor(moment, 42)) == (moment, 42)
+    assert decode_cursor(encode_cursor(None, 7)) == (None, 7)
+
+
+def test_bad_cursor():
+    with pytest.raises(PaginationError):
+        decode_cursor('not-a-cursor')
+
+
+def test_pages_are_newest_first_and_ties_break_on_id(session):
+    same = datetime(2026, 2, 9, 9, 0)
+    add(session, datetime(2026, 2, 8), same, same, same, datetime(2026, 2, 10))
+
+    assert walk(session, limit=2) == [5, 4, 3, 2, 1]
+    assert walk(session, limit=1) == [5, 4, 3, 2, 1]
+
+
+def test_rows_without_a_timestamp_come_last(session):
+    add(session, datetime(2026, 2, 8), None, datetime(2026, 2, 9), None, None)
+
+    assert walk(session, limit=2) == [3, 1, 5, 4, 2]
+    assert walk(session, limit=1) == [3, 1, 5, 4, 2]
@@ -0,0 +1,75 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import Column, DateTime, Integer, String, Text, create_engine
+from sqlalchemy.orm import Session, declarative_base
+
+from search import ensure_sqlite_search_index, search_sqlite
+
+Base = declarative_base()
+
+TABLE = 'search_test_visitor'
+
+
+class Visitor(Base):
+    __tablename__ = TABLE
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String(100), nullable=False)
+    phone = Column(String(20), nullable=False)
+    purpose = Column(String(200), nullable=False)
+    comments = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+@pytest.fixture
+def session(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'search.db'}")
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        # Indexed by the 'rebuild' when the index is first made
+        session.add(Visitor(name='Priya Sharma', phone='9876543210', purpose='Interview'))
+        session.commit()
+        if not ensure_sqlite_search_index(engine, TABLE):
+            pytest.skip('SQLite built without FTS5')
+        yield session
+
+
+def search(session, q=None, phone=None, phone_match='prefix'):
+    ids, _ = search_sqlite(session, TABLE, q, phone, phone_match, limit=20, offset=0)
+    return ids
+
+
+def test_existing_rows_are_indexed(session):
+    assert search(session, 'priya') == [1]
+    assert search(session, phone='3210', phone_match='suffix') == [1]
+
+
+def test_insert_is_searchable(session):
+    session.add(Visitor(name='Rahul Iyer', phone='9123456789', purpose='Delivery',
+                        comments='Brought laptop'))
+    session.commit()
+
+    assert search(session, 'rah') == [2]
+    assert search(session, 'laptop') == [2]
+    assert search(session, phone='4567', phone_match='contains') == [2]
+
+
+def test_update_replaces_the_indexed_text(session):
+    visitor = session.get(Visitor, 1)
+    visitor.name = 'Priya Nair'
+    visitor.phone = '9000011111'
+    session.commit()
+
+    assert search(session, 'nair') == [1]
+    assert search(session, 'sharma') == []
+    assert search(session, phone='3210', phone_match='suffix') == []
+    assert search(session, phone='1111', phone_match='suffix') == [1]
+
+
+def test_delete_removes_from_the_index(session):
+    session.delete(session.get(Visitor, 1))
+    session.commit()
+
+    assert search(session, 'priya') == []
+    assert search(session, phone='3210', phone_match='suffix') == []
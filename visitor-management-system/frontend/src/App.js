@@ -15,22 +15,107 @@ function App() {
   });
   
   const [visitors, setVisitors] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
   const [showSuccess, setShowSuccess] = useState(false);
   const [loading, setLoading] = useState(false);
+  // Returning-visitor typeahead under the name or phone field
+  const [suggestions, setSuggestions] = useState([]);
+  const [suggestFor, setSuggestFor] = useState(null); // 'name', 'phone' or null
 
   const API_URL = 'http://localhost:5000/api';
+  // Wait before reopening a live-update stream the server turned away
+  const STREAM_RETRY_MS = 30000;
 
   useEffect(() => {
-    if (currentPage === 'records') {
-      fetchVisitors();
+    if (currentPage !== 'records') {
+      return undefined;
     }
+    // Live updates: small deltas instead of reloading the whole list. The
+    // stream's first 'ready' event loads the list, so there is no fetch here.
+    // The browser reconnects by itself and resumes from the last event id.
+    let events = null;
+    let retryTimer = null;
+    const onInsert = (e) => {
+      const { visitors: added } = JSON.parse(e.data);
+      setVisitors((prev) => {
+        const known = new Set(prev.map((v) => v.id));
+        return [...added.filter((v) => !known.has(v.id)), ...prev];
+      });
+    };
+    const onDelete = (e) => {
+      const ids = new Set(JSON.parse(e.data).ids);
+      setVisitors((prev) => prev.filter((v) => !ids.has(v.id)));
+    };
+    const onCheckout = (e) => {
+      // {visitors: [{id, check_out}, ...]}, one or many visits
+      const closed = new Map(JSON.parse(e.data).visitors.map((v) => [v.id, v.check_out]));
+      setVisitors((prev) => prev.map((v) => (
+        closed.has(v.id) ? { ...v, check_out: closed.get(v.id) } : v
+      )));
+    };
+    // ready: (re)connected without a resume point; reset: missed changes
+    const onReload = () => fetchVisitors();
+
+    const connect = () => {
+      events = new EventSource(`${API_URL}/visitors/stream`);
+      events.addEventListener('insert', onInsert);
+      events.addEventListener('delete', onDelete);
+      events.addEventListener('checkout', onCheckout);
+      events.addEventListener('ready', onReload);
+      events.addEventListener('reset', onReload);
+      // The browser gives up on a refused stream (503 when the server has
+      // too many open): show the list without live updates, retry later
+      events.onerror = () => {
+        if (events.readyState === EventSource.CLOSED) {
+          fetchVisitors();
+          retryTimer = setTimeout(connect, STREAM_RETRY_MS);
+        }
+      };
+    };
+    connect();
+    return () => {
+      clearTimeout(retryTimer);
+      events.close();
+    };
   }, [currentPage]);
 
-  const fetchVisitors = async () => {
+  useEffect(() => {
+    const q = suggestFor ? formData[suggestFor].trim() : '';
+    if (q.length < 2) {
+      setSuggestions([]);
+      return undefined;
+    }
+    // Wait for a pause in typing; a newer keystroke cancels this lookup
+    const controller = new AbortController();
+    const timer = setTimeout(async () => {
+      try {
+        const response = await fetch(
+          `${API_URL}/visitors/suggest?q=${encodeURIComponent(q)}`,
+          { signal: controller.signal }
+        );
+        if (response.ok) {
+          setSuggestions((await response.json()).suggestions);
+        }
+      } catch (error) {
+        if (error.name !== 'AbortError') {
+          console.error('Error fetching suggestions:', error);
+        }
+      }
+    }, 120);
+    return () => {
+      clearTimeout(timer);
+      controller.abort();
+    };
+  }, [suggestFor, formData.name, formData.phone]);
+
+  // Loads the first page, or the next one when a cursor is passed
+  const fetchVisitors = async (cursor = null) => {
     try {
-      const response = await fetch(`${API_URL}/visitors`);
+      const query = cursor ? `?cursor=${encodeURIComponent(cursor)}` : '';
+      const response = await fetch(`${API_URL}/visitors${query}`);
       const data = await response.json();
-      setVisitors(data);
+      setVisitors(cursor ? (prev) => [...prev, ...data.visitors] : data.visitors);
+      setNextCursor(data.next_cursor);
     } catch (error) {
       console.error('Error fetching visitors:', error);
     }
@@ -41,8 +126,46 @@ function App() {
       ...formData,
       [e.target.name]: e.target.value
     });
+    if (e.target.name === 'name' || e.target.name === 'phone') {
+      setSuggestFor(e.target.name);
+    }
   };
 
+  // Fill the form with a returning visitor's last details
+  const pickSuggestion = (visitor) => {
+    setFormData({
+      ...formData,
+      name: visitor.name,
+      phone: visitor.phone,
+      purpose: visitor.purpose,
+      comments: visitor.comments
+    });
+    setSuggestFor(null);
+  };
+
+  const renderSuggestions = (field) => (
+    suggestFor === field && suggestions.length > 0 && (
+      <ul className="suggestions">
+        {suggestions.map((visitor) => (
+          <li
+            key={visitor.id}
+            // mousedown fires before the input's blur closes the list
+            onMouseDown={(e) => {
+              e.preventDefault();
+              pickSuggestion(visitor);
+            }}
+          >
+            <span className="suggestion-name">{visitor.name}</span>
+            <span className="suggestion-phone">{visitor.phone}</span>
+            <span className="suggestion-meta">
+              {visitor.purpose} · last visit {visitor.last_visit.slice(0, 10)}
+            </span>
+          </li>
+        ))}
+      </ul>
+    )
+  );
+
   const handleSubmit = async (e) => {
     e.preventDefault();
     setLoading(true);
@@ -58,6 +181,7 @@ function App() {
 
       if (response.ok) {
         setShowSuccess(true);
+        setSuggestFor(null);
         setFormData({
           name: '',
           phone: '',
@@ -81,10 +205,13 @@ function App() {
   const handleDelete = async (id) => {
     if (window.confirm('Are you sure you want to delete this visitor record?')) {
       try {
-        await fetch(`${API_URL}/visitors/${id}`, {
+        const response = await fetch(`${API_URL}/visitors/${id}`, {
           method: 'DELETE'
         });
-        fetchVisitors();
+        // The stream sends the delete too; removing it here is just quicker
+        if (response.ok) {
+          setVisitors((prev) => prev.filter((v) => v.id !== id));
+        }
       } catch (error) {
         console.error('Error deleting visitor:', error);
       }
@@ -150,9 +277,12 @@ function App() {
                     name="name"
                     value={formData.name}
                     onChange={handleChange}
+                    onBlur={() => setSuggestFor(null)}
+                    autoComplete="off"
                     required
                     placeholder="Enter full name"
                   />
+                  {renderSuggestions('name')}
                 </div>
 
                 <div className="form-group">
@@ -166,9 +296,12 @@ function App() {
                     name="phone"
                     value={formData.phone}
                     onChange={handleChange}
+                    onBlur={() => setSuggestFor(null)}
+                    autoComplete="off"
                     required
                     placeholder="Phone Number"
                   />
+                  {renderSuggestions('phone')}
                 </div>
 
                 <div className="form-group">
@@ -282,7 +415,9 @@ function App() {
               <div className="section-header">
                 <h2>Visitor Records</h2>
                 <div className="header-line"></div>
-                <div className="record-count">{visitors.length} Total Records</div>
+                <div className="record-count">
+                  {visitors.length}{nextCursor ? '+' : ''} Total Records
+                </div>
               </div>
 
               <div className="records-container">
@@ -344,6 +479,14 @@ function App() {
                         </div>
                       </div>
                     ))}
+                    {nextCursor && (
+                      <button
+                        className="nav-btn load-more-btn"
+                        onClick={() => fetchVisitors(nextCursor)}
+                      >
+                        Load More
+                      </button>
+                    )}
                   </div>
                 )}
               </div>